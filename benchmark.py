@@ -0,0 +1,325 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Замеры идут без экрана; переменная задается до импорта Qt
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication, QMessageBox
+
+import ui
+from datagen import BENCH_DBNAME, START_DATE, MONTHS, TABLES
+from journeys import Timetable
+from reports import render_report_file
+
+# Сколько страниц прокрутки читается после первой
+SCROLL_PAGES = 10
+# Сортировки по началу ключа строки сверх сортировки первого столбца по убыванию: они читаются
+# страницами по индексу, и откат к сортировке всего представления виден как регрессия
+SORT_CASES = {
+    "route_stops": (("route_code", False),),
+    "brigade_routes": (("route_code", False),),
+}
+# Поисковые запросы: по тексту (триграммный индекс) и по числу
+SEARCH_TERMS = ("Вокзал 1", "Поезд 12", "Иванов", "42")
+# Сколько значений группы (вокзалов) передается в пакетный отчет
+BATCH_GROUPS = 5
+# Сколько пар вокзалов (первые и последние по коду) ищется в расписании
+JOURNEY_PAIRS = 5
+# Отношение времени к прошлому прогону, выше которого замер считается регрессией
+REGRESSION_RATIO = 1.2
+# Разница меньше этой считается шумом, даже если отношение велико (замеры в миллисекунды), секунды
+REGRESSION_MIN_SECONDS = 0.005
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    # Замеры на живом окне приложения: фоновые задачи ждутся в цикле событий Qt,
+    # поэтому время включает и запрос, и передачу строк в модель
+    def __init__(self, window, repeat):
+        self.window = window
+        self.repeat = repeat
+        self.results = {}
+        self.errors = []
+
+    def wait(self):
+        while self.window.executor.is_busy():
+            QApplication.processEvents()
+            time.sleep(0.001)
+        QApplication.processEvents()
+
+    def measure(self, name, action, prepare=None):
+        # action возвращает число строк; ошибка окна (QMessageBox) прерывает замер
+        runs = []
+        rows = None
+        for _ in range(self.repeat):
+            if prepare is not None:
+                prepare()
+                self.wait()
+            errors = len(self.errors)
+            started = time.perf_counter()
+            rows = action()
+            self.wait()
+            runs.append(time.perf_counter() - started)
+            if len(self.errors) > errors:
+                print(f"{name}: ошибка {self.errors[-1]}")
+                return
+        self.results[name] = {
+            "runs": [round(seconds, 4) for seconds in runs],
+            "min": round(min(runs), 4),
+            "median": round(statistics.median(runs), 4),
+            "max": round(max(runs), 4),
+            "rows": rows,
+        }
+        print(f"{name}: {statistics.median(runs):.4f} с, строк {rows}")
+
+    def open_table(self, table):
+        # Снимки сбрасываются: замеряется загрузка с сервера, а не показ из кэша
+        window = self.window
+        window.snapshot_cache.clear()
+        window.search_field.blockSignals(True)
+        window.search_field.clear()
+        window.search_field.blockSignals(False)
+        window.current_table = None
+        window.table_selector.blockSignals(True)
+        window.table_selector.setCurrentText(table)
+        window.table_selector.blockSignals(False)
+        window.load_table_data()
+        self.wait()
+        return window.table_model.rowCount()
+
+    def scroll(self):
+        model = self.window.table_model
+        for _ in range(SCROLL_PAGES):
+            if not model.canFetchMore():
+                break
+            # Страница читается в фоне: ждем ее, как пользователь при прокрутке
+            model.fetchMore()
+            self.wait()
+        return model.rowCount()
+
+    def search(self, term):
+        self.window.search_field.blockSignals(True)
+        self.window.search_field.setText(term)
+        self.window.search_field.blockSignals(False)
+        self.window.search_records()
+        self.wait()
+        return self.window.table_model.rowCount()
+
+    def sort(self, column, descending):
+        self.window.sort_order = [(column, descending)]
+        self.window.table_model.set_sort_columns(self.window.sort_order)
+        self.window.search_records()
+        self.wait()
+        return self.window.table_model.rowCount()
+
+    def run_tables(self):
+        window = self.window
+        for table in window.metadata:
+            self.measure(f"load_table_data:{table}", lambda: self.open_table(table))
+            self.open_table(table)
+            rows, columns = list(window.table_model.rows()), list(window.table_model.column_names())
+
+            # Только передача уже прочитанной страницы в модель и представление
+            def load_rows():
+                window.load_rows(rows, columns)
+                return len(rows)
+
+            self.measure(f"load_rows:{table}", load_rows)
+            self.measure(f"scroll:{table}", self.scroll, prepare=lambda: self.open_table(table))
+            if columns:
+                self.measure(f"sort:{table}:{columns[0]}:desc", lambda: self.sort(columns[0], True),
+                             prepare=lambda: self.open_table(table))
+            for column, descending in SORT_CASES.get(table, ()):
+                self.measure(f"sort:{table}:{column}:{'desc' if descending else 'asc'}",
+                             lambda: self.sort(column, descending), prepare=lambda: self.open_table(table))
+            for term in SEARCH_TERMS:
+                self.measure(f"search_records:{table}:{term}", lambda: self.search(term),
+                             prepare=lambda: self.open_table(table))
+        self.open_table(next(iter(window.metadata)))
+
+    def report_values(self, report, batch=False):
+        # Период - весь сгенерированный год, вокзал - первый по имени
+        start = datetime.datetime.fromisoformat(START_DATE)
+        values = {}
+        for param in report["params"]:
+            if param["type"] == "datetime":
+                values[param["name"]] = start if param["name"] == "start_date" else \
+                    start + datetime.timedelta(days=MONTHS * 31)
+            elif param["type"] == "integer":
+                values[param["name"]] = param.get("default", param.get("min", 0))
+            elif param["type"] == "order":
+                values[param["name"]] = param["options"][0][0]
+            else:
+                names = self.source_values(param, BATCH_GROUPS if batch else 1)
+                values[param["name"]] = names if batch else names[0]
+        return values
+
+    def source_values(self, param, count):
+        with self.window.db.session(readonly=True) as connection, connection.cursor() as cursor:
+            cursor.execute(f"SELECT {param['source_column']} FROM {param['source_table']}"
+                           f" ORDER BY {param['source_column']} LIMIT %s", (count,))
+            return [row[0] for row in cursor.fetchall()] or [""]
+
+    def run_reports(self, directory):
+        engine = self.window.report_engine
+        db = self.window.db
+        for name, report in engine.reports.items():
+            values = self.report_values(report)
+            query, params = engine.build_query(name, values)
+            fetched = []
+
+            def run_query():
+                with db.session(readonly=True) as connection, connection.cursor() as cursor:
+                    cursor.execute(query, params)
+                    fetched[:] = cursor.fetchall()
+                return len(fetched)
+
+            def run_render():
+                with db.session(readonly=True) as connection:
+                    return engine.render(connection, name, values, os.path.join(directory, report["file_name"]))
+
+            self.measure(f"report_query:{name}", run_query)
+            self.measure(f"report_pdf:{name}", lambda: render_report_file(
+                report["title"], report["columns"], fetched, os.path.join(directory, f"pdf_{report['file_name']}")))
+            self.measure(f"report_render:{name}", run_render)
+
+            if "batch" in report:
+                batch_values = self.report_values(report, batch=True)
+
+                def run_batch():
+                    with db.session(readonly=True) as connection:
+                        results = engine.render_batch(connection, name, batch_values,
+                                                      os.path.join(directory, f"batch_{name}"), processes=1)
+                    return sum(rows for _, _, rows in results)
+
+                self.measure(f"report_batch:{name}", run_batch)
+
+    def run_journeys(self):
+        # Загрузка расписания (как при первом поиске поездки) и поиск по нему в середине периода
+        timetable = Timetable()
+
+        def load():
+            with self.window.db.session(readonly=True) as connection:
+                timetable.load(connection)
+            return timetable.connection_count()
+
+        self.measure("timetable_load", load)
+        stations = sorted(timetable.station_names)
+        after = datetime.datetime.fromisoformat(START_DATE) + datetime.timedelta(days=MONTHS * 15)
+        for origin, target in zip(stations[:JOURNEY_PAIRS], reversed(stations[-JOURNEY_PAIRS:])):
+            self.measure(f"journey:{origin}:{target}",
+                         lambda: len(timetable.earliest_arrival(origin, target, after) or []))
+
+    def dataset(self):
+        with self.window.db.session(readonly=True) as connection, connection.cursor() as cursor:
+            counts = {}
+            for table in TABLES:
+                cursor.execute(f"SELECT count(*) FROM {table}")
+                counts[table] = cursor.fetchone()[0]
+            cursor.execute("SHOW server_version")
+            return counts, cursor.fetchone()[0]
+
+
+def compare(results, previous_path):
+    # Медианы сравниваются с прошлым прогоном; возвращает число регрессий
+    with open(previous_path, "r", encoding="utf-8") as file:
+        previous = json.load(file)["benchmarks"]
+    regressions = 0
+    print(f"\nСравнение с {previous_path}:")
+    for name, result in results.items():
+        if name not in previous or not previous[name]["median"]:
+            continue
+        ratio = result["median"] / previous[name]["median"]
+        mark = ""
+        if ratio > REGRESSION_RATIO and result["median"] - previous[name]["median"] > REGRESSION_MIN_SECONDS:
+            mark = "  <-- медленнее"
+            regressions += 1
+        print(f"{name}: {previous[name]['median']:.4f} -> {result['median']:.4f} с (x{ratio:.2f}){mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности приложения вокзала")
+    parser.add_argument("--dbname", default=BENCH_DBNAME)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="файл результатов JSON (по умолчанию benchmark_<коммит>.json)")
+    parser.add_argument("--compare", help="результаты прошлого прогона для сравнения")
+    parser.add_argument("--skip-reports", action="store_true")
+    args = parser.parse_args()
+
+    # Метаданные и шрифты читаются по относительным путям; пути из аргументов и файл результатов
+    # отсчитываются от каталога запуска
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    ui.DB_PARAMS["db_name"] = args.dbname
+    # Журнал медленных запросов замеров не смешивается с рабочим
+    ui.SLOW_QUERY_LOG = None
+
+    app = QApplication([])
+    benchmark = None
+
+    def record_error(parent, title, text, *rest, **kwargs):
+        benchmark.errors.append(f"{title}: {text}")
+        return QMessageBox.StandardButton.Ok
+
+    QMessageBox.critical = record_error
+    QMessageBox.warning = record_error
+
+    started = time.perf_counter()
+    window = ui.App()
+    benchmark = Benchmark(window, args.repeat)
+    benchmark.wait()
+    startup = time.perf_counter() - started
+    if window.db is None or benchmark.errors:
+        print("\n".join(benchmark.errors) or "Нет подключения к базе данных")
+        return 1
+    benchmark.results["startup"] = {"runs": [round(startup, 4)], "min": round(startup, 4),
+                                    "median": round(startup, 4), "max": round(startup, 4), "rows": None}
+
+    counts, server_version = benchmark.dataset()
+    benchmark.run_tables()
+    benchmark.run_journeys()
+    if not args.skip_reports:
+        with tempfile.TemporaryDirectory() as directory:
+            benchmark.run_reports(directory)
+    window.close()
+    app.processEvents()
+
+    commit = git_commit()
+    output = os.path.join(cwd, args.output or f"benchmark_{commit or 'unknown'}.json")
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "commit": commit,
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "server_version": server_version,
+            "database": args.dbname,
+            "repeat": args.repeat,
+            "dataset": counts,
+            "errors": benchmark.errors,
+            "benchmarks": benchmark.results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {output}")
+
+    if args.compare and compare(benchmark.results, os.path.join(cwd, args.compare)):
+        return 2
+    return 1 if benchmark.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
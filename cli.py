@@ -0,0 +1,293 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import psycopg2
+
+from db import DB_PARAMS, DatabaseManager, sorted_query
+from exporter import EXPORT_FORMATS, available_formats, export_query
+from search import SearchEngine, select_query
+
+# Командная строка для отчетов, выгрузок и поиска поездок без окна (например, из cron).
+# PyQt6 не импортируется, а построитель PDF загружается только для отчетов, поэтому процесс
+# стартует быстро и несколько экземпляров можно запускать параллельно
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TABLE_METADATA = os.path.join(BASE_DIR, "table_metadata.json")
+REPORT_METADATA = os.path.join(BASE_DIR, "report_metadata.json")
+
+
+class UsageError(Exception):
+    pass
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def parse_assignments(pairs):
+    # "-p имя=значение"; повтор имени дает список (значения списка для пакета отчетов)
+    values = {}
+    for pair in pairs or []:
+        name, separator, value = pair.partition("=")
+        if not separator:
+            raise UsageError(f"Параметр должен иметь вид имя=значение: {pair}")
+        values.setdefault(name.strip(), []).append(value)
+    return values
+
+
+def report_values(connection, report, given, batch=False):
+    # Значения параметров в том виде, в каком их передает окно параметров отчета
+    unknown = set(given) - {param["name"] for param in report["params"]}
+    if unknown:
+        raise UsageError(f"Неизвестные параметры отчета: {', '.join(sorted(unknown))}")
+
+    values = {}
+    for param in report["params"]:
+        name, kind = param["name"], param["type"]
+        raw = given.get(name)
+        if kind == "dropdown" and batch:
+            # В пакете по умолчанию выбраны все значения списка, как в окне параметров
+            values[name] = raw or source_values(connection, param)
+            continue
+        if raw is not None and len(raw) > 1:
+            raise UsageError(f"Параметр {name} задан несколько раз")
+        value = raw[0] if raw else None
+
+        if kind == "datetime":
+            if value is None:
+                raise UsageError(f"Не задан параметр {name} (дата и время, например 2025-01-31 или 2025-01-31T12:00)")
+            try:
+                values[name] = datetime.datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                raise UsageError(f"Неверная дата в параметре {name}: {value}")
+        elif kind == "integer":
+            minimum, maximum = param.get("min", 0), param.get("max", 100)
+            if value is None:
+                values[name] = param.get("default", minimum)
+                continue
+            try:
+                number = int(value)
+            except ValueError:
+                raise UsageError(f"Параметр {name} должен быть целым числом: {value}")
+            if not minimum <= number <= maximum:
+                raise UsageError(f"Параметр {name} должен быть от {minimum} до {maximum}")
+            values[name] = number
+        elif kind == "order":
+            options = [label for label, _ in param["options"]]
+            if value is None:
+                values[name] = options[0]
+            elif value in options:
+                values[name] = value
+            else:
+                raise UsageError(f"Параметр {name}: допустимые значения - {', '.join(options)}")
+        else:
+            if value is None:
+                raise UsageError(f"Не задан параметр {name}")
+            values[name] = value
+    return values
+
+
+def source_values(connection, param):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT {param['source_column']} FROM {param['source_table']}"
+                       f" ORDER BY {param['source_column']}")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def export_format_for(path, export_format):
+    # Формат задается явно или по расширению файла
+    formats = available_formats()
+    if export_format is None:
+        extension = os.path.splitext(path)[1].lower()
+        export_format = next((name for name, (suffix, _) in EXPORT_FORMATS.items() if suffix == extension), None)
+        if export_format is None:
+            raise UsageError(f"Не удалось определить формат по расширению файла {path}, укажите --format")
+    if export_format not in EXPORT_FORMATS:
+        raise UsageError(f"Неизвестный формат: {export_format}")
+    if export_format not in formats:
+        raise UsageError(f"Формат {export_format} недоступен: установите {EXPORT_FORMATS[export_format][1]}")
+    return export_format
+
+
+def parse_sort(items, column_names):
+    # "--sort столбец" или "--sort столбец:desc"; первый столбец - главный
+    sort_columns = []
+    for item in items or []:
+        column, _, direction = item.partition(":")
+        if column not in column_names:
+            raise UsageError(f"Нет столбца {column}")
+        if direction.lower() not in ("", "asc", "desc"):
+            raise UsageError(f"Направление сортировки должно быть asc или desc: {item}")
+        sort_columns.append((column, direction.lower() == "desc"))
+    return sort_columns
+
+
+def list_reports(args, db):
+    for name, report in load_json(REPORT_METADATA).items():
+        batch = " (есть пакет: --batch)" if "batch" in report else ""
+        print(f"{name}: {report['description']}{batch}")
+        for param in report["params"]:
+            details = param["type"]
+            if param["type"] == "order":
+                details += ": " + " | ".join(label for label, _ in param["options"])
+            elif param["type"] == "dropdown":
+                details += f": значения {param['source_table']}.{param['source_column']}"
+            elif param["type"] == "integer":
+                details += f" {param.get('min', 0)}..{param.get('max', 100)}"
+            print(f"  -p {param['name']}=...  {details}")
+    return 0
+
+
+def run_report(args, db):
+    # Построитель PDF (fpdf2, fontTools) нужен только здесь
+    from reports import ReportEngine, BATCH_INDEX_FILE
+
+    reports = load_json(REPORT_METADATA)
+    if args.name not in reports:
+        raise UsageError(f"Нет отчета {args.name}; список: reports")
+    report = reports[args.name]
+    if args.batch and "batch" not in report:
+        raise UsageError(f"У отчета {args.name} нет пакетного варианта")
+    engine = ReportEngine(reports)
+    given = parse_assignments(args.param)
+
+    with db.session(readonly=True) as connection:
+        values = report_values(connection, report, given, batch=bool(args.batch))
+        if args.batch:
+            results = engine.render_batch(connection, args.name, values, args.batch, processes=args.processes)
+            if not results:
+                print("Для заданного периода и фильтров данные отсутствуют.", file=sys.stderr)
+                return 0
+            print(f"Сформировано отчетов: {len(results)}, папка {args.batch}, список {BATCH_INDEX_FILE}")
+            return 0
+        output = args.output or report["file_name"]
+        row_count = engine.render(connection, args.name, values, output)
+    if not row_count:
+        print("Для заданного периода и фильтров данные отсутствуют.", file=sys.stderr)
+        return 0
+    print(f"Строк в отчете: {row_count}, файл {output}")
+    return 0
+
+
+def run_export(args, db):
+    metadata = load_json(TABLE_METADATA)
+    if args.table not in metadata:
+        raise UsageError(f"Нет таблицы {args.table}; доступны: {', '.join(metadata)}")
+    export_format = export_format_for(args.output, args.format)
+
+    with db.session(readonly=True) as connection:
+        with connection.cursor() as cursor:
+            # Тот же запрос, что выгружает окно: вся таблица или результат поиска, со всеми столбцами
+            if args.search:
+                query, params = SearchEngine(metadata).build_query(cursor, args.table, args.search, lazy=True)
+            else:
+                query, params = select_query(metadata, args.table, lazy=True), None
+            cursor.execute(f"SELECT * FROM ({query}) export_rows LIMIT 0", params)
+            column_names = [column[0] for column in cursor.description]
+        sort_columns = parse_sort(args.sort, column_names)
+        if sort_columns:
+            query = sorted_query(query, sort_columns)
+        row_count = export_query(connection, query, params, args.output, export_format)
+    print(f"Выгружено строк: {row_count}, файл {args.output}")
+    return 0
+
+
+def run_journey(args, db):
+    from journeys import MIN_TRANSFER_SECONDS, Timetable, route_trains
+
+    try:
+        after = datetime.datetime.fromisoformat(args.after) if args.after else datetime.datetime.now()
+    except ValueError:
+        raise UsageError(f"Неверная дата в --after: {args.after}")
+    if args.transfer is not None and args.transfer < 0:
+        raise UsageError("Время пересадки не может быть отрицательным")
+    min_transfer = MIN_TRANSFER_SECONDS if args.transfer is None else args.transfer * 60
+
+    # Расписание читается целиком: для одного запроса это основная часть времени
+    timetable = Timetable()
+    with db.session(readonly=True) as connection:
+        timetable.load(connection)
+        origin, target = timetable.station_code(args.origin), timetable.station_code(args.target)
+        for station, code in ((args.origin, origin), (args.target, target)):
+            if code is None:
+                raise UsageError(f"Нет вокзала {station}")
+        legs = timetable.earliest_arrival(origin, target, after, min_transfer)
+        if not legs:
+            print("Поездка не найдена." if legs is None else "Начальный и конечный вокзалы совпадают.",
+                  file=sys.stderr)
+            return 0
+        with connection.cursor() as cursor:
+            trains = route_trains(cursor, {leg.route_code for leg in legs})
+    for line in timetable.describe(legs, trains):
+        print(line)
+    print(f"Пересадок: {len(legs) - 1}, в пути {legs[-1].arrival - legs[0].departure}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Отчеты, выгрузки и поиск поездок по базе вокзала без графического интерфейса")
+    parser.add_argument("--dbname", default=DB_PARAMS["db_name"])
+    parser.add_argument("--user", default=DB_PARAMS["user"])
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", DB_PARAMS["password"]))
+    parser.add_argument("--host", default=DB_PARAMS["host"])
+    parser.add_argument("--port", type=int, default=DB_PARAMS["port"])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reports = commands.add_parser("reports", help="список отчетов и их параметров")
+    reports.set_defaults(handler=list_reports)
+
+    report = commands.add_parser("report", help="сформировать отчет в PDF")
+    report.add_argument("name")
+    report.add_argument("-p", "--param", action="append", metavar="ИМЯ=ЗНАЧЕНИЕ",
+                        help="значение параметра; для списка в пакете повторяется")
+    report.add_argument("-o", "--output", help="файл PDF (по умолчанию имя из метаданных отчета)")
+    report.add_argument("--batch", metavar="ПАПКА", help="пакет отчетов по группам в папку")
+    report.add_argument("--processes", type=int, help="процессов для построения пакета (по умолчанию по числу ядер)")
+    report.set_defaults(handler=run_report)
+
+    export = commands.add_parser("export", help="выгрузить таблицу или результат поиска")
+    export.add_argument("table")
+    export.add_argument("-o", "--output", required=True)
+    export.add_argument("--format", choices=EXPORT_FORMATS, help="по умолчанию по расширению файла")
+    export.add_argument("--search", help="выгрузить только найденные строки")
+    export.add_argument("--sort", action="append", metavar="СТОЛБЕЦ[:desc]")
+    export.set_defaults(handler=run_export)
+
+    journey = commands.add_parser("journey", help="самое раннее прибытие с пересадками")
+    journey.add_argument("origin", metavar="FROM", help="вокзал отправления: код или наименование")
+    journey.add_argument("target", metavar="TO", help="вокзал прибытия: код или наименование")
+    journey.add_argument("--after", help="отправление не раньше (по умолчанию сейчас), например 2025-01-31T12:00")
+    journey.add_argument("--transfer", type=int, help="минимальное время пересадки, минуты (по умолчанию 5)")
+    journey.set_defaults(handler=run_journey)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    db = None
+    try:
+        # Список отчетов берется из метаданных, подключение к базе для него не нужно
+        if args.command != "reports":
+            db = DatabaseManager(args.dbname, args.user, args.password, args.host, args.port, max_connections=2)
+        return args.handler(args, db)
+    except UsageError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 2
+    except psycopg2.Error as e:
+        print(f"Ошибка базы данных: {str(e).strip()}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"Ошибка записи файла: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if db is not None:
+            db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+# Объемы данных: число остановок маршрутов = routes * stops
+SCALES = {
+    "small": {"stations": 100, "trains": 500, "brigades": 200, "staff": 2000, "routes": 10000, "stops": 10},
+    "medium": {"stations": 1000, "trains": 5000, "brigades": 2000, "staff": 20000, "routes": 200000, "stops": 10},
+    "large": {"stations": 5000, "trains": 20000, "brigades": 10000, "staff": 100000, "routes": 2000000, "stops": 15},
+}
+# Маршруты равномерно распределены по месяцам, начиная с START_DATE
+START_DATE = "2025-01-01"
+MONTHS = 12
+# Сколько маршрутов (со всеми их остановками) вставляется одним оператором
+CHUNK_ROUTES = 50000
+
+TRAIN_TYPES = ("Скоростной", "Пассажирский", "Пригородный", "Грузовой", "Почтовый")
+POSITIONS = ("Машинист", "Помощник машиниста", "Кондуктор", "Проводник", "Диспетчер", "Начальник поезда")
+COUNTRIES = ("Россия", "Германия", "Франция", "Испания", "Китай", "Чехия")
+LAST_NAMES = ("Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев", "Соколов")
+FIRST_NAMES = ("Иван", "Петр", "Алексей", "Сергей", "Андрей", "Дмитрий", "Николай", "Михаил")
+MIDDLE_NAMES = ("Иванович", "Петрович", "Сергеевич", "Андреевич", "Николаевич", "Михайлович")
+
+# База для замеров: генерация очищает таблицы, поэтому рабочая база по умолчанию не используется
+BENCH_DBNAME = "vokzal_bench"
+# Таблицы с данными в порядке зависимостей; очищаются перед генерацией
+TABLES = ("stations", "train_types", "trains", "positions", "brigades", "staff", "routes", "route_data",
+          "route_brigades")
+
+
+def mix(expression, modulo, salt=1):
+    # Псевдослучайное число 0..modulo-1 из номера строки: мультипликативное хеширование
+    # на целых числах дает одинаковые данные на любом сервере и при любом плане запроса
+    return f"((({expression})::BIGINT * {2654435761 + 2 * salt} + {salt * 40503}) % 4294967296 / 7 % {modulo})"
+
+
+def sql_array(values):
+    return "ARRAY[" + ", ".join(f"'{value}'" for value in values) + "]"
+
+
+def pick(values, expression, salt=1):
+    return f"({sql_array(values)})[1 + {mix(expression, len(values), salt)}]"
+
+
+def generate(connection, scale, log=print):
+    started = time.perf_counter()
+    stations, trains, routes, stops = scale["stations"], scale["trains"], scale["routes"], scale["stops"]
+    brigades, staff = scale["brigades"], scale["staff"]
+
+    # Время отправления маршрута r - равномерно по периоду с разбросом; интервал между остановками
+    # и вокзалы остановок зависят только от номера маршрута и остановки
+    departure = (f"'{START_DATE}'::TIMESTAMP + (r::FLOAT8 * {MONTHS * 30 * 86400} / {routes}) * INTERVAL '1 second'"
+                 f" + {mix('r', 3600, 11)} * INTERVAL '1 second'")
+    interval = f"(20 + {mix('r', 100, 12)}) * INTERVAL '1 minute'"
+
+    def stop_station(k):
+        return f"1 + {mix(f'r * {stops} + {k}', stations, 13)}"
+
+    statements = [
+        ("stations", f"""
+            INSERT INTO stations (station_code, name, inn, address)
+            SELECT i, 'Вокзал ' || i, lpad(i::TEXT, 10, '0'), 'Город ' || (1 + {mix('i', 300, 2)}) || ', ул. Вокзальная, ' || i
+            FROM generate_series(1, {stations}) i
+        """),
+        ("train_types", f"""
+            INSERT INTO train_types (train_type_code, name)
+            SELECT i, ({sql_array(TRAIN_TYPES)})[i]
+            FROM generate_series(1, {len(TRAIN_TYPES)}) i
+        """),
+        ("trains", f"""
+            INSERT INTO trains (train_code, station_code, train_type_code, name, country_of_origin)
+            SELECT i, 1 + {mix('i', stations, 3)}, 1 + {mix('i', len(TRAIN_TYPES), 4)}, 'Поезд ' || i,
+                   {pick(COUNTRIES, 'i', 5)}
+            FROM generate_series(1, {trains}) i
+        """),
+        ("positions", f"""
+            INSERT INTO positions (position_code, name)
+            SELECT i, ({sql_array(POSITIONS)})[i]
+            FROM generate_series(1, {len(POSITIONS)}) i
+        """),
+        ("brigades", f"""
+            INSERT INTO brigades (brigade_code, name)
+            SELECT i, 'Бригада ' || i
+            FROM generate_series(1, {brigades}) i
+        """),
+        ("staff", f"""
+            INSERT INTO staff (inn, fio, gender, age, experience_years, position_code, brigade_code)
+            SELECT lpad(i::TEXT, 12, '0'),
+                   {pick(LAST_NAMES, 'i', 6)} || ' ' || {pick(FIRST_NAMES, 'i', 7)} || ' ' || {pick(MIDDLE_NAMES, 'i', 8)},
+                   'M', 19 + {mix('i', 45, 9)}, {mix('i', 25, 10)}, 1 + {mix('i', len(POSITIONS), 14)},
+                   -- примерно каждый одиннадцатый сотрудник без бригады
+                   CASE WHEN {mix('i', brigades + brigades // 10, 15)} < {brigades}
+                        THEN 1 + {mix('i', brigades + brigades // 10, 15)} END
+            FROM generate_series(1, {staff}) i
+        """),
+    ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+        cursor.execute("SELECT create_route_partitions(%s::TIMESTAMP, %s::TIMESTAMP + %s * INTERVAL '1 month')",
+                       (START_DATE, START_DATE, MONTHS + 1))
+        for table, statement in statements:
+            cursor.execute(statement)
+            log(f"{table}: {cursor.rowcount}")
+        connection.commit()
+
+        # Маршруты, их остановки и бригады - порциями, чтобы транзакции оставались умеренными
+        for first in range(1, routes + 1, CHUNK_ROUTES):
+            last = min(first + CHUNK_ROUTES - 1, routes)
+            cursor.execute(f"""
+                INSERT INTO routes (route_code, owner_station_code, train_code, departure_station_code,
+                                    arrival_station_code, departure_time, arrival_time)
+                SELECT r, s.first_station, 1 + {mix('r', trains, 16)}, s.first_station, s.last_station,
+                       {departure}, {departure} + ({stops} - 1) * {interval}
+                FROM generate_series({first}, {last}) r,
+                LATERAL (SELECT {stop_station(1)} AS first_station, {stop_station(stops)} AS last_station) s
+            """)
+            cursor.execute(f"""
+                INSERT INTO route_data (route_code, stop_number, station_code, arrival_time, departure_time,
+                                        route_departure_time)
+                SELECT r, k, {stop_station('k')},
+                       CASE WHEN k > 1 THEN {departure} + (k - 1) * {interval} END,
+                       CASE WHEN k < {stops} THEN {departure} + (k - 1) * {interval} + INTERVAL '5 minutes' END,
+                       {departure}
+                FROM generate_series({first}, {last}) r, generate_series(1, {stops}) k
+            """)
+            cursor.execute(f"""
+                INSERT INTO route_brigades (route_code, brigade_code, route_departure_time)
+                SELECT r, 1 + {mix('r', brigades, 17)}, {departure}
+                FROM generate_series({first}, {last}) r
+            """)
+            connection.commit()
+            log(f"routes: {last}/{routes}, route_data: {last * stops}")
+
+        # Счетчики SERIAL продолжаются после сгенерированных кодов
+        for table, column in (("stations", "station_code"), ("train_types", "train_type_code"),
+                              ("trains", "train_code"), ("positions", "position_code"),
+                              ("brigades", "brigade_code"), ("routes", "route_code")):
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'),"
+                           f" (SELECT max({column}) FROM {table}))")
+        connection.commit()
+
+        # Статистика для планировщика сразу, не дожидаясь автоочистки
+        cursor.execute("ANALYZE")
+        connection.commit()
+    log(f"Готово за {time.perf_counter() - started:.1f} с")
+
+
+def filled_tables(connection):
+    # Таблицы, в которых уже есть строки: генерация их очистит
+    with connection.cursor() as cursor:
+        filled = []
+        for table in TABLES:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if cursor.fetchone()[0]:
+                filled.append(table)
+    connection.rollback()
+    return filled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Детерминированные данные вокзала для замеров производительности")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--routes", type=int, help="число маршрутов вместо заданного масштабом")
+    parser.add_argument("--stops", type=int, help="остановок на маршрут вместо заданного масштабом")
+    parser.add_argument("--dbname", default=BENCH_DBNAME)
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD"))
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--force", action="store_true", help="очистить таблицы, даже если в них есть данные")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    if args.routes:
+        scale["routes"] = args.routes
+    if args.stops:
+        scale["stops"] = args.stops
+
+    connection = psycopg2.connect(dbname=args.dbname, user=args.user, password=args.password,
+                                  host=args.host, port=args.port)
+    try:
+        filled = filled_tables(connection)
+        if filled and not args.force:
+            print(f"В базе {args.dbname} уже есть данные ({', '.join(filled)}); генерация их удалит. "
+                  f"Запустите с --force, если это база для замеров", file=sys.stderr)
+            return 1
+        generate(connection, scale)
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,649 @@
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+from metrics import InstrumentedCursor
+
+# Параметры подключения по умолчанию (окно приложения и командная строка)
+DB_PARAMS = {
+    "db_name": "vokzal",
+    "user": "postgres",
+    "password": "pass",
+    "host": "localhost",
+    "port": 5432
+}
+# Подготовленных операторов на соединение пула; давно не использованные освобождаются
+PREPARED_STATEMENTS = 100
+
+# Плейсхолдеры psycopg2: он находит их во всем тексте запроса, включая литералы, - так же и здесь
+_PLACEHOLDERS = re.compile(r"%%|%\((\w+)\)s|%s")
+# Строковые литералы и идентификаторы в кавычках (их пробелы значимы) и пробелы вне них
+_SQL_SPACES = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+")
+
+
+def normalize_sql(query):
+    # Запросы из f-строк с разными отступами и переносами дают один ключ
+    return _SQL_SPACES.sub(lambda match: " " if match.group(0).isspace() else match.group(0), query).strip()
+
+
+def server_placeholders(query):
+    # %s и %(имя)s -> $1, $2...: текст для PREPARE и порядок параметров (индексы или имена)
+    order = []
+
+    def replace(match):
+        if match.group(0) == "%%":
+            return "%"
+        key = match.group(1) if match.group(1) is not None else len(order)
+        if key not in order:
+            order.append(key)
+        return f"${order.index(key) + 1}"
+
+    return _PLACEHOLDERS.sub(replace, query), order
+
+
+class PreparedStatements:
+    # Подготовленные на сервере операторы одного соединения: нормализованный текст -> (имя, порядок
+    # параметров), в порядке использования (LRU). Новое соединение, в том числе после обрыва,
+    # начинает с пустого кэша, и операторы готовятся заново при первом выполнении
+    def __init__(self, size=PREPARED_STATEMENTS):
+        self.size = size
+        self._statements = OrderedDict()
+        # Запросы, которые сервер подготовить не смог (например, не выводится тип параметра)
+        self._unsupported = set()
+
+    def execute(self, cursor, query, params=None):
+        key = normalize_sql(query)
+        if key in self._unsupported:
+            cursor.execute(query, params)
+            return
+        entry = self._statements.get(key)
+        if entry is None:
+            entry = self._prepare(cursor, key, query, params)
+            if entry is None:
+                cursor.execute(query, params)
+                return
+        else:
+            self._statements.move_to_end(key)
+
+        connection = cursor.connection
+        # Вне транзакции неудачный EXECUTE можно просто откатить; в открытой транзакции его
+        # ограждает точка сохранения, чтобы не потерять сделанное до него
+        fresh = connection.autocommit or \
+            connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as service:
+            if not fresh:
+                service.execute("SAVEPOINT execute_statement")
+            try:
+                self._execute(cursor, entry, key, params)
+            except psycopg2.errors.InvalidSqlStatementName:
+                # Операторы сброшены на сервере (DEALLOCATE, DISCARD ALL): готовим заново и
+                # повторяем один раз, ошибка повтора уходит вызывающему коду
+                self._statements.clear()
+                if fresh:
+                    if not connection.autocommit:
+                        connection.rollback()
+                else:
+                    service.execute("ROLLBACK TO SAVEPOINT execute_statement")
+                    service.execute("RELEASE SAVEPOINT execute_statement")
+                entry = self._prepare(cursor, key, query, params)
+                if entry is None:
+                    cursor.execute(query, params)
+                else:
+                    self._execute(cursor, entry, key, params)
+                return
+            if not fresh:
+                service.execute("RELEASE SAVEPOINT execute_statement")
+
+    def _execute(self, cursor, entry, key, params):
+        name, order = entry
+        arguments = f" ({', '.join(['%s'] * len(order))})" if order else ""
+        statement = f"EXECUTE {name}{arguments}"
+        values = [params[item] for item in order] if order else None
+        # В метрики и журнал медленных запросов попадает сам запрос, а не обертка EXECUTE
+        execute_as = getattr(cursor, "execute_as", None)
+        if execute_as is not None:
+            execute_as(statement, values, key, params)
+        else:
+            cursor.execute(statement, values)
+
+    def _prepare(self, cursor, key, query, params):
+        # Без параметров psycopg2 не разбирает плейсхолдеры, и текст уходит на сервер как есть
+        text, order = server_placeholders(query) if params is not None else (query, [])
+        name = "stmt_" + hashlib.md5(key.encode("utf-8")).hexdigest()[:16]
+        # Служебные команды идут мимо метрик (обычный курсор), в них учитывается только сам запрос.
+        # Ошибка PREPARE откатывается к точке сохранения и не прерывает транзакцию вызывающего кода
+        with cursor.connection.cursor(cursor_factory=psycopg2.extensions.cursor) as service:
+            savepoint = not service.connection.autocommit
+            if savepoint:
+                service.execute("SAVEPOINT prepare_statement")
+            try:
+                service.execute(f"PREPARE {name} AS {text}")
+            except psycopg2.Error:
+                if not savepoint:
+                    raise
+                service.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+                service.execute("RELEASE SAVEPOINT prepare_statement")
+                self._unsupported.add(key)
+                return None
+            if savepoint:
+                service.execute("RELEASE SAVEPOINT prepare_statement")
+
+            self._statements[key] = (name, order)
+            while len(self._statements) > self.size:
+                _, (evicted, _) = self._statements.popitem(last=False)
+                service.execute(f"DEALLOCATE {evicted}")
+        return name, order
+
+    def __len__(self):
+        return len(self._statements)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    # Соединение пула со своим кэшем подготовленных операторов
+    prepared = None
+
+
+def execute_prepared(cursor, query, params=None):
+    # Повторяющийся запрос через подготовленный оператор: разбор и планирование на сервере
+    # выполняются при первом вызове на соединении. Серверный курсор и соединение вне пула
+    # выполняют запрос как есть
+    statements = getattr(cursor.connection, "prepared", None)
+    if statements is None or cursor.name is not None:
+        cursor.execute(query, params)
+        return
+    statements.execute(cursor, query, params)
+
 
 class DatabaseManager:
-    def __init__(self, db_name, user, password, host="localhost", port=5432):
-        self.connection = psycopg2.connect(
-            dbname=db_name,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
-        self.cursor = self.connection.cursor()
+    # Ограниченный пул соединений: чтение и запись идут через разные соединения,
+    # каждый поток работает со своим соединением и своим курсором
+    def __init__(self, db_name, user, password, host="localhost", port=5432,
+                 min_connections=1, max_connections=8, acquire_timeout=30, health_check_interval=30,
+                 prepared_statements=PREPARED_STATEMENTS):
+        self.params = {
+            "dbname": db_name,
+            "user": user,
+            "password": password,
+            "host": host,
+            "port": port
+        }
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        # Размер кэша подготовленных операторов на соединение; 0 - не готовить
+        self.prepared_statements = prepared_statements
+
+        self._lock = threading.Condition()
+        # Свободные соединения по режиму: readonly -> [(соединение, время возврата)]
+        self._idle = {True: [], False: []}
+        self._opened = 0
+        self._closed = False
+
+        # Первое соединение открываем сразу, чтобы ошибки подключения были видны при запуске
+        for _ in range(min_connections):
+            self.release(self.acquire(readonly=False))
+
+    def _connect(self, readonly):
+        # Все запросы через соединения пула учитываются в метриках (metrics.QUERY_METRICS)
+        connection = psycopg2.connect(**self.params, connection_factory=PooledConnection,
+                                      cursor_factory=InstrumentedCursor)
+        connection.set_session(readonly=readonly)
+        if self.prepared_statements:
+            connection.prepared = PreparedStatements(self.prepared_statements)
+        return connection
+
+    def connect_dedicated(self):
+        # Отдельное соединение вне пула (например, для LISTEN), закрывает его владелец
+        return psycopg2.connect(**self.params, cursor_factory=InstrumentedCursor)
+
+    def _is_alive(self, connection, idle_since):
+        if connection.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+
+        # Давно не использованное соединение проверяем запросом
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self, readonly=True):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+                idle = self._idle[readonly]
+                if idle:
+                    connection, idle_since = idle.pop()
+                    break
+                if self._opened < self.max_connections:
+                    connection, idle_since = None, None
+                    self._opened += 1
+                    break
+
+                # Свободное соединение другого режима закрываем, чтобы освободить место
+                other = self._idle[not readonly]
+                if other:
+                    self._discard(other.pop()[0])
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError("connection pool exhausted")
+                self._lock.wait(remaining)
+
+        if connection is not None and self._is_alive(connection, idle_since):
+            return connection
+
+        # Новое соединение или замена оборвавшемуся
+        if connection is not None:
+            self._close_quietly(connection)
+        try:
+            return self._connect(readonly)
+        except psycopg2.Error:
+            with self._lock:
+                self._opened -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, connection):
+        if not connection.closed:
+            try:
+                if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                self._close_quietly(connection)
+
+        with self._lock:
+            if connection.closed or self._closed:
+                self._discard(connection)
+            else:
+                self._idle[bool(connection.readonly)].append((connection, time.monotonic()))
+            self._lock.notify()
+
+    def _discard(self, connection):
+        # Вызывается под блокировкой
+        self._close_quietly(connection)
+        self._opened -= 1
+        self._lock.notify()
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def session(self, readonly=False):
+        # Одна короткая транзакция: commit при успехе, rollback при ошибке
+        connection = self.acquire(readonly)
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            if not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            self.release(connection)
+
+    def run(self, job, readonly=True, retries=1):
+        # Читающие задачи повторяются на новом соединении, если старое оборвалось
+        while True:
+            try:
+                with self.session(readonly) as connection:
+                    return job(connection)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if not readonly or retries <= 0 or isinstance(e, psycopg2.extensions.QueryCanceledError):
+                    raise
+                retries -= 1
 
     def execute_query(self, query, params=None):
+        def job(connection):
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall() if cursor.description else None
+
         try:
-            self.cursor.execute(query, params)
-            self.connection.commit()
-            return self.cursor.fetchall() if self.cursor.description else None
+            return self.run(job, readonly=False, retries=0)
         except Exception as e:
             print(f"Error executing query: {e}")
-            self.connection.rollback()
 
     def close(self):
-        self.cursor.close()
-        self.connection.close()
+        with self._lock:
+            self._closed = True
+            for idle in self._idle.values():
+                while idle:
+                    self._discard(idle.pop()[0])
+            self._lock.notify_all()
+
+
+class PagedStream:
+    # Общее у потоков строк: порядок (столбцы сортировки с ключом строки в конце), значения
+    # порядка в последней полученной строке - с них поток продолжается - и служебные столбцы
+    # в конце запроса (например, ранг поиска), которые нужны для порядка, но не показываются.
+    # Соединение поток берет из пула сам и только на время чтения
+    def __init__(self, query, params, order, page_size, acquire, release, hidden_columns=0):
+        self.query = query
+        self.params = params
+        self.order = list(order) if order else None
+        self.page_size = page_size
+        self.acquire = acquire
+        self.release = release
+        self.hidden_columns = hidden_columns
+        self.column_names = None
+        self.exhausted = False
+        self.first_page = []
+        self.row_count_estimate = None
+        # Версии таблиц, прочитанные до первой страницы (None - не проверялись)
+        self.versions = None
+        # Значения столбцов порядка в последней полученной строке (None - с начала)
+        self.position = None
+        # Страницы, приостановка и закрытие могут идти из разных потоков
+        self._lock = threading.Lock()
+
+    def _take(self, rows, description):
+        names = [desc[0] for desc in description]
+        if self.column_names is None:
+            self.column_names = names[:len(names) - self.hidden_columns]
+        if rows and self.order:
+            self.position = tuple(rows[-1][names.index(column)] for column, _ in self.order)
+        if self.hidden_columns:
+            rows = [row[:-self.hidden_columns] for row in rows]
+        return rows
+
+    def _after_position(self, params):
+        return rows_after([(number, column, descending, self.position[number])
+                           for number, (column, descending) in enumerate(self.order)], params)
+
+    def resume_at(self, position, column_names):
+        # Продолжение с позиции, полученной раньше (например, позиции сохраненного снимка)
+        self.column_names = list(column_names)
+        self.position = tuple(position)
+
+    def estimate_row_count(self, connection):
+        with connection.cursor() as cursor:
+            return estimate_row_count(cursor, self.query, self.params)
+
+    def suspend(self):
+        pass
+
+    def close(self):
+        self.exhausted = True
+
+
+class RowStream(PagedStream):
+    # Серверный (именованный) курсор: строки забираются порциями, а сервер выполняет запрос
+    # (и сортировку) один раз. Курсор держит транзакцию - она не дает очистке убрать старые
+    # версии строк и блокирует DDL над таблицами (отсоединение секций, миграции), поэтому
+    # курсор закрывается, как только строки кончились, а простаивающий поток приостанавливается
+    # (suspend): курсор закрывается, соединение возвращается в пул, следующая страница открывает
+    # курсор заново после последней полученной строки. Без порядка (order=None) продолжить
+    # нельзя - приостановка завершает поток на уже полученных строках
+    _names = itertools.count(1)
+
+    def __init__(self, query, params=None, page_size=500, acquire=None, release=None, order=None, hidden_columns=0):
+        super().__init__(query, params, order, page_size, acquire, release, hidden_columns)
+        self.connection = None
+        self.cursor = None
+        if acquire is None:
+            # Все строки уже есть у клиента (например, в сохраненном снимке): курсор не нужен
+            self.exhausted = True
+
+    def _execute(self, connection):
+        query, params = self.query, self.params
+        if self.order:
+            params = dict(params or {})
+            query = f"SELECT * FROM ({query}) sorted_rows"
+            if self.position is not None:
+                query += f" WHERE {self._after_position(params)}"
+            query += f" ORDER BY {order_by_clause(self.order)}"
+        cursor = connection.cursor(name=f"row_stream_{next(RowStream._names)}")
+        cursor.itersize = self.page_size
+        try:
+            cursor.execute(query, params)
+        except psycopg2.Error:
+            cursor.close()
+            raise
+        return cursor
+
+    def fetch(self, count=None, connection=None):
+        # connection - соединение вызывающего (например, фоновой задачи) для одной страницы:
+        # курсор на нем закрывается сразу, следующая страница откроет свой. Поток без порядка
+        # так продолжить нельзя - он сразу открывает курсор на своем соединении
+        with self._lock:
+            if self.exhausted:
+                return []
+
+            count = count or self.page_size
+            try:
+                if connection is not None and self.order and self.cursor is None:
+                    cursor = self._execute(connection)
+                    try:
+                        rows = cursor.fetchmany(count)
+                        description = cursor.description
+                    finally:
+                        cursor.close()
+                else:
+                    if self.cursor is None:
+                        self.connection = self.acquire(True)
+                        self.cursor = self._execute(self.connection)
+                    rows = self.cursor.fetchmany(count)
+                    description = self.cursor.description
+            except psycopg2.Error:
+                # Поток с порядком продолжится со следующей страницы на новом курсоре
+                self._release()
+                if not self.order:
+                    self.exhausted = True
+                raise
+
+            rows = self._take(rows, description)
+            if len(rows) < count:
+                self.exhausted = True
+                self._release()
+            return rows
+
+    def suspend(self):
+        with self._lock:
+            if self.cursor is None:
+                return
+            self._release()
+            if not self.order:
+                self.exhausted = True
+
+    def close(self):
+        with self._lock:
+            self.exhausted = True
+            self._release()
+
+    def _release(self):
+        cursor, connection = self.cursor, self.connection
+        self.cursor = self.connection = None
+        if cursor is not None:
+            try:
+                cursor.close()
+            except psycopg2.Error:
+                pass
+        # Транзакцию курсора завершает пул (rollback при возврате)
+        if connection is not None:
+            self.release(connection)
+
+
+def query_plan(cursor, query, params=None):
+    # Корневой узел плана запроса с оценками планировщика (без выполнения)
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def estimate_row_count(cursor, query, params=None):
+    # Оценка числа строк по статистике планировщика вместо полного COUNT(*)
+    return int(query_plan(cursor, query, params)["Plan Rows"])
+
+
+def view_dependencies(cursor):
+    # Таблицы, из которых собраны представления: изменение любой из них меняет строки представления
+    cursor.execute("""
+        SELECT view_name, table_name
+        FROM information_schema.view_table_usage
+        WHERE view_schema = current_schema()
+    """)
+    dependencies = {}
+    for view_name, table_name in cursor.fetchall():
+        dependencies.setdefault(view_name, set()).add(table_name)
+    return dependencies
+
+
+def ensure_partitions(cursor, partitions, from_time, to_time):
+    # Секционированной таблице (метаданные "partitions") создаются недостающие секции на период
+    execute_prepared(cursor, f"SELECT {partitions['function']}(%s, %s)", (from_time, to_time))
+
+
+def table_versions(cursor, tables):
+    # Версии таблиц по счетчикам изменений (в порядке имен); у еще не менявшейся таблицы версия 0
+    tables = sorted(tables)
+    execute_prepared(cursor, "SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)", (tables,))
+    versions = dict(cursor.fetchall())
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def order_by_clause(sort_columns):
+    # NULL в конце при любом направлении сортировки
+    return ", ".join(f"{column} {'DESC' if descending else 'ASC'} NULLS LAST" for column, descending in sort_columns)
+
+
+def sorted_query(query, sort_columns):
+    return f"SELECT * FROM ({query}) sorted_rows ORDER BY {order_by_clause(sort_columns)}"
+
+
+def rows_after(items, params):
+    # Условие "строка идет после значений items" для столбцов с NULL в конце;
+    # items - (номер, столбец, по убыванию, значение)
+    condition = "FALSE"
+    for number, column, descending, value in reversed(items):
+        if value is None:
+            # После NULL в этом столбце ничего нет, равны ему только NULL
+            condition = f"({column} IS NULL AND {condition})"
+            continue
+        name = f"keyset_{number}"
+        params[name] = value
+        operator = "<" if descending else ">"
+        condition = (f"({column} {operator} %({name})s OR {column} IS NULL"
+                     f" OR ({column} = %({name})s AND {condition}))")
+    return condition
+
+
+def stream_order(sort_columns, key_columns):
+    # Порядок потока: сортировка пользователя, затем ключ строки - он делает порядок однозначным
+    sorted_names = {column for column, _ in sort_columns}
+    return list(sort_columns) + [(column, False) for column in key_columns if column not in sorted_names]
+
+
+class KeysetStream(PagedStream):
+    # Отсортированные на сервере строки страницами "после последней полученной строки" (keyset):
+    # каждая страница - короткий запрос по индексу первого столбца сортировки на соединении,
+    # взятом из пула на время страницы; курсор, транзакция и блокировки между прокрутками
+    # не держатся. Строки с NULL в первом столбце читаются отдельным проходом после остальных -
+    # так условие по этому столбцу остается индексируемым
+    def __init__(self, query, params, order, page_size=500, acquire=None, release=None, hidden_columns=0):
+        super().__init__(query, params, order, page_size, acquire, release, hidden_columns)
+        # Текущий проход: строки с NULL в первом столбце или остальные
+        self._nulls = False
+
+    def _page_query(self, count):
+        (lead, lead_descending), rest = self.order[0], self.order[1:]
+        params = dict(self.params or {})
+        conditions = [f"{lead} IS NULL" if self._nulls else f"{lead} IS NOT NULL"]
+        if self.position is not None:
+            after = rows_after([(number, column, descending, self.position[number])
+                                for number, (column, descending) in enumerate(self.order) if number > 0], params)
+            if self._nulls:
+                conditions.append(after)
+            else:
+                params["keyset_0"] = self.position[0]
+                # Нестрогая граница по первому столбцу - для поиска по индексу
+                conditions.append(f"{lead} {'<=' if lead_descending else '>='} %(keyset_0)s")
+                conditions.append(f"({lead} {'<' if lead_descending else '>'} %(keyset_0)s"
+                                  f" OR ({lead} = %(keyset_0)s AND {after}))")
+
+        # Первый столбец в проходе либо без NULL, либо целиком NULL - его NULLS не указываем,
+        # чтобы подошел обычный индекс (в том числе при обратном чтении)
+        order = [] if self._nulls else [f"{lead} DESC" if lead_descending else lead]
+        if rest:
+            order.append(order_by_clause(rest))
+        query = f"SELECT * FROM ({self.query}) sorted_rows WHERE {' AND '.join(conditions)}"
+        if order:
+            query += f" ORDER BY {', '.join(order)}"
+        query += f" LIMIT {int(count)}"
+        return query, params
+
+    def resume_at(self, position, column_names):
+        super().resume_at(position, column_names)
+        self._nulls = self.position[0] is None
+
+    def is_index_backed(self, connection):
+        # Страница дешевле чтения всех строк, только если сервер берет их сразу в нужном порядке
+        # (по индексу); иначе каждая страница сортировала бы весь результат заново
+        with connection.cursor() as cursor:
+            page_cost = query_plan(cursor, *self._page_query(self.page_size))["Total Cost"]
+            full_cost = query_plan(cursor, self.query, self.params)["Total Cost"]
+        return page_cost < full_cost
+
+    def _fetch_pass(self, connection, count):
+        with connection.cursor() as cursor:
+            cursor.execute(*self._page_query(count))
+            return self._take(cursor.fetchall(), cursor.description)
+
+    def fetch(self, count=None, connection=None):
+        # connection - соединение вызывающего для этой страницы; иначе берется из пула
+        with self._lock:
+            if self.exhausted:
+                return []
+
+            count = count or self.page_size
+            borrowed = connection is None
+            if borrowed:
+                connection = self.acquire(True)
+            try:
+                rows = self._fetch_pass(connection, count)
+                if len(rows) < count and not self._nulls:
+                    self._nulls = True
+                    self.position = None
+                    rows += self._fetch_pass(connection, count - len(rows))
+            finally:
+                # Между страницами транзакцию не держим: пул завершает ее при возврате соединения
+                if borrowed:
+                    self.release(connection)
+
+            if len(rows) < count:
+                self.exhausted = True
+            return rows
+
+
+def open_stream(connection, query, params, order, acquire, release, page_size=500, hidden_columns=0):
+    # Страницы по ключу, если порядок поддержан индексом; иначе серверный курсор с ORDER BY -
+    # сервер сортирует результат один раз. connection нужен только для выбора (планы запросов)
+    if order:
+        stream = KeysetStream(query, params, order, page_size, acquire, release, hidden_columns)
+        if stream.is_index_backed(connection):
+            return stream
+    return RowStream(query, params, page_size, acquire, release, order, hidden_columns)
@@ -0,0 +1,187 @@
+import importlib.util
+import itertools
+import os
+import threading
+
+import psycopg2.extensions
+
+# Сколько строк за раз читается серверным курсором при выгрузке в XLSX
+CHUNK_SIZE = 5000
+# Размер блока при передаче CSV от COPY (в файл или в pyarrow)
+COPY_BLOCK_SIZE = 1 << 20
+# Строк данных на листе Excel (одна строка листа занята заголовками)
+XLSX_MAX_ROWS = 1048575
+
+# Формат -> (расширение файла, модуль, без которого формат недоступен)
+EXPORT_FORMATS = {
+    "CSV": (".csv", None),
+    "Parquet": (".parquet", "pyarrow"),
+    "XLSX": (".xlsx", "xlsxwriter"),
+}
+
+# OID типов PostgreSQL -> имя типа pyarrow; остальные типы выгружаются строками
+ARROW_TYPES = {
+    16: "bool_",
+    20: "int64",
+    21: "int16",
+    23: "int32",
+    700: "float32",
+    701: "float64",
+    1082: "date32",
+}
+TIMESTAMP_OID = 1114
+TIMESTAMPTZ_OID = 1184
+
+_cursor_names = itertools.count(1)
+
+
+def available_formats():
+    # Parquet и XLSX - необязательные зависимости
+    return [name for name, (_, module) in EXPORT_FORMATS.items()
+            if module is None or importlib.util.find_spec(module) is not None]
+
+
+def copy_statement(cursor, query, params):
+    # COPY не принимает параметры запроса: значения подставляются на клиенте с экранированием
+    return b"COPY (" + cursor.mogrify(query, params) + b") TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+
+def export_csv(connection, query, params, path, is_cancelled=None):
+    # Строки идут с сервера в файл готовым CSV, без создания объектов Python
+    with connection.cursor() as cursor, open(path, "wb") as file:
+        cursor.copy_expert(copy_statement(cursor, query, params), file, size=COPY_BLOCK_SIZE)
+        return cursor.rowcount
+
+
+def arrow_schema(pa, cursor, query, params):
+    cursor.execute(f"SELECT * FROM ({query}) export_rows LIMIT 0", params)
+    fields = []
+    for column in cursor.description:
+        if column.type_code == TIMESTAMP_OID:
+            data_type = pa.timestamp("us")
+        elif column.type_code == TIMESTAMPTZ_OID:
+            data_type = pa.timestamp("us", tz="UTC")
+        elif column.type_code in ARROW_TYPES:
+            data_type = getattr(pa, ARROW_TYPES[column.type_code])()
+        else:
+            data_type = pa.string()
+        fields.append(pa.field(column.name, data_type))
+    return pa.schema(fields)
+
+
+def export_parquet(connection, query, params, path, is_cancelled=None):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    with connection.cursor() as cursor:
+        schema = arrow_schema(pa, cursor, query, params)
+        # Время с часовым поясом выгружается в UTC, чтобы pyarrow разбирал его единообразно
+        cursor.execute("SET LOCAL TimeZone = 'UTC'")
+        statement = copy_statement(cursor, query, params)
+
+    # CSV из COPY передается через канал прямо в потоковый разборщик pyarrow: столбцы
+    # собираются в нативных буферах и пишутся в Parquet группами строк
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        try:
+            with connection.cursor() as cursor, os.fdopen(write_fd, "wb") as pipe:
+                cursor.copy_expert(statement, pipe, size=COPY_BLOCK_SIZE)
+        except Exception as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    row_count = 0
+    try:
+        # Закрытие канала при ошибке чтения прерывает и COPY
+        with os.fdopen(read_fd, "rb") as source:
+            reader = pa_csv.open_csv(
+                source,
+                read_options=pa_csv.ReadOptions(block_size=COPY_BLOCK_SIZE),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=schema,
+                    true_values=["t"],
+                    false_values=["f"],
+                    # COPY пишет NULL пустым значением, а пустую строку - в кавычках
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                ),
+            )
+            with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+                for batch in reader:
+                    if is_cancelled is not None and is_cancelled():
+                        raise psycopg2.extensions.QueryCanceledError("export cancelled")
+                    writer.write_batch(batch)
+                    row_count += batch.num_rows
+    finally:
+        producer.join()
+
+    if errors:
+        raise errors[0]
+    return row_count
+
+
+def export_xlsx(connection, query, params, path, is_cancelled=None):
+    import xlsxwriter
+
+    # В режиме constant_memory каждая строка листа сразу сбрасывается на диск
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "remove_timezone": True,
+    })
+    header_format = workbook.add_format({"bold": True})
+
+    def add_worksheet(column_names):
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, column_names, header_format)
+        return worksheet
+
+    row_count = 0
+    try:
+        with connection.cursor(name=f"export_{next(_cursor_names)}") as cursor:
+            cursor.itersize = CHUNK_SIZE
+            cursor.execute(query, params)
+            worksheet = None
+            sheet_row = 0
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if is_cancelled is not None and is_cancelled():
+                    raise psycopg2.extensions.QueryCanceledError("export cancelled")
+                # Лист с заголовками создается и для пустого результата
+                if worksheet is None:
+                    column_names = [column.name for column in cursor.description]
+                    worksheet = add_worksheet(column_names)
+                for row in rows:
+                    # Строки сверх предела листа Excel переходят на следующий лист
+                    if sheet_row >= XLSX_MAX_ROWS:
+                        worksheet = add_worksheet(column_names)
+                        sheet_row = 0
+                    sheet_row += 1
+                    worksheet.write_row(sheet_row, 0, row)
+                if not rows:
+                    break
+                row_count += len(rows)
+    finally:
+        workbook.close()
+    return row_count
+
+
+EXPORTERS = {
+    "CSV": export_csv,
+    "Parquet": export_parquet,
+    "XLSX": export_xlsx,
+}
+
+
+def export_query(connection, query, params, path, export_format, is_cancelled=None):
+    # Выгрузка результата запроса в файл; возвращает число строк. Недописанный файл удаляется
+    try:
+        return EXPORTERS[export_format](connection, query, params, path, is_cancelled)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
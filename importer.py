@@ -0,0 +1,280 @@
+import threading
+
+# Сколько отклоненных строк возвращать в отчете (остальные только считаются)
+MAX_REJECTED = 1000
+
+
+class ImportResult:
+    def __init__(self, table, target_table):
+        self.table = table
+        self.target_table = target_table
+        self.total = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected_count = 0
+        # [(номер строки данных, причина)]
+        self.rejected = []
+
+
+class CsvImporter:
+    # Массовая загрузка CSV: файл копируется (COPY) во временную таблицу, названия из справочников
+    # превращаются в коды одним запросом с соединениями, а корректные строки вставляются в базовую
+    # таблицу одним INSERT ... SELECT - без построчных триггеров INSTEAD OF
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self._table_info = {}
+        self._lock = threading.Lock()
+
+    def import_fields(self, table):
+        # Заголовок CSV - имена полей из метаданных; скрытые поля (коды SERIAL,
+        # вычисляемые столбцы представлений) не загружаются
+        fields = self.metadata[table]["fields"]
+        return [field for field, details in fields.items() if details.get("input_type") != "hide"]
+
+    def target_table(self, table):
+        return self.metadata[table].get("row_key", {}).get("table", table)
+
+    def table_info(self, cursor, table):
+        # Типы столбцов базовой таблицы, ее CHECK-ограничения (имя, выражение, столбцы)
+        # и внешние ключи (имя, таблица-справочник, столбцы, столбцы справочника)
+        with self._lock:
+            if table in self._table_info:
+                return self._table_info[table]
+
+        cursor.execute("""
+            SELECT attname, format_type(atttypid, atttypmod), attnotnull
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        """, (table,))
+        column_types = {name: (data_type, not_null) for name, data_type, not_null in cursor.fetchall()}
+
+        cursor.execute("""
+            SELECT
+                c.conname,
+                pg_get_expr(c.conbin, c.conrelid),
+                ARRAY(SELECT a.attname::TEXT FROM pg_attribute a
+                      WHERE a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey))
+            FROM pg_constraint c
+            WHERE c.conrelid = %s::regclass AND c.contype = 'c'
+        """, (table,))
+        checks = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT
+                c.conname,
+                c.confrelid::regclass::TEXT,
+                ARRAY(SELECT a.attname::TEXT FROM unnest(c.conkey) WITH ORDINALITY k(attnum, n)
+                      JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum ORDER BY k.n),
+                ARRAY(SELECT a.attname::TEXT FROM unnest(c.confkey) WITH ORDINALITY k(attnum, n)
+                      JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum ORDER BY k.n)
+            FROM pg_constraint c
+            -- Ссылки на секционированную таблицу дублируются для каждой ее секции - берем исходную
+            WHERE c.conrelid = %s::regclass AND c.contype = 'f' AND c.conparentid = 0
+        """, (table,))
+        references = cursor.fetchall()
+
+        with self._lock:
+            self._table_info[table] = (column_types, checks, references)
+        return column_types, checks, references
+
+    def column_map(self, table):
+        # Поле CSV -> (столбец базовой таблицы, внешний ключ или None)
+        target = self.target_table(table)
+        is_view = target != table
+        fields = self.metadata[table]["fields"]
+
+        columns = {}
+        for field in self.import_fields(table):
+            details = fields[field]
+            foreign_key = details.get("foreign_key")
+            if foreign_key:
+                # В базовой таблице столбец ссылки называется как поле, в представлении - как ключ справочника
+                column = foreign_key["key_column"] if is_view else field
+            elif is_view and details["source_table"] == target:
+                column = details["source_column"]
+            else:
+                column = field
+            columns[field] = (column, foreign_key)
+        return columns
+
+    def import_csv(self, connection, table, file):
+        target = self.target_table(table)
+        fields = self.metadata[table]["fields"]
+        columns = self.column_map(table)
+        result = ImportResult(table, target)
+
+        with connection.cursor() as cursor:
+            column_types, checks, references = self.table_info(cursor, target)
+            # Проверка значений без исключений доступна с PostgreSQL 16; на старых версиях
+            # неверное значение прервет загрузку целиком
+            can_validate = connection.server_version >= 160000
+
+            staging_columns = ", ".join(f"{field} TEXT" for field in columns)
+            cursor.execute(f"""
+                CREATE TEMP TABLE import_staging (
+                    line_number BIGINT GENERATED ALWAYS AS IDENTITY,
+                    {staging_columns}
+                ) ON COMMIT DROP
+            """)
+            cursor.copy_expert(
+                f"COPY import_staging ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER true)", file
+            )
+            result.total = cursor.rowcount
+            cursor.execute("ANALYZE import_staging")
+
+            # Недостающие записи справочника, которые разрешено создавать (например, бригады)
+            for field, (column, foreign_key) in columns.items():
+                if foreign_key and foreign_key.get("create_missing"):
+                    source_column = fields[field]["source_column"]
+                    cursor.execute(f"""
+                        INSERT INTO {foreign_key['table']} ({source_column})
+                        SELECT DISTINCT st.{field}
+                        FROM import_staging st
+                        WHERE st.{field} IS NOT NULL AND NOT EXISTS (
+                            SELECT 1 FROM {foreign_key['table']} ref WHERE ref.{source_column} = st.{field}
+                        )
+                    """)
+
+            select_list = []
+            joins = []
+            reasons = []
+            for number, (field, (column, foreign_key)) in enumerate(columns.items()):
+                data_type, not_null = column_types[column]
+                if not_null:
+                    reasons.append(f"WHEN st.{field} IS NULL THEN 'Не заполнено поле {field}'")
+
+                if foreign_key:
+                    # Названия в справочниках могут повторяться - берем запись с наименьшим кодом
+                    alias = f"ref_{number}"
+                    key_column = foreign_key["key_column"]
+                    source_column = fields[field]["source_column"]
+                    joins.append(f"""
+                LEFT JOIN (
+                    SELECT DISTINCT ON ({source_column}) {source_column} AS name, {key_column} AS code
+                    FROM {foreign_key['table']}
+                    ORDER BY {source_column}, {key_column}
+                ) {alias} ON {alias}.name = st.{field}""")
+                    select_list.append(f"{alias}.code AS {column}")
+                    reasons.append(
+                        f"WHEN st.{field} IS NOT NULL AND {alias}.code IS NULL "
+                        f"THEN 'Не найдено значение поля {field}: ' || st.{field}"
+                    )
+                elif can_validate:
+                    select_list.append(
+                        f"CASE WHEN pg_input_is_valid(st.{field}, '{data_type}') "
+                        f"THEN st.{field}::{data_type} END AS {column}"
+                    )
+                    reasons.append(
+                        f"WHEN st.{field} IS NOT NULL AND NOT pg_input_is_valid(st.{field}, '{data_type}') "
+                        f"THEN 'Неверное значение поля {field}: ' || st.{field}"
+                    )
+                else:
+                    select_list.append(f"st.{field}::{data_type} AS {column}")
+
+            reject_reason = f"CASE {' '.join(reasons)} END" if reasons else "NULL::TEXT"
+            cursor.execute(f"""
+                CREATE TEMP TABLE import_rows ON COMMIT DROP AS
+                SELECT
+                    st.line_number,
+                    {', '.join(select_list)},
+                    {reject_reason} AS reject_reason
+                FROM import_staging st{''.join(joins)}
+            """)
+
+            # Составные ссылки, часть столбцов которых в файле не задается (например, время
+            # отправления маршрута в route_data), дополняются из таблицы-справочника по известной части
+            target_columns = [column for column, _ in columns.values()]
+            filled_columns = set()
+            for name, ref_table, ref_columns, key_columns in references:
+                known = [(column, key) for column, key in zip(ref_columns, key_columns) if column in target_columns]
+                missing = [(column, key) for column, key in zip(ref_columns, key_columns)
+                           if column not in target_columns]
+                if not known or not missing:
+                    continue
+                for column, _ in missing:
+                    cursor.execute(f"ALTER TABLE import_rows ADD COLUMN {column} {column_types[column][0]}")
+                cursor.execute(f"""
+                    UPDATE import_rows r
+                    SET {', '.join(f"{column} = ref.{key}" for column, key in missing)}
+                    FROM {ref_table} ref
+                    WHERE r.reject_reason IS NULL AND {' AND '.join(f"ref.{key} = r.{column}" for column, key in known)}
+                """)
+                target_columns += [column for column, _ in missing]
+                filled_columns.update(column for column, _ in missing)
+
+            # CHECK-ограничения проверяются тем же выражением по уже преобразованным значениям,
+            # чтобы одна неверная строка не прервала всю загрузку
+            checks = [(name, expression) for name, expression, check_columns in checks
+                      if set(check_columns) <= set(target_columns)]
+            if checks:
+                cursor.execute(f"""
+                    UPDATE import_rows
+                    SET reject_reason = CASE {' '.join(
+                        f"WHEN ({expression}) IS FALSE THEN 'Нарушено ограничение {name}'"
+                        for name, expression in checks
+                    )} END
+                    WHERE reject_reason IS NULL AND ({' OR '.join(
+                        f"({expression}) IS FALSE" for _, expression in checks
+                    )})
+                """)
+
+            # Ссылки, значения которых пришли из файла как есть (не через названия справочников),
+            # проверяем одним антисоединением на каждый внешний ключ
+            resolved_columns = {column for column, foreign_key in columns.values() if foreign_key}
+            for name, ref_table, ref_columns, key_columns in references:
+                if not set(ref_columns) <= set(target_columns) or set(ref_columns) <= resolved_columns:
+                    continue
+                file_columns = [column for column in ref_columns if column not in filled_columns]
+                cursor.execute(f"""
+                    UPDATE import_rows r
+                    SET reject_reason = 'Нет записи в {ref_table} для ' || concat_ws(', ', {', '.join(
+                        f"r.{column}" for column in file_columns
+                    )})
+                    WHERE r.reject_reason IS NULL
+                        AND {' AND '.join(f"r.{column} IS NOT NULL" for column in file_columns)}
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {ref_table} ref
+                            WHERE {' AND '.join(
+                                f"ref.{key} = r.{column}" for column, key in zip(ref_columns, key_columns)
+                            )}
+                        )
+                """)
+
+            cursor.execute("SELECT count(*) FROM import_rows WHERE reject_reason IS NOT NULL")
+            result.rejected_count = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT line_number, reject_reason
+                FROM import_rows
+                WHERE reject_reason IS NOT NULL
+                ORDER BY line_number
+                LIMIT %s
+            """, (MAX_REJECTED,))
+            result.rejected = cursor.fetchall()
+
+            # Секционированной таблице нужны секции на весь период загружаемых строк
+            partitions = self.metadata[table].get("partitions")
+            if partitions and partitions["column"] in target_columns:
+                cursor.execute(f"""
+                    SELECT {partitions['function']}(min({partitions['column']}), max({partitions['column']}))
+                    FROM import_rows
+                    WHERE reject_reason IS NULL
+                    HAVING count({partitions['column']}) > 0
+                """)
+
+            # Строки вставляются в порядке первичного ключа (если он загружается из файла),
+            # так индекс заполняется последовательно; строки с уже существующим ключом
+            # пропускаются и считаются дубликатами
+            key_columns = self.metadata[table].get("row_key", {}).get("columns", [])
+            order_by = f"ORDER BY {', '.join(key_columns)}" if key_columns and set(key_columns) <= set(target_columns) else ""
+            cursor.execute(f"""
+                INSERT INTO {target} ({', '.join(target_columns)})
+                SELECT {', '.join(target_columns)} FROM import_rows WHERE reject_reason IS NULL
+                {order_by}
+                ON CONFLICT DO NOTHING
+            """)
+            result.inserted = cursor.rowcount
+            result.duplicates = result.total - result.rejected_count - result.inserted
+
+        # Все строки файла попадают в базу в одной транзакции
+        connection.commit()
+        return result
@@ -0,0 +1,317 @@
+import bisect
+import datetime
+import sys
+import threading
+from array import array
+
+# Поиск поездок с пересадками по расписанию из route_data (алгоритм сканирования соединений, CSA).
+# Соединение - перегон маршрута между соседними остановками: отправление, прибытие, вокзалы, маршрут.
+# Соединения хранятся в массивах array('i'), отсортированных по времени отправления, без объекта
+# Python на строку; массивы разбиты на корзины по суткам отправления
+
+# Время в расписании - секунды от TIME_BASE в 32-битных целых (хватает до 2068 года)
+TIME_BASE = datetime.datetime(2000, 1, 1)
+BUCKET_SECONDS = 86400
+# Минимальное время пересадки по умолчанию, секунды
+MIN_TRANSFER_SECONDS = 5 * 60
+# Поездки дольше не рассматриваются, секунды
+MAX_JOURNEY_SECONDS = 3 * 86400
+# Сколько суток от отправления маршрута может занимать его путь: корзины, где ищутся его перегоны
+MAX_ROUTE_DAYS = 7
+# Корзин в одной порции при загрузке расписания
+LOAD_ITERSIZE = 8
+
+_BASE = f"TIMESTAMP '{TIME_BASE.isoformat(' ')}'"
+# Перегоны маршрутов: остановка и следующая за ней (без последней остановки и перегонов без времени)
+CONNECTIONS_QUERY = f"""
+    SELECT route_code, station_code AS from_station, next_station AS to_station,
+           floor(extract(epoch FROM departure_time - {_BASE}))::INT AS departure,
+           floor(extract(epoch FROM next_arrival - {_BASE}))::INT AS arrival
+    FROM (
+        SELECT route_code, station_code, departure_time,
+               lead(station_code) OVER stops AS next_station,
+               lead(arrival_time) OVER stops AS next_arrival
+        FROM route_data
+        {{where}}
+        WINDOW stops AS (PARTITION BY route_code, route_departure_time ORDER BY stop_number)
+    ) legs
+    WHERE next_station IS NOT NULL AND departure_time IS NOT NULL AND next_arrival IS NOT NULL
+"""
+# Корзина целиком одной строкой: столбцы упакованы сервером в bytea (int4send - 4 байта, big-endian),
+# клиент превращает их в массивы без разбора отдельных значений
+_PACKED_ORDER = "ORDER BY departure, arrival, from_station, to_station, route_code"
+BUCKETS_QUERY = f"""
+    SELECT floor(departure / {BUCKET_SECONDS}::FLOAT8)::INT AS bucket,
+           string_agg(int4send(departure), '' {_PACKED_ORDER}),
+           string_agg(int4send(arrival), '' {_PACKED_ORDER}),
+           string_agg(int4send(from_station), '' {_PACKED_ORDER}),
+           string_agg(int4send(to_station), '' {_PACKED_ORDER}),
+           string_agg(int4send(route_code), '' {_PACKED_ORDER})
+    FROM ({CONNECTIONS_QUERY.format(where="")}) connections
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+def to_seconds(moment):
+    return int((moment - TIME_BASE).total_seconds())
+
+
+def from_seconds(seconds):
+    return TIME_BASE + datetime.timedelta(seconds=seconds)
+
+
+def unpack(data):
+    values = array("i")
+    values.frombytes(bytes(data))
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+class TimetableBucket:
+    # Перегоны, отправляющиеся в одни сутки, - пять параллельных массивов в порядке отправления
+    __slots__ = ("departures", "arrivals", "from_stations", "to_stations", "routes")
+
+    def __init__(self, departures, arrivals, from_stations, to_stations, routes):
+        self.departures = departures
+        self.arrivals = arrivals
+        self.from_stations = from_stations
+        self.to_stations = to_stations
+        self.routes = routes
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows - кортежи (отправление, прибытие, откуда, куда, маршрут)
+        rows.sort()
+        columns = list(zip(*rows)) if rows else [()] * 5
+        return cls(*(array("i", column) for column in columns))
+
+    def columns(self):
+        return self.departures, self.arrivals, self.from_stations, self.to_stations, self.routes
+
+    def row(self, i):
+        return tuple(column[i] for column in self.columns())
+
+    def removed(self, route_codes):
+        # Позиции перегонов маршрутов route_codes
+        return [i for i, route in enumerate(self.routes) if route in route_codes]
+
+    def replace(self, removed, rows):
+        # Новая корзина без перегонов на позициях removed и с перегонами rows. Массивы копируются
+        # срезами между изменениями, а не строятся заново, - исходная корзина не меняется
+        inserts = {}
+        for row in sorted(rows):
+            i = bisect.bisect_left(self.departures, row[0])
+            while i < len(self) and self.row(i) < row:
+                i += 1
+            inserts.setdefault(i, []).append(row)
+        skipped = set(removed)
+
+        columns = [array("i") for _ in range(5)]
+        start = 0
+        for i in sorted(skipped | set(inserts)):
+            for column, values in zip(columns, self.columns()):
+                column.extend(values[start:i])
+            for row in inserts.get(i, ()):
+                for column, value in zip(columns, row):
+                    column.append(value)
+            start = i + 1 if i in skipped else i
+        for column, values in zip(columns, self.columns()):
+            column.extend(values[start:])
+        return TimetableBucket(*columns)
+
+    def __len__(self):
+        return len(self.departures)
+
+
+class Leg:
+    # Участок поездки на одном маршруте: посадка и высадка
+    __slots__ = ("route_code", "from_station", "departure", "to_station", "arrival")
+
+    def __init__(self, route_code, from_station, departure, to_station, arrival):
+        self.route_code = route_code
+        self.from_station = from_station
+        self.departure = departure
+        self.to_station = to_station
+        self.arrival = arrival
+
+
+class Timetable:
+    # Расписание в памяти. Загружается один раз (load), затем обновляется по маршрутам (refresh):
+    # перестраиваются только корзины, где были или появились перегоны измененных маршрутов.
+    # Поиск читает корзины без блокировки: обновление подменяет корзину целиком
+    def __init__(self):
+        self.buckets = {}
+        self.station_names = {}
+        self.station_codes = {}
+        # Наибольший код вокзала + 1: размер таблицы времени готовности в поиске
+        self.station_limit = 0
+        self._lock = threading.Lock()
+
+    def connection_count(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def load(self, connection, is_cancelled=None):
+        buckets = {}
+        # Корзины идут с сервера порциями: в памяти клиента одновременно только упакованная порция
+        with connection.cursor(name="timetable_buckets") as cursor:
+            cursor.itersize = LOAD_ITERSIZE
+            cursor.execute(BUCKETS_QUERY)
+            for number, *columns in cursor:
+                if is_cancelled is not None and is_cancelled():
+                    return False
+                buckets[number] = TimetableBucket(*(unpack(column) for column in columns))
+        # Вокзалы читаются после перегонов: все вокзалы прочитанных перегонов уже есть в таблице
+        station_names = read_stations(connection)
+        with self._lock:
+            self.buckets = buckets
+            self.set_stations(station_names)
+        return True
+
+    def set_stations(self, station_names):
+        self.station_names = station_names
+        self.station_codes = {name: code for code, name in station_names.items()}
+        self.station_limit = max(station_names, default=0) + 1
+
+    def refresh(self, connection, routes):
+        # routes - [(код маршрута, время отправления маршрута)] из ключей уведомления route_data;
+        # старые перегоны ищутся в корзинах от отправления маршрута, новые читаются из базы
+        route_codes = {int(code) for code, _ in routes}
+        if not route_codes:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(CONNECTIONS_QUERY.format(where="WHERE route_code = ANY(%(routes)s)")
+                           + " ORDER BY departure", {"routes": sorted(route_codes)})
+            added = {}
+            for route_code, from_station, to_station, departure, arrival in cursor:
+                added.setdefault(departure // BUCKET_SECONDS, []).append(
+                    (departure, arrival, from_station, to_station, route_code))
+        station_names = read_stations(connection)
+
+        with self._lock:
+            # Перегоны маршрута идут подряд по суткам от его отправления: просмотр корзин
+            # заканчивается на первых сутках без перегонов, кроме самих суток отправления
+            # (первый перегон может отправиться уже после полуночи)
+            removed = {}
+            for route_code, departure_time in routes:
+                first = to_seconds(parse_time(departure_time)) // BUCKET_SECONDS
+                for number in range(first, first + MAX_ROUTE_DAYS + 1):
+                    bucket = self.buckets.get(number)
+                    positions = bucket.removed({int(route_code)}) if bucket is not None else []
+                    if not positions:
+                        if number > first:
+                            break
+                        continue
+                    removed.setdefault(number, set()).update(positions)
+
+            buckets = dict(self.buckets)
+            for number in removed.keys() | added.keys():
+                bucket = buckets.get(number)
+                if bucket is None:
+                    bucket = TimetableBucket.from_rows(added[number])
+                else:
+                    bucket = bucket.replace(removed.get(number, ()), added.get(number, []))
+                if len(bucket):
+                    buckets[number] = bucket
+                else:
+                    buckets.pop(number, None)
+            self.buckets = buckets
+            self.set_stations(station_names)
+
+    def station_code(self, station):
+        # Вокзал по коду или наименованию
+        if isinstance(station, int) or str(station).isdigit():
+            code = int(station)
+            return code if code in self.station_names else None
+        return self.station_codes.get(station)
+
+    def earliest_arrival(self, origin, target, after, min_transfer=MIN_TRANSFER_SECONDS,
+                         max_duration=MAX_JOURNEY_SECONDS):
+        # Самое раннее прибытие из origin в target при отправлении не раньше after (datetime).
+        # Возвращает список участков Leg или None, если за max_duration доехать нельзя
+        if origin == target:
+            return []
+        start = to_seconds(after)
+        limit = start + max_duration
+        buckets = self.buckets
+
+        # С какого времени можно отправиться с вокзала: на начальном - сразу, на остальных -
+        # после прибытия и пересадки. Поезд, в котором уже едем, пересадки не требует
+        best = limit + 1
+        ready = [best] * max(self.station_limit, origin + 1, target + 1)
+        ready[origin] = start
+        boarded = {}
+        reached_by = {}
+        for number in range(start // BUCKET_SECONDS, limit // BUCKET_SECONDS + 1):
+            bucket = buckets.get(number)
+            if bucket is None:
+                continue
+            if bucket.departures and bucket.departures[0] >= best:
+                break
+            first = bisect.bisect_left(bucket.departures, start) if number == start // BUCKET_SECONDS else 0
+            for departure, arrival, from_station, to_station, route in zip(
+                    bucket.departures[first:], bucket.arrivals[first:], bucket.from_stations[first:],
+                    bucket.to_stations[first:], bucket.routes[first:]):
+                # Большинство перегонов отсекается здесь: с вокзала к этому времени не уехать
+                if ready[from_station] > departure and route not in boarded:
+                    continue
+                if departure >= best:
+                    break
+                if route not in boarded:
+                    boarded[route] = (from_station, departure)
+                if to_station == target:
+                    if arrival < best:
+                        best = arrival
+                        reached_by[target] = (route, arrival)
+                    continue
+                transfer_ready = arrival + min_transfer
+                if transfer_ready < ready[to_station]:
+                    ready[to_station] = transfer_ready
+                    reached_by[to_station] = (route, arrival)
+
+        if target not in reached_by:
+            return None
+
+        # Участки восстанавливаются от конечного вокзала: маршрут, которым доехали, и где в него сели
+        legs = []
+        station = target
+        while station != origin:
+            route, arrival = reached_by[station]
+            from_station, departure = boarded[route]
+            legs.append(Leg(route, from_station, from_seconds(departure), station, from_seconds(arrival)))
+            station = from_station
+        legs.reverse()
+        return legs
+
+    def describe(self, legs, trains=None):
+        # Строки для вывода: отправление, прибытие, маршрут и поезд
+        lines = []
+        for leg in legs:
+            train = f" ({trains[leg.route_code]})" if trains and leg.route_code in trains else ""
+            lines.append(f"{leg.departure:%Y-%m-%d %H:%M} {self.station_names.get(leg.from_station, leg.from_station)}"
+                         f" -> {leg.arrival:%Y-%m-%d %H:%M} {self.station_names.get(leg.to_station, leg.to_station)},"
+                         f" маршрут {leg.route_code}{train}")
+        return lines
+
+
+def read_stations(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT station_code, name FROM stations")
+        return dict(cursor.fetchall())
+
+
+def route_trains(cursor, route_codes):
+    # Названия поездов маршрутов найденной поездки
+    cursor.execute("""
+        SELECT r.route_code, t.name
+        FROM routes r
+        JOIN trains t ON t.train_code = r.train_code
+        WHERE r.route_code = ANY(%s)
+    """, (sorted(route_codes),))
+    return dict(cursor.fetchall())
+
+
+def parse_time(value):
+    # Ключи уведомлений приходят строками JSON ("2025-01-01T08:00:00")
+    return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(value)
@@ -0,0 +1,135 @@
+from PyQt6.QtCore import QObject, QSocketNotifier, QTimer, pyqtSignal
+import psycopg2
+import json
+
+# Канал, в который триггеры из scripts/triggers.sql сообщают об изменении таблицы:
+# имя таблицы, операцию и ключи измененных строк
+CHANNEL = "table_changed"
+RECONNECT_INTERVAL = 5000
+
+
+def listen_connection(connect, channel=CHANNEL):
+    # Новое соединение с подпиской на канал; открывается в фоновом потоке, а не в потоке интерфейса
+    connection = connect()
+    try:
+        connection.set_session(autocommit=True)
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel}")
+    except psycopg2.Error:
+        connection.close()
+        raise
+    return connection
+
+
+class ChangeListener(QObject):
+    # LISTEN на отдельном соединении; уведомления читаются в потоке интерфейса по готовности сокета,
+    # а переподключение идет в пуле фоновых задач (executor - workers.QueryExecutor)
+    table_changed = pyqtSignal(str)
+    # Таблица, операция и ключи строк ([{столбец: значение}]); None - ключи неизвестны
+    rows_changed = pyqtSignal(str, str, object)
+    # Соединение обрывалось: уведомления за это время потеряны, кэши нужно сбросить целиком
+    changes_missed = pyqtSignal()
+
+    def __init__(self, connect, executor, channel=CHANNEL, parent=None):
+        super().__init__(parent)
+        self.connect = connect
+        self.executor = executor
+        self.channel = channel
+        self.connection = None
+        self.notifier = None
+        self.was_connected = False
+        self.stopped = False
+
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.setInterval(RECONNECT_INTERVAL)
+        self.reconnect_timer.timeout.connect(self.start)
+
+    def start(self, connection=None):
+        # connection - уже подписанное соединение (listen_connection); без него подключаемся в фоне
+        self.stopped = False
+        if connection is not None:
+            self._attach(connection)
+            return
+
+        def on_finished(connection):
+            if self.stopped:
+                connection.close()
+                return
+            self._attach(connection)
+
+        def on_failed(error):
+            if not self.stopped:
+                self.reconnect_timer.start()
+
+        self.executor.submit(lambda _: listen_connection(self.connect, self.channel), on_finished, on_failed,
+                             uses_connection=False)
+
+    def _attach(self, connection):
+        self.connection = connection
+        self.notifier = QSocketNotifier(self.connection.fileno(), QSocketNotifier.Type.Read, self)
+        self.notifier.activated.connect(self._poll)
+
+        if self.was_connected:
+            self.changes_missed.emit()
+        self.was_connected = True
+
+    def stop(self):
+        self.stopped = True
+        self.reconnect_timer.stop()
+        self._drop()
+
+    def _poll(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            self._drop()
+            self.changes_missed.emit()
+            self.reconnect_timer.start()
+            return
+
+        # Уведомления из одной пачки сводим по таблице и операции, ключи объединяем
+        tables = []
+        changes = {}
+        while self.connection.notifies:
+            table, op, keys = parse_payload(self.connection.notifies.pop(0).payload)
+            if table not in tables:
+                tables.append(table)
+            if (table, op) not in changes:
+                changes[(table, op)] = keys
+            elif changes[(table, op)] is None or keys is None:
+                changes[(table, op)] = None
+            else:
+                changes[(table, op)] += [key for key in keys if key not in changes[(table, op)]]
+
+        for table in tables:
+            self.table_changed.emit(table)
+        for (table, op), keys in changes.items():
+            self.rows_changed.emit(table, op, keys)
+
+    def _drop(self):
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+            self.connection = None
+
+
+def parse_payload(payload):
+    # Старый формат уведомления - только имя таблицы
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        return payload, "", None
+    if not isinstance(change, dict):
+        return payload, "", None
+
+    keys = change.get("keys")
+    if keys is not None:
+        keys = [dict(zip(change["columns"], key)) for key in keys]
+    return change["table"], change.get("op") or "", keys
@@ -0,0 +1,65 @@
+import threading
+
+from db import execute_prepared
+
+
+class LookupCache:
+    # Списки значений для выпадающих полей по парам (source_table, source_column) из метаданных.
+    # Сбрасываются по таблице-источнику, когда она меняется (уведомления table_changed)
+    def __init__(self):
+        self._values = {}
+        # Поколение таблицы растет при каждом сбросе: результат запроса, начатого
+        # до изменения таблицы, в кэш уже не попадет
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def cached(self, pairs):
+        with self._lock:
+            if all(pair in self._values for pair in pairs):
+                return {pair: self._values[pair] for pair in pairs}
+        return None
+
+    def get_many(self, connection, pairs):
+        result = {}
+        missing = []
+        with self._lock:
+            for pair in pairs:
+                if pair in self._values:
+                    result[pair] = self._values[pair]
+                elif pair not in missing:
+                    missing.append(pair)
+
+        if not missing:
+            return result
+
+        with self._lock:
+            generations = [self._generations.get(source_table, 0) for source_table, _ in missing]
+
+        # Все недостающие списки одним запросом (одна строка, по массиву на список):
+        # окно с несколькими выпадающими полями ждет один обмен с сервером, а не по одному на поле
+        query = "SELECT " + ", ".join(
+            f"ARRAY(SELECT {source_column} FROM {source_table})" for source_table, source_column in missing
+        )
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, query)
+            lists = cursor.fetchone()
+
+        with self._lock:
+            for pair, generation, values in zip(missing, generations, lists):
+                values = [str(value) for value in values]
+                result[pair] = values
+                if self._generations.get(pair[0], 0) == generation:
+                    self._values[pair] = values
+        return result
+
+    def invalidate(self, table):
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            for pair in [pair for pair in self._values if pair[0] == table]:
+                del self._values[pair]
+
+    def clear(self):
+        with self._lock:
+            for table in list(self._generations) + [pair[0] for pair in self._values]:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._values.clear()
@@ -1,8 +1,86 @@
-from PyQt6.QtWidgets import QApplication
-from ui import App
+import time
+
+# Отсчет времени запуска - до импорта остальных модулей
+STARTED = time.perf_counter()
+
+import datetime
+import json
+import sys
+
+# Предел ожидания в режиме замера запуска, мс
+STARTUP_TIMEOUT = 60000
+# Команды командной строки (cli.build_parser); остальные аргументы - для Qt (-platform, -style ...)
+CLI_COMMANDS = ("reports", "report", "export", "journey")
+
+
+def measure_startup(output=None):
+    # Холодный запуск по этапам, секунды от старта процесса: импорт модулей окна, создание окна,
+    # первая отрисовка, подключение к базе, первая страница таблицы. Строка JSON выводится
+    # и дописывается в файл, чтобы сравнивать запуск между версиями
+    marks = {}
+
+    def mark(name):
+        marks.setdefault(name, round(time.perf_counter() - STARTED, 4))
+
+    from PyQt6.QtCore import QEvent, QObject, QTimer
+    from PyQt6.QtWidgets import QApplication
+    from ui import App
+    mark("imports")
+
+    class PaintWatcher(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Type.Paint:
+                mark("first_paint")
+            return False
 
-if __name__ == "__main__":
     app = QApplication([])
     window = App()
+    mark("window")
+    watcher = PaintWatcher()
+    window.installEventFilter(watcher)
+
+    def on_database_ready(connected):
+        mark("connected")
+        if not connected:
+            marks["error"] = "no database connection"
+            app.quit()
+
+    def on_rows():
+        if "connected" in marks:
+            mark("first_rows")
+            app.quit()
+
+    window.database_ready.connect(on_database_ready)
+    window.table_model.modelReset.connect(on_rows)
+    QTimer.singleShot(STARTUP_TIMEOUT, app.quit)
+    window.show()
+    app.exec()
+    window.close()
+
+    # Модули отчетов при запуске не загружаются
+    marks["pdf_loaded"] = "fpdf" in sys.modules
+    line = json.dumps({"time": datetime.datetime.now().isoformat(timespec="seconds"), **marks})
+    print(line)
+    if output:
+        with open(output, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+    return 0 if "first_rows" in marks else 1
+
+
+if __name__ == "__main__":
+    # --startup-time [файл] - замер запуска окна
+    if sys.argv[1:2] == ["--startup-time"]:
+        sys.exit(measure_startup(sys.argv[2] if len(sys.argv) > 2 else None))
+
+    # Команда - командная строка (отчеты и выгрузки без окна, PyQt6 не загружается)
+    if sys.argv[1:2] and sys.argv[1] in CLI_COMMANDS:
+        from cli import main
+        sys.exit(main())
+
+    from PyQt6.QtWidgets import QApplication
+    from ui import App
+
+    app = QApplication(sys.argv)
+    window = App()
     window.show()
     app.exec()
@@ -0,0 +1,291 @@
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+import psycopg2.extensions
+
+from snapshots import estimate_size
+
+# Границы корзин гистограммы времени запросов, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Сколько последних медленных запросов хранится в памяти
+SLOW_LOG_SIZE = 200
+# Длина текста запроса в журнале медленных запросов
+MAX_LOGGED_QUERY = 4000
+
+# Кадры этих файлов пропускаются при поиске места вызова: интересен код, который
+# запросил данные (диалог, отчет, модель таблицы), а не обертки над курсором
+_INTERNAL_FILES = {os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), "db.py")}
+_PSYCOPG2_DIR = os.path.dirname(os.path.abspath(psycopg2.__file__))
+# EXPLAIN ANALYZE повторяет запрос, поэтому снимается только для чтения
+_READ_QUERY = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def call_site():
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in _INTERNAL_FILES and not filename.startswith(_PSYCOPG2_DIR):
+            return f"{os.path.basename(filename)}:{frame.f_code.co_qualname}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def query_text(query):
+    if isinstance(query, bytes):
+        return query.decode("utf-8", errors="replace")
+    return str(query)
+
+
+class SiteStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class QueryMetrics:
+    # Счетчики и гистограммы запросов по месту вызова и журнал медленных запросов.
+    # Пополняется из курсоров всех потоков
+    def __init__(self, slow_seconds=0.5, explain_seconds=None, log_path=None):
+        self.slow_seconds = slow_seconds
+        # Выше этого времени к записи журнала добавляется план EXPLAIN (ANALYZE, BUFFERS); None - не снимать
+        self.explain_seconds = explain_seconds
+        self.log_path = log_path
+        self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def configure(self, slow_seconds=None, explain_seconds=None, log_path=None):
+        self.slow_seconds = slow_seconds if slow_seconds is not None else self.slow_seconds
+        self.explain_seconds = explain_seconds
+        self.log_path = log_path
+
+    def _site(self, site):
+        stats = self._sites.get(site)
+        if stats is None:
+            stats = self._sites[site] = SiteStats()
+        return stats
+
+    def wants_plan(self, query, seconds):
+        return self.explain_seconds is not None and seconds >= self.explain_seconds and _READ_QUERY.match(query)
+
+    def add_fetched(self, site, rows, size):
+        with self._lock:
+            stats = self._site(site)
+            stats.rows += rows
+            stats.bytes += size
+
+    def record(self, site, query, seconds, rows=0, size=0, error=None, plan=None):
+        # Один завершенный запрос: время целиком (для серверного курсора - вместе с чтением порций)
+        slow = seconds >= self.slow_seconds
+        with self._lock:
+            stats = self._site(site)
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.errors += error is not None
+            stats.slow += slow
+            for number, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[number] += 1
+                    break
+        if not slow:
+            return
+
+        # Параметры не записываются: в них бывают персональные данные (ИНН, ФИО)
+        entry = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "site": site,
+            "seconds": round(seconds, 4),
+            "rows": rows,
+            "bytes": size,
+            "query": query[:MAX_LOGGED_QUERY],
+        }
+        if error is not None:
+            entry["error"] = error
+        if plan is not None:
+            entry["plan"] = plan
+        with self._lock:
+            self.slow_queries.append(entry)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def render(self):
+        # Текстовый формат Prometheus
+        with self._lock:
+            sites = sorted((site, stats) for site, stats in self._sites.items())
+            lines = [
+                "# HELP vokzal_query_duration_seconds Время выполнения запросов по месту вызова",
+                "# TYPE vokzal_query_duration_seconds histogram",
+            ]
+            for site, stats in sites:
+                label = f'site="{escape_label(site)}"'
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'vokzal_query_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'vokzal_query_duration_seconds_bucket{{{label},le="+Inf"}} {stats.calls}')
+                lines.append(f"vokzal_query_duration_seconds_sum{{{label}}} {stats.seconds:.6f}")
+                lines.append(f"vokzal_query_duration_seconds_count{{{label}}} {stats.calls}")
+            for name, attribute, help_text in (
+                ("vokzal_query_rows_total", "rows", "Строк возвращено или изменено"),
+                ("vokzal_query_fetched_bytes_total", "bytes", "Оценка объема полученных строк в памяти, байт"),
+                ("vokzal_query_errors_total", "errors", "Запросов, завершившихся ошибкой"),
+                ("vokzal_slow_queries_total", "slow", "Запросов дольше порога журнала медленных запросов"),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for site, stats in sites:
+                    lines.append(f'{name}{{site="{escape_label(site)}"}} {getattr(stats, attribute)}')
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+QUERY_METRICS = QueryMetrics()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    # Курсор, который сообщает о каждом запросе в QUERY_METRICS. Обычный курсор получает
+    # все строки при execute - запрос записывается сразу; серверный (именованный) читает
+    # их порциями - запрос записывается при закрытии или следующем execute
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Место вызова последнего запроса и незавершенный запрос серверного курсора:
+        # [место вызова, текст, параметры, секунды, строки, байты]
+        self._site = None
+        self._pending = None
+
+    def _run(self, method, query, params, *args):
+        self._finish()
+        site = self._site = call_site()
+        text = query_text(query)
+        started = time.perf_counter()
+        try:
+            result = method(*args)
+        except Exception as e:
+            QUERY_METRICS.record(site, text, time.perf_counter() - started, error=str(e).strip())
+            raise
+        seconds = time.perf_counter() - started
+        if self.name is None:
+            rows = max(self.rowcount, 0)
+            QUERY_METRICS.add_fetched(site, rows, 0)
+            QUERY_METRICS.record(site, text, seconds, rows, plan=self._plan(text, params, seconds))
+        else:
+            self._pending = [site, text, params, seconds, 0, 0]
+        return result
+
+    def execute(self, query, vars=None):
+        return self._run(super().execute, query, vars, query, vars)
+
+    def execute_as(self, statement, vars, query, params=None):
+        # Выполняется statement (EXECUTE подготовленного оператора), а записывается исходный
+        # запрос: по нему понятно, что выполнялось, и для него снимается план EXPLAIN
+        return self._run(super().execute, query, params, statement, vars)
+
+    def executemany(self, query, vars_list):
+        return self._run(super().executemany, query, None, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._run(super().copy_expert, sql, None, sql, file, size)
+
+    def _fetched(self, rows, started):
+        seconds = time.perf_counter() - started
+        size = estimate_size(rows) if rows else 0
+        if self._pending is not None:
+            # Серверный курсор: время ожидания порций входит во время запроса
+            self._pending[3] += seconds
+            self._pending[4] += len(rows)
+            self._pending[5] += size
+            QUERY_METRICS.add_fetched(self._pending[0], len(rows), size)
+        elif size and self._site is not None:
+            QUERY_METRICS.add_fetched(self._site, 0, size)
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched([row] if row is not None else [], started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        return self._fetched(super().fetchmany(size) if size is not None else super().fetchmany(), started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        return self._fetched(super().fetchall(), started)
+
+    def _plan(self, query, params, seconds):
+        # План снимается повторным выполнением в точке сохранения: побочные эффекты откатываются,
+        # а ошибка EXPLAIN не прерывает транзакцию вызывающего кода. Серверный курсор обычно
+        # читается не до конца - для него только план без выполнения
+        if not QUERY_METRICS.wants_plan(query, seconds):
+            return None
+        connection = self.connection
+        if connection.closed or connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            return None
+        with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute("SAVEPOINT query_metrics_explain")
+            try:
+                options = "ANALYZE, BUFFERS" if self.name is None else "BUFFERS"
+                cursor.execute(f"EXPLAIN ({options}) {query}", params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            except psycopg2.Error as e:
+                plan = f"EXPLAIN failed: {str(e).strip()}"
+            cursor.execute("ROLLBACK TO SAVEPOINT query_metrics_explain")
+            cursor.execute("RELEASE SAVEPOINT query_metrics_explain")
+        return plan
+
+    def _finish(self):
+        if self._pending is None:
+            return
+        (site, text, params, seconds, rows, size), self._pending = self._pending, None
+        plan = None
+        try:
+            plan = self._plan(text, params, seconds)
+        except psycopg2.Error:
+            pass
+        QUERY_METRICS.record(site, text, seconds, rows, size, plan=plan)
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = QUERY_METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    # Метрики отдаются по HTTP (GET /metrics) из фонового потока; остановка - server.shutdown()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
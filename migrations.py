@@ -0,0 +1,255 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+import psycopg2
+
+from db import query_plan
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), "scripts")
+MIGRATIONS_DIR = os.path.join(SCRIPTS_DIR, "migrations")
+# Исходная схема в порядке применения - такая, какой создавались базы до появления миграций
+# (в существующей базе она отмечается примененной, поэтому не меняется); за ней идут миграции
+# из scripts/migrations по номеру, и любое изменение схемы - только новой миграцией
+BASE_SCRIPTS = ("tables.sql", "indexes.sql", "views.sql", "triggers.sql")
+# Пример данных для пустой базы - только по явному запросу (--sample-data), после миграций
+SAMPLE_DATA = "insert.sql"
+# Ключ блокировки: два запуска одновременно не применяют одну миграцию дважды
+MIGRATION_LOCK = 7301
+# Проверка с выключенными последовательным и индексным чтением показывает, что путь по индексу
+# есть, но не что планировщик выберет его при настоящей статистике
+INDEX_CHECK_NOTE = "путь по индексу есть; выбор планировщика не проверяется"
+
+# Поиск кодов по наименованиям и маршрута по коду в триггерах INSTEAD OF (scripts/triggers.sql)
+# (таблица, столбец условия, запрос, параметры)
+TRIGGER_LOOKUPS = (
+    ("stations", "name", "SELECT station_code FROM stations WHERE name = %s", ("",)),
+    ("train_types", "name", "SELECT train_type_code FROM train_types WHERE name = %s", ("",)),
+    ("positions", "name", "SELECT position_code FROM positions WHERE name = %s", ("",)),
+    ("brigades", "name", "SELECT brigade_code FROM brigades WHERE name = %s", ("",)),
+    ("routes", "route_code", "SELECT departure_time FROM routes WHERE route_code = %s", (0,)),
+)
+
+
+def migration_files():
+    # [(версия, путь)]: версия - путь относительно scripts, по ней миграция записывается как примененная
+    files = [(name, os.path.join(SCRIPTS_DIR, name)) for name in BASE_SCRIPTS]
+    if os.path.isdir(MIGRATIONS_DIR):
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if name.endswith(".sql"):
+                files.append((f"migrations/{name}", os.path.join(MIGRATIONS_DIR, name)))
+    return files
+
+
+def checksum(script):
+    return hashlib.sha256(script.encode("utf-8")).hexdigest()
+
+
+def applied_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+def apply_migrations(connection, log=print, sample_data=False):
+    # Каждая миграция применяется один раз в своей транзакции и записывается в schema_migrations;
+    # повторный запуск применяет только новые. sample_data - загрузить пример данных, если база
+    # пуста. Возвращает список примененных версий
+    files = []
+    for version, path in migration_files():
+        with open(path, "rb") as file:
+            files.append((version, file.read().decode("utf-8")))
+    applied = []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+        try:
+            done = applied_migrations(cursor)
+            connection.commit()
+
+            # База создана скриптами до появления миграций: исходная схема считается примененной
+            if not done:
+                cursor.execute("SELECT to_regclass('stations') IS NOT NULL")
+                if cursor.fetchone()[0]:
+                    for version, script in files:
+                        if version in BASE_SCRIPTS:
+                            done[version] = checksum(script)
+                            cursor.execute("INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s)",
+                                           (version, done[version]))
+                    connection.commit()
+                    log("Исходная схема уже создана, отмечена как примененная")
+
+            for version, script in files:
+                if version in done:
+                    if done[version] != checksum(script):
+                        log(f"Миграция {version} изменена после применения, повторно не применяется")
+                    continue
+                try:
+                    cursor.execute(script)
+                    cursor.execute("INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s)",
+                                   (version, checksum(script)))
+                    connection.commit()
+                except psycopg2.Error:
+                    connection.rollback()
+                    raise
+                applied.append(version)
+                log(f"Применена миграция {version}")
+
+            if sample_data:
+                load_sample_data(connection, cursor, log)
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+            connection.commit()
+    return applied
+
+
+def load_sample_data(connection, cursor, log=print):
+    # Пример данных только для пустой базы: в рабочую базу его строки не попадут
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM stations)")
+    if cursor.fetchone()[0]:
+        log("В базе уже есть данные, пример данных не загружается")
+        return
+    with open(os.path.join(SCRIPTS_DIR, SAMPLE_DATA), "rb") as file:
+        script = file.read().decode("utf-8")
+    try:
+        cursor.execute(script)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    log("Загружен пример данных")
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def uses_index(cursor, query, params, table, column):
+    # Читается ли таблица (или ее секции) по индексу, начинающемуся со столбца условия.
+    # Разрешено только чтение по битовой карте: она строится лишь из условий запроса,
+    # подходящих индексу, поэтому полный проход индекса не сойдет за поиск по нему.
+    # На маленьких таблицах планировщик иначе выбрал бы последовательное чтение, даже
+    # когда индекс есть, а проверяется именно наличие индекса
+    cursor.execute("SELECT relid::regclass::TEXT FROM pg_partition_tree(%s::regclass)", (table,))
+    relations = {row[0] for row in cursor.fetchall()} | {table}
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    cursor.execute("SET LOCAL enable_indexscan = off")
+    cursor.execute("SET LOCAL enable_indexonlyscan = off")
+    nodes = [node for node in plan_nodes(query_plan(cursor, query, params)) if node.get("Relation Name") in relations]
+    if nodes and all(node["Node Type"] == "Bitmap Heap Scan" for node in nodes):
+        indexes = list({child["Index Name"] for node in nodes for child in plan_nodes(node) if "Index Name" in child})
+        # Индексы секций показываются именем индекса секционированной таблицы
+        cursor.execute("""
+            SELECT c.relname, p.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relname = ANY(%s) AND c.relkind = 'i'
+        """, (indexes,))
+        parents = dict(cursor.fetchall())
+        indexes = sorted({parents.get(index, index) for index in indexes})
+        # Индекс по столбцу не первым ключом или триграммный проходит весь индекс, а не ищет в нем
+        cursor.execute("""
+            SELECT i.relname
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_am a ON a.oid = i.relam
+            JOIN pg_attribute c ON c.attrelid = x.indrelid AND c.attnum = x.indkey[0]
+            WHERE i.relname = ANY(%s) AND c.attname = %s AND a.amname IN ('btree', 'hash')
+        """, (indexes, column))
+        if cursor.fetchone() is not None:
+            return True, ", ".join(indexes)
+        return False, f"индексы без {column} первым столбцом: {', '.join(indexes)}"
+    return False, ", ".join(sorted({f"{node['Node Type']} on {node['Relation Name']}" for node in nodes})) or "таблица не читается"
+
+
+def sample_report_values(report, batch=False):
+    # Значения параметров для EXPLAIN: важны типы, а не сами значения.
+    # В пакете значения выпадающих списков - списки выбранных вариантов
+    now = datetime.datetime.now().replace(microsecond=0)
+    values = {}
+    for param in report["params"]:
+        if param["type"] == "datetime":
+            values[param["name"]] = now if param["name"] == "end_date" else now - datetime.timedelta(days=365)
+        elif param["type"] == "integer":
+            values[param["name"]] = param.get("default", param.get("min", 0))
+        elif param["type"] == "order":
+            values[param["name"]] = param["options"][0][0]
+        else:
+            values[param["name"]] = [""] if batch else ""
+    return values
+
+
+def check_indexes(connection, reports):
+    # [(проверка, таблица.столбец, индекс используется, индексы или найденные способы чтения)]
+    checks = []
+    if reports:
+        # Модуль отчетов (fpdf2, fontTools) нужен только для текста их запросов: миграции
+        # применяются и без него
+        from reports import ReportEngine
+        engine = ReportEngine(reports)
+    for name, report in reports.items():
+        columns = report.get("indexed_columns", {})
+        checks.append((f"отчет {name}", *engine.build_query(name, sample_report_values(report)), columns))
+        if "batch" in report:
+            query, params = engine.build_query(name, sample_report_values(report, batch=True), batch=True)
+            checks.append((f"пакет {name}", query, params, columns))
+    for table, column, query, params in TRIGGER_LOOKUPS:
+        checks.append((f"триггер: поиск в {table}", query, params, {table: column}))
+
+    results = []
+    with connection.cursor() as cursor:
+        for check, query, params, columns in checks:
+            for table, column in columns.items():
+                results.append((check, f"{table}.{column}", *uses_index(cursor, query, params, table, column)))
+                connection.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы вокзала")
+    parser.add_argument("--dbname", default="vokzal")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD"))
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--check", action="store_true", help="только проверить планы отчетов и триггеров")
+    parser.add_argument("--sample-data", action="store_true", help="загрузить пример данных в пустую базу")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(dbname=args.dbname, user=args.user, password=args.password,
+                                  host=args.host, port=args.port)
+    try:
+        if not args.check:
+            applied = apply_migrations(connection, sample_data=args.sample_data)
+            if not applied:
+                print("Новых миграций нет")
+
+        with open(os.path.join(os.path.dirname(__file__), "report_metadata.json"), "r", encoding="utf-8") as file:
+            reports = json.load(file)
+        try:
+            results = check_indexes(connection, reports)
+        except ImportError as e:
+            print(f"Запросы отчетов не проверяются: нет модуля {e.name}")
+            results = check_indexes(connection, {})
+        failed = 0
+        for check, table, ok, detail in results:
+            print(f"{'OK  ' if ok else 'НЕТ '} {check}: {table} ({detail}{'; ' + INDEX_CHECK_NOTE if ok else ''})")
+            failed += not ok
+        return 1 if failed else 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from io import BytesIO
+
+import psycopg2.extensions
+from fontTools import ttLib
+from fpdf import FPDF
+
+from db import execute_prepared
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
+FONT_FAMILY = "TimesNewRoman"
+FONT_FILES = (("", "timesnrcyrmt.ttf"), ("B", "timesnrcyrmt_bold.ttf"))
+# Таблицы шрифта, не нужные в PDF: fpdf2 разбирает и собирает их заново при каждом сохранении подмножества
+UNUSED_FONT_TABLES = ("VDMX", "hdmx", "LTSH")
+
+# Сколько строк отчета забирается с сервера за раз: в памяти одновременно только одна порция
+CHUNK_SIZE = 2000
+CELL_HEIGHT = 10
+# Файл со списком отчетов пакета
+BATCH_INDEX_FILE = "index.csv"
+
+
+class FontCache:
+    # Шрифты разбираются один раз на процесс. Документ получает копию метрик (общие таблицы
+    # символов и ширин не копируются) и свой экземпляр файла шрифта: при сохранении fpdf2
+    # урезает его до использованных символов, поэтому делить его между документами нельзя
+    def __init__(self, family, files):
+        self.family = family
+        self.files = files
+        self._fonts = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        prototype = FPDF()
+        fonts = {}
+        for style, file_name in self.files:
+            path = os.path.join(FONT_DIR, file_name)
+            prototype.add_font(self.family, style=style, fname=path)
+            font = prototype.fonts[f"{self.family.lower()}{style}"]
+
+            # Облегченная копия файла без лишних таблиц, из нее открываются шрифты документов
+            ttfont = ttLib.TTFont(path, recalcTimestamp=False)
+            for tag in UNUSED_FONT_TABLES:
+                if tag in ttfont:
+                    del ttfont[tag]
+            buffer = BytesIO()
+            ttfont.save(buffer)
+            fonts[font.fontkey] = (font, buffer.getvalue())
+        return fonts
+
+    def add_to(self, pdf):
+        with self._lock:
+            if self._fonts is None:
+                self._fonts = self._load()
+            fonts = self._fonts
+
+        for fontkey, (font, data) in fonts.items():
+            copy = deepcopy(font)
+            # Файл открывается лениво: таблицы читаются, только когда понадобятся при сохранении
+            copy.ttfont = ttLib.TTFont(BytesIO(data), recalcBBoxes=False, recalcTimestamp=False, lazy=True)
+            pdf.fonts[fontkey] = copy
+
+
+FONT_CACHE = FontCache(FONT_FAMILY, FONT_FILES)
+
+
+class ReportPdf(FPDF):
+    # Заголовок отчета печатается на первой странице, шапка таблицы - на каждой
+    def __init__(self, title, columns):
+        super().__init__()
+        self.report_title = title
+        self.columns = columns
+
+        # Шрифты берутся из общего кэша, файлы TrueType не разбираются заново
+        FONT_CACHE.add_to(self)
+        self.add_page()
+
+    def header(self):
+        if self.page_no() == 1:
+            self.set_font(FONT_FAMILY, style="B", size=16)
+            self.cell(0, CELL_HEIGHT, self.report_title, new_x="LMARGIN", new_y="NEXT", align="C")
+            self.ln(10)  # Отступ
+
+        self.set_font(FONT_FAMILY, style="B", size=12)
+        for column in self.columns:
+            self.cell(column["width"], CELL_HEIGHT, column["header"], border=1, align="C")
+        self.ln()
+        self.set_font(FONT_FAMILY, size=12)
+
+    def add_rows(self, rows):
+        for row in rows:
+            # Строка целиком переносится на новую страницу, а не разрывается между ячейками
+            if self.will_page_break(CELL_HEIGHT):
+                self.add_page()
+            for column, value in zip(self.columns, row):
+                self.cell(column["width"], CELL_HEIGHT, "" if value is None else str(value),
+                          border=1, align=column.get("align", "C"))
+            self.ln()
+
+
+def render_report_file(title, columns, rows, file_path):
+    # Выполняется и в процессах пула: строки уже прочитаны, процесс только строит PDF
+    pdf = ReportPdf(title, columns)
+    pdf.add_rows(rows)
+    pdf.output(file_path)
+    return len(rows)
+
+
+def batch_file_name(stem, key, used_names):
+    # Имя файла из значений группы (вокзал, месяц), уникальное в пределах пакета
+    name = "_".join([stem] + [re.sub(r"[^\w-]+", "_", str(value)).strip("_") for value in key])
+    file_name = f"{name}.pdf"
+    number = 1
+    while file_name in used_names:
+        number += 1
+        file_name = f"{name}_{number}.pdf"
+    used_names.add(file_name)
+    return file_name
+
+
+class ReportEngine:
+    # Отчеты объявляются в метаданных (запрос, параметры, столбцы и их ширина);
+    # строки читаются серверным курсором порциями и сразу выводятся в PDF
+    _names = itertools.count(1)
+
+    def __init__(self, reports):
+        self.reports = reports
+
+    def build_query(self, name, values, batch=False):
+        # В текст запроса подставляются только объявленные в метаданных фрагменты (варианты сортировки),
+        # остальные значения передаются параметрами
+        report = self.reports[name]
+        query = report["batch"]["query"] if batch else report["query"]
+        fragments = {}
+        params = {}
+        for param in report["params"]:
+            value = values[param["name"]]
+            if param["type"] == "order":
+                fragments[param["name"]] = dict(param["options"])[value]
+            else:
+                params[param["name"]] = value
+        return "\n".join(query).format(**fragments), params
+
+    def render(self, connection, name, values, file_path, chunk_size=CHUNK_SIZE, is_cancelled=None):
+        # Возвращает число строк отчета; пустой отчет в файл не сохраняется
+        report = self.reports[name]
+        query, params = self.build_query(name, values)
+
+        pdf = None
+        row_count = 0
+        with connection.cursor(name=f"report_{next(ReportEngine._names)}") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                # Отмена между порциями: пока строится PDF, запроса на сервере нет
+                if is_cancelled is not None and is_cancelled():
+                    raise psycopg2.extensions.QueryCanceledError("report cancelled")
+                if pdf is None:
+                    pdf = ReportPdf(report["title"], report["columns"])
+                pdf.add_rows(rows)
+                row_count += len(rows)
+
+        if pdf is not None:
+            pdf.output(file_path)
+        return row_count
+
+    def render_batch(self, connection, name, values, directory, processes=None, is_cancelled=None):
+        # Пакет отчетов (например, по каждому вокзалу и месяцу): один сгруппированный запрос,
+        # строки делятся по первым столбцам ("group_columns"), PDF строятся параллельно в процессах.
+        # Возвращает [(значения группы, имя файла, число строк)]
+        report = self.reports[name]
+        batch = report["batch"]
+        group_size = len(batch["group_columns"])
+        query, params = self.build_query(name, values, batch=True)
+
+        groups = {}
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, query, params)
+            for row in cursor:
+                groups.setdefault(row[:group_size], []).append(row[group_size:])
+        if not groups:
+            return []
+
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.splitext(report["file_name"])[0]
+        used_names = set()
+        tasks = []
+        for key, rows in groups.items():
+            title = f"{report['title']}: {', '.join(str(value) for value in key)}"
+            file_name = batch_file_name(stem, key, used_names)
+            tasks.append((key, file_name, (title, report["columns"], rows, os.path.join(directory, file_name))))
+
+        processes = min(processes or os.cpu_count() or 1, len(tasks))
+        results = []
+        if processes <= 1:
+            # Запуск процессов дороже, чем один файл или одно ядро
+            for key, file_name, args in tasks:
+                if is_cancelled is not None and is_cancelled():
+                    raise psycopg2.extensions.QueryCanceledError("report cancelled")
+                results.append((key, file_name, render_report_file(*args)))
+        else:
+            # spawn, а не fork: процесс интерфейса держит потоки Qt и соединения с базой
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+                futures = [(key, file_name, pool.submit(render_report_file, *args)) for key, file_name, args in tasks]
+                for key, file_name, future in futures:
+                    if is_cancelled is not None and is_cancelled():
+                        pool.shutdown(cancel_futures=True)
+                        raise psycopg2.extensions.QueryCanceledError("report cancelled")
+                    results.append((key, file_name, future.result()))
+
+        with open(os.path.join(directory, BATCH_INDEX_FILE), "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(batch["group_columns"] + ["row_count", "file_name"])
+            for key, file_name, row_count in results:
+                writer.writerow(list(key) + [row_count, file_name])
+        return results
@@ -1,3 +1,9 @@
+-- Пример данных для пустой базы (python migrations.py --sample-data): загружается после миграций,
+-- поэтому строки уже в нынешней схеме
+
+-- Секция маршрутов за месяц примера
+SELECT create_route_partitions('2024-11-01', '2024-11-30');
+
 -- Заполнение таблицы stations
 INSERT INTO stations (name, inn, address)
 VALUES 
@@ -48,18 +54,18 @@ VALUES
     (3, 3, 3, 1, '2024-11-16 10:00:00', '2024-11-16 18:00:00');
 
 -- Заполнение таблицы route_data
-INSERT INTO route_data (route_code, stop_number, station_code, arrival_time, departure_time)
+INSERT INTO route_data (route_code, stop_number, station_code, arrival_time, departure_time, route_departure_time)
 VALUES 
-    (1, 1, 1, NULL, '2024-11-15 08:00:00'),
-    (1, 2, 2, '2024-11-15 12:00:00', NULL),
-    (2, 1, 2, NULL, '2024-11-15 14:00:00'),
-    (2, 2, 3, '2024-11-15 18:00:00', NULL),
-    (3, 1, 3, NULL, '2024-11-16 10:00:00'),
-    (3, 2, 1, '2024-11-16 18:00:00', NULL);
+    (1, 1, 1, NULL, '2024-11-15 08:00:00', '2024-11-15 08:00:00'),
+    (1, 2, 2, '2024-11-15 12:00:00', NULL, '2024-11-15 08:00:00'),
+    (2, 1, 2, NULL, '2024-11-15 14:00:00', '2024-11-15 14:00:00'),
+    (2, 2, 3, '2024-11-15 18:00:00', NULL, '2024-11-15 14:00:00'),
+    (3, 1, 3, NULL, '2024-11-16 10:00:00', '2024-11-16 10:00:00'),
+    (3, 2, 1, '2024-11-16 18:00:00', NULL, '2024-11-16 10:00:00');
 
 -- Заполнение таблицы route_brigades
-INSERT INTO route_brigades (route_code, brigade_code)
+INSERT INTO route_brigades (route_code, brigade_code, route_departure_time)
 VALUES 
-    (1, 1),
-    (2, 2),
-    (3, 3);
\ No newline at end of file
+    (1, 1, '2024-11-15 08:00:00'),
+    (2, 2, '2024-11-15 14:00:00'),
+    (3, 3, '2024-11-16 10:00:00');
\ No newline at end of file
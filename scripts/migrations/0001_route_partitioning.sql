@@ -0,0 +1,307 @@
+-- Маршруты и их остановки секционируются по месяцу отправления маршрута: отчеты за период
+-- читают только нужные секции, а VACUUM и перестроение индексов работают с одной секцией.
+-- Ключ секционирования входит в первичный ключ, поэтому ссылки на маршрут становятся
+-- составными: (код маршрута, время отправления маршрута). Секционировать существующую
+-- таблицу нельзя - строки переносятся в новые таблицы, старые удаляются
+
+-- Представления над маршрутами пересоздаются в конце (вместе с их триггерами)
+DROP VIEW route_stops;
+DROP VIEW brigade_routes;
+
+-- Старые таблицы на время переноса уходят в отдельную схему вместе с индексами и ограничениями,
+-- поэтому новые таблицы получают прежние имена ограничений и индексов. Последовательность кодов
+-- маршрутов остается в public: ее отвязывают от старой таблицы до переноса
+ALTER SEQUENCE routes_route_code_seq OWNED BY NONE;
+CREATE SCHEMA route_partitioning;
+ALTER TABLE route_data SET SCHEMA route_partitioning;
+ALTER TABLE routes SET SCHEMA route_partitioning;
+
+-- Коды маршрутов продолжают ту же последовательность
+CREATE TABLE routes (
+    route_code INT NOT NULL DEFAULT nextval('routes_route_code_seq'),  -- код маршрута
+    owner_station_code INT NOT NULL,      -- код вокзала владельца
+    train_code INT NOT NULL,              -- код поезда
+    departure_station_code INT NOT NULL,  -- код вокзала отправления
+    arrival_station_code INT NOT NULL,    -- код вокзала прибытия
+    departure_time TIMESTAMP NOT NULL,    -- время отправления (ключ секционирования)
+    arrival_time TIMESTAMP NOT NULL,      -- время прибытия
+    PRIMARY KEY (route_code, departure_time),
+    FOREIGN KEY (owner_station_code) REFERENCES stations(station_code)
+        ON DELETE CASCADE,                -- удаление маршрута при удалении вокзала-владельца
+    FOREIGN KEY (train_code) REFERENCES trains(train_code)
+        ON DELETE CASCADE,                -- удаление маршрута при удалении поезда
+    FOREIGN KEY (departure_station_code) REFERENCES stations(station_code),
+    FOREIGN KEY (arrival_station_code) REFERENCES stations(station_code)
+) PARTITION BY RANGE (departure_time);
+
+ALTER SEQUENCE routes_route_code_seq OWNED BY routes.route_code;
+
+CREATE TABLE route_data (
+    route_code INT NOT NULL,              -- код маршрута
+    stop_number INT NOT NULL,             -- номер остановки
+    station_code INT NOT NULL,            -- код вокзала остановки
+    arrival_time TIMESTAMP,               -- время прибытия
+    departure_time TIMESTAMP,             -- время убытия
+    route_departure_time TIMESTAMP NOT NULL,  -- время отправления маршрута (ключ секционирования)
+    PRIMARY KEY (route_code, route_departure_time, stop_number),
+    CONSTRAINT route_data_route_fkey FOREIGN KEY (route_code, route_departure_time)
+        REFERENCES routes(route_code, departure_time)
+        ON DELETE CASCADE                 -- удаление остановок при удалении маршрута
+        ON UPDATE CASCADE,                -- перенос остановок при переносе маршрута
+    FOREIGN KEY (station_code) REFERENCES stations(station_code)
+) PARTITION BY RANGE (route_departure_time);
+
+
+-- Создание месячных секций routes и route_data, покрывающих период [from_time, to_time].
+-- Уже существующие секции пропускаются, поэтому функцию можно вызывать перед каждой загрузкой.
+-- Секция создается отдельной таблицей и присоединяется (ATTACH PARTITION): это не блокирует
+-- чтение родительской таблицы, в отличие от CREATE TABLE ... PARTITION OF
+CREATE OR REPLACE FUNCTION create_route_partitions(from_time TIMESTAMP, to_time TIMESTAMP)
+RETURNS INT
+SET lock_timeout = '5s'
+AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', from_time);
+    month_end TIMESTAMP;
+    suffix TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month_start <= to_time LOOP
+        month_end := month_start + INTERVAL '1 month';
+        suffix := to_char(month_start, '"y"YYYY"m"MM');
+
+        IF to_regclass('routes_' || suffix) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE routes INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', 'routes_' || suffix);
+            EXECUTE format(
+                'ALTER TABLE routes ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                'routes_' || suffix, month_start, month_end
+            );
+            created := created + 1;
+        END IF;
+        IF to_regclass('route_data_' || suffix) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE route_data INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', 'route_data_' || suffix);
+            EXECUTE format(
+                'ALTER TABLE route_data ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                'route_data_' || suffix, month_start, month_end
+            );
+        END IF;
+
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Перенос в схему archive секций за месяцы, целиком закончившиеся до before_time.
+-- Отсоединенные таблицы больше не читаются запросами к routes/route_data;
+-- их можно выгрузить (pg_dump -n archive) и удалить
+CREATE OR REPLACE FUNCTION archive_route_partitions(before_time TIMESTAMP)
+RETURNS INT AS $$
+DECLARE
+    partition RECORD;
+    suffix TEXT;
+    archived INT := 0;
+BEGIN
+    -- Границы месячной секции восстанавливаются по ее имени (routes_yYYYYmMM)
+    FOR partition IN
+        SELECT
+            c.relname,
+            to_timestamp(substr(c.relname, length('routes_') + 1), '"y"YYYY"m"MM')::TIMESTAMP AS range_start
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'routes'::regclass AND c.relname ~ '^routes_y[0-9]{4}m[0-9]{2}$'
+        ORDER BY range_start
+    LOOP
+        CONTINUE WHEN partition.range_start + INTERVAL '1 month' > before_time;
+        suffix := substr(partition.relname, length('routes_') + 1);
+
+        -- Связи бригад с архивными маршрутами переносятся в архивную таблицу
+        WITH moved AS (
+            DELETE FROM route_brigades
+            WHERE route_departure_time >= partition.range_start
+                AND route_departure_time < partition.range_start + INTERVAL '1 month'
+            RETURNING *
+        )
+        INSERT INTO archive.route_brigades SELECT * FROM moved;
+
+        -- Сначала остановки: пока они ссылаются на маршруты, секцию маршрутов отсоединить нельзя
+        IF to_regclass('route_data_' || suffix) IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE route_data DETACH PARTITION %I', 'route_data_' || suffix);
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT IF EXISTS route_data_route_fkey', 'route_data_' || suffix);
+            EXECUTE format('ALTER TABLE %I SET SCHEMA archive', 'route_data_' || suffix);
+        END IF;
+
+        EXECUTE format('ALTER TABLE routes DETACH PARTITION %I', partition.relname);
+        EXECUTE format('ALTER TABLE %I SET SCHEMA archive', partition.relname);
+        archived := archived + 1;
+    END LOOP;
+    RETURN archived;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Секции на все месяцы с маршрутами и на год вперед
+SELECT create_route_partitions(
+    COALESCE((SELECT min(departure_time) FROM route_partitioning.routes), now()::TIMESTAMP),
+    GREATEST((SELECT max(departure_time) FROM route_partitioning.routes), now()::TIMESTAMP + INTERVAL '12 months')
+);
+
+INSERT INTO routes (route_code, owner_station_code, train_code, departure_station_code, arrival_station_code,
+                    departure_time, arrival_time)
+SELECT route_code, owner_station_code, train_code, departure_station_code, arrival_station_code,
+    departure_time, arrival_time
+FROM route_partitioning.routes;
+
+INSERT INTO route_data (route_code, stop_number, station_code, arrival_time, departure_time, route_departure_time)
+SELECT rd.route_code, rd.stop_number, rd.station_code, rd.arrival_time, rd.departure_time, r.departure_time
+FROM route_partitioning.route_data rd
+JOIN route_partitioning.routes r ON r.route_code = rd.route_code;
+
+-- Связи бригад ссылаются на маршрут составным ключом
+ALTER TABLE route_brigades ADD COLUMN route_departure_time TIMESTAMP;  -- время отправления маршрута
+UPDATE route_brigades rb
+SET route_departure_time = r.departure_time
+FROM route_partitioning.routes r
+WHERE r.route_code = rb.route_code;
+ALTER TABLE route_brigades ALTER COLUMN route_departure_time SET NOT NULL;
+ALTER TABLE route_brigades DROP CONSTRAINT route_brigades_route_code_fkey;
+ALTER TABLE route_brigades ADD CONSTRAINT route_brigades_route_fkey FOREIGN KEY (route_code, route_departure_time)
+    REFERENCES routes(route_code, departure_time)
+    ON DELETE CASCADE                 -- удаление связи при удалении маршрута
+    ON UPDATE CASCADE;                -- перенос связи при переносе маршрута
+
+DROP SCHEMA route_partitioning CASCADE;
+
+-- Архив: сюда переносятся отсоединенные старые секции и связи бригад с их маршрутами
+CREATE SCHEMA IF NOT EXISTS archive;
+
+CREATE TABLE archive.route_brigades (LIKE route_brigades);
+
+-- Индексы исходной схемы (indexes.sql) на новых таблицах
+CREATE INDEX idx_route_data_station ON route_data (station_code);
+CREATE INDEX idx_route_data_arrival_time ON route_data (arrival_time);
+CREATE INDEX idx_route_data_departure_time ON route_data (departure_time);
+CREATE INDEX idx_route_departure_station ON routes (departure_station_code);
+CREATE INDEX idx_route_arrival_station ON routes (arrival_station_code);
+
+
+-- Полный список остановок для каждого маршрута
+CREATE VIEW route_stops AS
+SELECT 
+    r.route_code,                         -- Код маршрута
+    t.name AS train_name,                 -- Название поезда
+    s.name AS station_name,               -- Наименование вокзала
+    rd.stop_number,                       -- Номер остановки
+    rd.arrival_time,                      -- Время прибытия
+    rd.departure_time,                    -- Время отправления
+    rd.route_departure_time               -- Время отправления маршрута (секция остановки)
+FROM 
+    route_data rd
+JOIN 
+    routes r ON rd.route_code = r.route_code AND rd.route_departure_time = r.departure_time
+JOIN 
+    trains t ON r.train_code = t.train_code
+JOIN 
+    stations s ON rd.station_code = s.station_code
+ORDER BY 
+    r.route_code, rd.stop_number;
+
+
+-- Список бригад с информацией о маршрутах
+CREATE VIEW brigade_routes AS
+SELECT 
+    b.name AS brigade_name,              -- Название бригады
+    r.route_code,                        -- Код маршрута
+    s.name AS owner_station_name,        -- Вокзал-владелец маршрута
+    t.name AS train_name,                -- Название поезда
+    rb.brigade_code                      -- Код бригады (ключ строки)
+FROM 
+    route_brigades rb
+JOIN 
+    brigades b ON rb.brigade_code = b.brigade_code
+JOIN 
+    routes r ON rb.route_code = r.route_code AND rb.route_departure_time = r.departure_time
+JOIN 
+    trains t ON r.train_code = t.train_code
+JOIN 
+    stations s ON r.owner_station_code = s.station_code;
+
+
+-- Создание триггера
+CREATE OR REPLACE FUNCTION insert_route_stops() RETURNS TRIGGER AS $$
+BEGIN
+    -- Вставляем данные в route_data
+    INSERT INTO route_data (route_code, stop_number, station_code, arrival_time, departure_time, route_departure_time)
+	SELECT 
+		NEW.route_code, 
+		NEW.stop_number, 
+		s.station_code, 
+		NEW.arrival_time, 
+		NEW.departure_time,
+		r.departure_time                -- Время отправления маршрута определяет секцию
+    FROM 
+        stations s
+    JOIN 
+        routes r ON r.route_code = NEW.route_code
+	WHERE 
+        s.name = NEW.station_name;
+    
+    -- Вокзал или маршрут не найден: строка не добавлена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возвращаем строку, чтобы INSERT ... RETURNING отдал ключ новой записи
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем триггер к таблице
+CREATE TRIGGER trigger_insert_route_stops
+INSTEAD OF INSERT ON route_stops
+FOR EACH ROW EXECUTE FUNCTION insert_route_stops();
+
+
+-- Создание функции триггера
+CREATE OR REPLACE FUNCTION insert_brigade_routes() RETURNS TRIGGER AS $$
+DECLARE
+    catched_brigade_code INT;  -- Переменная для хранения кода бригады
+BEGIN
+    -- Проверяем, существует ли бригада с таким названием
+    SELECT b.brigade_code INTO catched_brigade_code
+    FROM brigades b
+    WHERE b.name = NEW.brigade_name;
+
+    -- Если бригада не найдена, то добавляем её
+    IF NOT FOUND THEN
+        -- Вставляем новую бригаду в таблицу brigades
+        INSERT INTO brigades (name)
+        VALUES (NEW.brigade_name)
+        RETURNING brigade_code INTO catched_brigade_code;
+    END IF;
+
+    -- Вставляем данные в таблицу route_brigades
+    INSERT INTO route_brigades (route_code, brigade_code, route_departure_time)
+    SELECT 
+        NEW.route_code,                -- Код маршрута
+        catched_brigade_code,          -- Код бригады (полученный или только что вставленный)
+        r.departure_time               -- Время отправления маршрута (часть ссылки на маршрут)
+    FROM routes r
+    WHERE r.route_code = NEW.route_code;
+
+    -- Маршрут не найден: строка не добавлена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возвращаем строку с кодом бригады, чтобы INSERT ... RETURNING отдал ключ новой записи
+    NEW.brigade_code := catched_brigade_code;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем триггер к представлению
+CREATE TRIGGER trigger_insert_brigade_routes
+INSTEAD OF INSERT ON brigade_routes
+FOR EACH ROW EXECUTE FUNCTION insert_brigade_routes();
@@ -0,0 +1,19 @@
+-- Индексы поиска по мере ввода: триграммные для подстроки и сходства, B-tree для времени маршрутов
+
+-- для поиска по подстроке (ILIKE '%...%') и ранжирования по сходству
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX idx_stations_name_trgm ON stations USING gin (name gin_trgm_ops);
+CREATE INDEX idx_stations_address_trgm ON stations USING gin (address gin_trgm_ops);
+CREATE INDEX idx_stations_inn_trgm ON stations USING gin ((inn::text) gin_trgm_ops);
+CREATE INDEX idx_train_types_name_trgm ON train_types USING gin (name gin_trgm_ops);
+CREATE INDEX idx_trains_name_trgm ON trains USING gin (name gin_trgm_ops);
+CREATE INDEX idx_trains_country_trgm ON trains USING gin (country_of_origin gin_trgm_ops);
+CREATE INDEX idx_positions_name_trgm ON positions USING gin (name gin_trgm_ops);
+CREATE INDEX idx_brigades_name_trgm ON brigades USING gin (name gin_trgm_ops);
+CREATE INDEX idx_staff_fio_trgm ON staff USING gin (fio gin_trgm_ops);
+CREATE INDEX idx_staff_inn_trgm ON staff USING gin ((inn::text) gin_trgm_ops);
+
+-- для поиска маршрутов по дате отправления/прибытия
+CREATE INDEX idx_route_departure_time ON routes (departure_time);
+CREATE INDEX idx_route_arrival_time ON routes (arrival_time);
@@ -0,0 +1,246 @@
+-- Ключи строк в представлениях и изменение записей одним UPDATE: представления отдают ключ
+-- строки, триггеры INSTEAD OF INSERT возвращают добавленную строку (INSERT ... RETURNING),
+-- а INSTEAD OF UPDATE изменяют строку по прежнему ключу
+
+
+-- Поезда за каждым вокзалом
+CREATE OR REPLACE VIEW station_trains AS
+SELECT 
+    s.name AS station_name,           -- Наименование вокзала
+    tt.name AS train_type_name,       -- Тип поезда
+    t.name AS train_name,             -- Название поезда
+    t.country_of_origin,              -- Страна-производитель
+    t.train_code                      -- Код поезда (ключ строки)
+FROM 
+    stations s
+JOIN 
+    trains t ON s.station_code = t.station_code
+JOIN 
+    train_types tt ON t.train_type_code = tt.train_type_code;
+
+
+-- Создание триггера
+CREATE OR REPLACE FUNCTION insert_station_train() RETURNS TRIGGER AS $$
+BEGIN
+    -- Вставка данных в таблицу trains
+    INSERT INTO trains (station_code, train_type_code, name, country_of_origin)
+    SELECT 
+        s.station_code, 
+        tt.train_type_code, 
+        NEW.train_name, 
+        NEW.country_of_origin
+    FROM 
+        stations s
+    JOIN 
+        train_types tt ON tt.name = NEW.train_type_name
+    WHERE 
+        s.name = NEW.station_name
+    RETURNING train_code INTO NEW.train_code;
+
+    -- Вокзал или тип не найден: строка не добавлена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возвращаем строку с кодом поезда, чтобы INSERT ... RETURNING отдал ключ новой записи
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Создание функции триггера
+CREATE OR REPLACE FUNCTION insert_staff_details() RETURNS TRIGGER AS $$
+BEGIN
+    -- Вставляем данные в таблицу staff
+    INSERT INTO staff (inn, fio, age, gender, experience_years, position_code, brigade_code)
+    SELECT 
+        NEW.inn,                                -- ИНН сотрудника
+        NEW.fio,                                -- ФИО сотрудника
+        NEW.age,                                -- Возраст
+        NEW.gender,                             -- Пол
+        NEW.experience_years,                   -- Стаж работы
+        p.position_code,                        -- Код должности
+        b.brigade_code                          -- Код бригады
+    FROM 
+        positions p
+    LEFT JOIN brigades b ON NEW.brigade_name = b.name
+    WHERE p.name = NEW.position_name;
+    
+    -- Должность не найдена: строка не добавлена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возвращаем строку, чтобы INSERT ... RETURNING отдал ключ новой записи
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Создание функции триггера изменения поезда через представление
+CREATE OR REPLACE FUNCTION update_station_train() RETURNS TRIGGER AS $$
+BEGIN
+    -- Изменяем только строку поезда с прежним кодом
+    UPDATE trains t
+    SET 
+        station_code = s.station_code,
+        train_type_code = tt.train_type_code,
+        name = NEW.train_name,
+        country_of_origin = NEW.country_of_origin
+    FROM 
+        stations s
+    JOIN 
+        train_types tt ON tt.name = NEW.train_type_name
+    WHERE 
+        s.name = NEW.station_name
+        AND t.train_code = OLD.train_code;
+
+    -- Вокзал или тип не найден: строка не изменена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- Код поезда не меняется
+    NEW.train_code := OLD.train_code;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем триггер к представлению
+CREATE TRIGGER update_station_train_trigger
+INSTEAD OF UPDATE ON station_trains
+FOR EACH ROW EXECUTE FUNCTION update_station_train();
+
+
+-- Создание функции триггера изменения остановки через представление
+CREATE OR REPLACE FUNCTION update_route_stops() RETURNS TRIGGER AS $$
+DECLARE
+    new_route_departure_time TIMESTAMP;  -- Время отправления маршрута после изменения
+BEGIN
+    -- Остановка своего маршрута остается в той же секции; маршрут другой - время его
+    -- отправления ищется по коду (по одному коду секцию routes не определить)
+    IF NEW.route_code = OLD.route_code THEN
+        new_route_departure_time := OLD.route_departure_time;
+    ELSE
+        SELECT r.departure_time INTO new_route_departure_time
+        FROM routes r
+        WHERE r.route_code = NEW.route_code;
+
+        -- Маршрут не найден: строка не изменена
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    -- Изменяем остановку по прежнему ключу (маршрут, время его отправления, номер остановки):
+    -- время отправления в условии оставляет для поиска одну секцию route_data
+    UPDATE route_data rd
+    SET 
+        route_code = NEW.route_code,
+        stop_number = NEW.stop_number,
+        station_code = s.station_code,
+        arrival_time = NEW.arrival_time,
+        departure_time = NEW.departure_time,
+        route_departure_time = new_route_departure_time
+    FROM 
+        stations s
+    WHERE 
+        s.name = NEW.station_name
+        AND rd.route_code = OLD.route_code
+        AND rd.route_departure_time = OLD.route_departure_time
+        AND rd.stop_number = OLD.stop_number;
+
+    -- Вокзал не найден: строка не изменена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    NEW.route_departure_time := new_route_departure_time;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем триггер к представлению
+CREATE TRIGGER trigger_update_route_stops
+INSTEAD OF UPDATE ON route_stops
+FOR EACH ROW EXECUTE FUNCTION update_route_stops();
+
+
+-- Создание функции триггера изменения сотрудника через представление
+CREATE OR REPLACE FUNCTION update_staff_details() RETURNS TRIGGER AS $$
+BEGIN
+    -- Изменяем сотрудника по прежнему ИНН
+    UPDATE staff st
+    SET 
+        inn = NEW.inn,                          -- ИНН сотрудника
+        fio = NEW.fio,                          -- ФИО сотрудника
+        age = NEW.age,                          -- Возраст
+        gender = NEW.gender,                    -- Пол
+        experience_years = NEW.experience_years, -- Стаж работы
+        position_code = p.position_code,        -- Код должности
+        brigade_code = (                        -- Код бригады (может отсутствовать)
+            SELECT b.brigade_code FROM brigades b WHERE b.name = NEW.brigade_name LIMIT 1
+        )
+    FROM 
+        positions p
+    WHERE 
+        p.name = NEW.position_name
+        AND st.inn = OLD.inn;
+
+    -- Должность не найдена: строка не изменена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем триггер к представлению
+CREATE TRIGGER trigger_update_staff_details
+INSTEAD OF UPDATE ON staff_details
+FOR EACH ROW EXECUTE FUNCTION update_staff_details();
+
+
+-- Создание функции триггера изменения бригады маршрута через представление
+CREATE OR REPLACE FUNCTION update_brigade_routes() RETURNS TRIGGER AS $$
+DECLARE
+    catched_brigade_code INT;  -- Переменная для хранения кода бригады
+BEGIN
+    -- Как и при добавлении, бригада ищется по названию и создается, если ее нет
+    SELECT b.brigade_code INTO catched_brigade_code
+    FROM brigades b
+    WHERE b.name = NEW.brigade_name;
+
+    IF NOT FOUND THEN
+        INSERT INTO brigades (name)
+        VALUES (NEW.brigade_name)
+        RETURNING brigade_code INTO catched_brigade_code;
+    END IF;
+
+    -- Изменяем только связь с прежним ключом (маршрут, бригада)
+    UPDATE route_brigades rb
+    SET 
+        route_code = NEW.route_code,
+        brigade_code = catched_brigade_code,
+        route_departure_time = r.departure_time
+    FROM 
+        routes r
+    WHERE 
+        r.route_code = NEW.route_code
+        AND rb.route_code = OLD.route_code
+        AND rb.brigade_code = OLD.brigade_code;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    NEW.brigade_code := catched_brigade_code;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем триггер к представлению
+CREATE TRIGGER trigger_update_brigade_routes
+INSTEAD OF UPDATE ON brigade_routes
+FOR EACH ROW EXECUTE FUNCTION update_brigade_routes();
@@ -0,0 +1,95 @@
+-- Уведомления об изменении таблиц (канал table_changed: таблица, операция, ключи строк)
+-- и счетчики изменений, по которым клиент проверяет сохраненные снимки таблиц
+
+-- Счетчики изменений таблиц: растут с каждым изменяющим оператором (триггеры в triggers.sql),
+-- по ним клиент проверяет, не устарел ли сохраненный снимок таблицы
+CREATE TABLE table_versions (
+    table_name TEXT PRIMARY KEY,          -- имя таблицы
+    version BIGINT NOT NULL DEFAULT 0     -- номер версии
+);
+
+
+-- Создание функции уведомления об изменении таблицы
+CREATE OR REPLACE FUNCTION notify_table_changed() RETURNS TRIGGER AS $$
+DECLARE
+    key_columns TEXT[];     -- Столбцы первичного ключа таблицы
+    changed_keys JSONB;     -- Ключи измененных строк
+    changed_count INT;
+BEGIN
+    -- Клиенты слушают канал table_changed: по имени таблицы сбрасывают кэши,
+    -- по ключам строк обновляют на экране только измененные строки
+    IF TG_OP <> 'TRUNCATE' THEN
+        SELECT array_agg(a.attname::TEXT ORDER BY array_position(i.indkey::INT2[], a.attnum)) INTO key_columns
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = TG_RELID AND i.indisprimary;
+
+        -- Ключи берутся из переходных таблиц оператора; при UPDATE - и старые, и новые
+        IF TG_OP = 'INSERT' THEN
+            SELECT count(*), jsonb_agg(k) INTO changed_count, changed_keys
+            FROM (SELECT to_jsonb(n) AS k FROM new_rows n LIMIT 101) rows;
+        ELSIF TG_OP = 'DELETE' THEN
+            SELECT count(*), jsonb_agg(k) INTO changed_count, changed_keys
+            FROM (SELECT to_jsonb(o) AS k FROM old_rows o LIMIT 101) rows;
+        ELSE
+            SELECT count(*), jsonb_agg(k) INTO changed_count, changed_keys
+            FROM (
+                SELECT to_jsonb(o) AS k FROM old_rows o
+                UNION
+                SELECT to_jsonb(n) FROM new_rows n
+                LIMIT 101
+            ) rows;
+        END IF;
+
+        -- Оставляем в каждой строке только ключевые столбцы (при UPDATE старый и новый ключ часто совпадают)
+        SELECT jsonb_agg(DISTINCT to_jsonb(ARRAY(SELECT k ->> c FROM unnest(key_columns) c)))
+        INTO changed_keys
+        FROM jsonb_array_elements(changed_keys) k;
+    END IF;
+
+    -- Версия таблицы меняется в той же транзакции, что и строки: клиент, прочитавший версию
+    -- до данных, не сохранит новые данные под старой версией
+    IF TG_OP = 'TRUNCATE' OR changed_count > 0 THEN
+        INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+        ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+    END IF;
+
+    -- Слишком много строк (или TRUNCATE): сообщаем только имя таблицы
+    IF changed_count IS NULL OR changed_count > 100 OR key_columns IS NULL THEN
+        changed_keys := NULL;
+    END IF;
+
+    PERFORM pg_notify('table_changed', jsonb_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'columns', to_jsonb(key_columns),
+        'keys', changed_keys
+    )::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Привязываем уведомление к таблицам: по триггеру на каждую операцию
+-- (переходные таблицы допускаются только у триггеров с одним событием)
+DO $$
+DECLARE
+    table_name TEXT;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY[
+        'stations', 'train_types', 'trains', 'positions', 'brigades',
+        'staff', 'routes', 'route_data', 'route_brigades'
+    ] LOOP
+        EXECUTE format('CREATE TRIGGER notify_%1$s_insert AFTER INSERT ON %1$I
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed()', table_name);
+        EXECUTE format('CREATE TRIGGER notify_%1$s_update AFTER UPDATE ON %1$I
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed()', table_name);
+        EXECUTE format('CREATE TRIGGER notify_%1$s_delete AFTER DELETE ON %1$I
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed()', table_name);
+        EXECUTE format('CREATE TRIGGER notify_%1$s_truncate AFTER TRUNCATE ON %1$I
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_changed()', table_name);
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,20 @@
+-- Индексы путей доступа, которыми пользуется приложение. IF NOT EXISTS - миграция
+-- безопасна и для баз, где часть индексов уже создана вручную
+
+-- соединения маршрутов с поездами и вокзалом-владельцем (представления, каскадное удаление)
+CREATE INDEX IF NOT EXISTS idx_route_train ON routes (train_code);
+CREATE INDEX IF NOT EXISTS idx_route_owner_station ON routes (owner_station_code);
+
+-- соединение поездов с типами (station_trains), проверка RESTRICT при удалении типа
+CREATE INDEX IF NOT EXISTS idx_train_type ON trains (train_type_code);
+
+-- маршруты бригады (brigade_routes, проверка RESTRICT) и отбор по времени отправления в отчете
+CREATE INDEX IF NOT EXISTS idx_route_brigades_brigade ON route_brigades (brigade_code);
+CREATE INDEX IF NOT EXISTS idx_route_brigades_departure_time ON route_brigades (route_departure_time);
+
+-- поиск кода по наименованию в триггерах INSTEAD OF и в отчетах (триграммный индекс
+-- для точного сравнения малоэффективен)
+CREATE INDEX IF NOT EXISTS idx_stations_name ON stations (name);
+CREATE INDEX IF NOT EXISTS idx_brigades_name ON brigades (name);
+CREATE INDEX IF NOT EXISTS idx_train_types_name ON train_types (name);
+CREATE INDEX IF NOT EXISTS idx_positions_name ON positions (name);
@@ -0,0 +1,84 @@
+-- Представления над маршрутами читаются страницами по ключу строки. Порядок задает запрос
+-- приложения, поэтому ORDER BY в представлении только заставлял сортировать все строки.
+-- Маршрут находится подзапросом LATERAL ... LIMIT 1 по составному ключу: соединение по двум
+-- столбцам с секционированной таблицей routes планировщик оценивает как почти пустое
+-- (внешний ключ на секционированную таблицу в оценке не учитывается) и выбирает полную
+-- сортировку вместо чтения по первичному ключу остановок или связей бригад
+
+-- Полный список остановок для каждого маршрута
+CREATE OR REPLACE VIEW route_stops AS
+SELECT
+    rd.route_code,                        -- Код маршрута
+    t.name AS train_name,                 -- Название поезда
+    s.name AS station_name,               -- Наименование вокзала
+    rd.stop_number,                       -- Номер остановки
+    rd.arrival_time,                      -- Время прибытия
+    rd.departure_time,                    -- Время отправления
+    rd.route_departure_time               -- Время отправления маршрута (секция остановки)
+FROM
+    route_data rd
+CROSS JOIN LATERAL (
+    SELECT r.train_code
+    FROM routes r
+    WHERE r.route_code = rd.route_code AND r.departure_time = rd.route_departure_time
+    LIMIT 1
+) r
+JOIN
+    trains t ON r.train_code = t.train_code
+JOIN
+    stations s ON rd.station_code = s.station_code;
+
+
+-- Список бригад с информацией о маршрутах
+CREATE OR REPLACE VIEW brigade_routes AS
+SELECT
+    b.name AS brigade_name,              -- Название бригады
+    rb.route_code,                       -- Код маршрута
+    s.name AS owner_station_name,        -- Вокзал-владелец маршрута
+    t.name AS train_name,                -- Название поезда
+    rb.brigade_code                      -- Код бригады (ключ строки)
+FROM
+    route_brigades rb
+JOIN
+    brigades b ON rb.brigade_code = b.brigade_code
+CROSS JOIN LATERAL (
+    SELECT r.train_code, r.owner_station_code
+    FROM routes r
+    WHERE r.route_code = rb.route_code AND r.departure_time = rb.route_departure_time
+    LIMIT 1
+) r
+JOIN
+    trains t ON r.train_code = t.train_code
+JOIN
+    stations s ON r.owner_station_code = s.station_code;
+
+
+-- Время отправления маршрута входит в ключ строки остановок: INSERT ... RETURNING отдает его
+CREATE OR REPLACE FUNCTION insert_route_stops() RETURNS TRIGGER AS $$
+BEGIN
+    -- Вставляем данные в route_data
+    INSERT INTO route_data (route_code, stop_number, station_code, arrival_time, departure_time, route_departure_time)
+	SELECT
+		NEW.route_code,
+		NEW.stop_number,
+		s.station_code,
+		NEW.arrival_time,
+		NEW.departure_time,
+		r.departure_time                -- Время отправления маршрута определяет секцию
+    FROM
+        stations s
+    JOIN
+        routes r ON r.route_code = NEW.route_code
+	WHERE
+        s.name = NEW.station_name
+    RETURNING route_departure_time INTO NEW.route_departure_time;
+
+    -- Вокзал или маршрут не найден: строка не добавлена
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- Возвращаем строку, чтобы INSERT ... RETURNING отдал ключ новой записи
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
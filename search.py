@@ -0,0 +1,161 @@
+import re
+import threading
+from datetime import datetime, timedelta
+
+# Типы столбцов, по которым строится условие поиска
+TEXT_TYPES = {"character varying", "character", "text"}
+NUMBER_TYPES = {"smallint", "integer", "bigint"}
+TIMESTAMP_TYPES = {"timestamp without time zone", "timestamp with time zone", "date"}
+
+# Триграммный индекс используется для образцов от трех символов
+MIN_QUERY_LENGTH = 3
+# Сколько совпадений по каждому столбцу ранжируется при поиске в окне: ранг нужен для всех
+# строк до первой, поэтому для широкого образца берутся первые найденные, а не все
+SEARCH_CANDIDATES = 1000
+
+DATE_FORMATS = (
+    ("%Y-%m-%d %H:%M", timedelta(minutes=1)),
+    ("%Y-%m-%d", timedelta(days=1)),
+    ("%d.%m.%Y %H:%M", timedelta(minutes=1)),
+    ("%d.%m.%Y", timedelta(days=1)),
+)
+
+
+def escape_like(text):
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+
+def parse_date_range(text):
+    for date_format, step in DATE_FORMATS:
+        try:
+            start = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        return start, start + step
+    return None
+
+
+def table_columns(meta, lazy=False):
+    # Столбцы запроса по метаданным ("columns"): объявленные, кроме широких ("lazy": true) - их
+    # читают при открытии строки, - и недостающие столбцы ключа строки. None - столбцы не объявлены
+    columns = meta.get("columns")
+    if not columns:
+        return None
+    names = [name for name, hints in columns.items() if lazy or not hints.get("lazy")]
+    for name in meta.get("row_key", {}).get("columns", []) + meta.get("delete_map", {}).get("keys", []):
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def lazy_columns(meta):
+    return [name for name, hints in meta.get("columns", {}).items() if hints.get("lazy")]
+
+
+def select_query(metadata, table, lazy=False):
+    # Запрос всей таблицы: только нужные столбцы вместо SELECT *
+    columns = table_columns(metadata.get(table, {}), lazy)
+    return f"SELECT {', '.join(columns) if columns else '*'} FROM {table}"
+
+
+class SearchEngine:
+    # Поиск по представлениям из метаданных: каждый столбец проверяется отдельным условием,
+    # которое может использовать индекс (pg_trgm для текста, B-tree для чисел и времени),
+    # результаты объединяются и ранжируются по триграммному сходству
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self._column_types = {}
+        self._lock = threading.Lock()
+
+    def column_types(self, cursor, table):
+        with self._lock:
+            if table in self._column_types:
+                return self._column_types[table]
+
+        cursor.execute("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+            ORDER BY ordinal_position
+        """, (table,))
+        column_types = cursor.fetchall()
+
+        with self._lock:
+            self._column_types[table] = column_types
+        return column_types
+
+    def search_columns(self, table, column_types):
+        # Столбцы поиска можно ограничить в метаданных ("search_columns") теми, у которых есть индекс
+        declared = self.metadata.get(table, {}).get("search_columns")
+        if declared is None:
+            return column_types
+        types = dict(column_types)
+        return [(column, types[column]) for column in declared if column in types]
+
+    def build_query(self, cursor, table, text, lazy=False, ranked=False):
+        # Условия строятся по всем столбцам поиска, а возвращаются только столбцы из метаданных
+        # (с широкими - при lazy=True, например для выгрузки). При ranked=True ранг возвращается
+        # последним столбцом search_rank без ORDER BY - порядок задает читающий (поток строк),
+        # а совпадений по каждому столбцу берется не больше SEARCH_CANDIDATES; выгрузка получает все
+        text = text.strip()
+        column_types = self.column_types(cursor, table)
+        column_names = table_columns(self.metadata.get(table, {}), lazy) or [column for column, _ in column_types]
+
+        params = {
+            "query": text,
+            "pattern": f"%{escape_like(text)}%",
+        }
+        number = int(text) if text.isdigit() and len(text) < 10 else None
+        date_range = parse_date_range(text)
+        if number is not None:
+            params["number"] = number
+        if date_range:
+            params["date_from"], params["date_to"] = date_range
+
+        conditions = []
+        ranks = []
+        for column, data_type in self.search_columns(table, column_types):
+            if data_type in TEXT_TYPES:
+                conditions.append(f"CAST({column} AS TEXT) ILIKE %(pattern)s")
+                ranks.append(f"similarity(CAST({column} AS TEXT), %(query)s)")
+                continue
+
+            if data_type in NUMBER_TYPES and number is not None:
+                condition = f"{column} = %(number)s"
+            elif data_type in TIMESTAMP_TYPES and date_range:
+                condition = f"{column} >= %(date_from)s AND {column} < %(date_to)s"
+            else:
+                continue
+            # Точные совпадения по числу или дате получают наивысший ранг
+            conditions.append(condition)
+            ranks.append(f"CASE WHEN {condition} THEN 1 ELSE 0 END")
+
+        if not conditions:
+            # Искать не по чему: возвращаем пустой результат с теми же столбцами
+            rank_column = ", 0::float8 AS search_rank" if ranked else ""
+            return f"SELECT {', '.join(column_names)}{rank_column} FROM {table} WHERE false", None
+
+        # float8: значение ранга возвращается в запрос продолжения потока без потери точности
+        rank = ranks[0] if len(ranks) == 1 else f"GREATEST({', '.join(ranks)})"
+        rank = f"CAST({rank} AS float8)"
+
+        select_list = ", ".join(column_names)
+        # Отдельный SELECT на каждое условие, чтобы каждый мог использовать свой индекс
+        limit = f" LIMIT {SEARCH_CANDIDATES}" if ranked else ""
+        branches = "\n            UNION\n".join(
+            f"            (SELECT {select_list}, {rank} AS search_rank FROM {table} WHERE {condition}{limit})"
+            for condition in conditions
+        )
+        if ranked:
+            return f"""
+        SELECT {select_list}, search_rank FROM (
+{branches}
+        ) found
+        """, params
+        query = f"""
+        SELECT {select_list} FROM (
+{branches}
+        ) found
+        ORDER BY search_rank DESC
+        """
+        return query, params
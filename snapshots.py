@@ -0,0 +1,73 @@
+import sys
+from collections import OrderedDict
+
+# Сколько строк снимка измеряется для оценки его размера
+SIZE_SAMPLE_ROWS = 16
+
+
+def estimate_size(rows):
+    # Оценка по нескольким строкам, равномерно взятым из снимка: строки одной таблицы
+    # близки по размеру, а измерение каждого значения стоило бы как сама загрузка
+    if not rows:
+        return sys.getsizeof(rows)
+    step = max(1, len(rows) // SIZE_SAMPLE_ROWS)
+    sample = rows[::step]
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+    return sys.getsizeof(rows) + sample_size * len(rows) // len(sample)
+
+
+class TableSnapshot:
+    # Загруженные строки таблицы и версии ее таблиц-источников на момент загрузки.
+    # Недочитанный снимок продолжается в порядке order ([(столбец, по убыванию)]) с позиции
+    # position - значений этих столбцов в последней полученной строке
+    def __init__(self, versions, column_names, rows, exhausted, row_count_estimate, order=None, position=None):
+        self.versions = versions
+        self.column_names = column_names
+        self.rows = rows
+        self.exhausted = exhausted
+        self.row_count_estimate = row_count_estimate
+        self.order = order
+        self.position = position
+        self.size = estimate_size(rows)
+
+
+class SnapshotCache:
+    # Снимки недавно открытых таблиц в порядке использования (LRU) с ограничением по памяти.
+    # Снимок годится, пока версии таблиц-источников (счетчики изменений) не изменились.
+    # Используется только из потока интерфейса
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._snapshots = OrderedDict()
+
+    def put(self, table, snapshot):
+        self.discard(table)
+        # Снимок больше всего бюджета не сохраняем, чтобы не вытеснять остальные
+        if snapshot.size > self.max_bytes:
+            return
+        self._snapshots[table] = snapshot
+        self.size += snapshot.size
+        while self.size > self.max_bytes:
+            _, evicted = self._snapshots.popitem(last=False)
+            self.size -= evicted.size
+
+    def versions(self, table):
+        snapshot = self._snapshots.get(table)
+        return snapshot.versions if snapshot is not None else None
+
+    def take(self, table, versions):
+        # Снимок забирается из кэша (строки переходят к модели); устаревший просто удаляется
+        snapshot = self._snapshots.pop(table, None)
+        if snapshot is None:
+            return None
+        self.size -= snapshot.size
+        return snapshot if snapshot.versions == versions else None
+
+    def discard(self, table):
+        snapshot = self._snapshots.pop(table, None)
+        if snapshot is not None:
+            self.size -= snapshot.size
+
+    def clear(self):
+        self._snapshots.clear()
+        self.size = 0
@@ -0,0 +1,301 @@
+import datetime
+
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QRect, QEvent, pyqtSignal
+from PyQt6.QtWidgets import QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+
+
+ACTIONS_HEADER = "Действия"
+ACTIONS_WIDTH = 80
+ROW_HEIGHT = 40
+BUTTON_SIZE = 30
+PAGE_SIZE = 500
+
+
+def key_text(value):
+    # Значение ключа строки в том виде, в каком оно приходит в уведомлениях (JSON): время -
+    # в формате ISO с "T" и без нулей в конце долей секунды
+    if isinstance(value, datetime.datetime):
+        text = value.isoformat()
+        return text.rstrip("0") if value.microsecond else text
+    return str(value)
+
+
+class RowTableModel(QAbstractTableModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Строки храним как есть (кортежи курсора), без копирования и без виджетов на ячейку
+        self._columns = []
+        self._rows = []
+        # Источник следующих страниц: fetch_page(count, deliver) читает страницу в фоне и передает
+        # строки в deliver; None - данные загружены целиком. Номер источника отсекает страницы
+        # прежнего источника, пришедшие после смены строк
+        self._fetch_page = None
+        self._exhausted = True
+        self._fetching = False
+        self._generation = 0
+        # Позиции ключевых столбцов строки, индекс "ключ -> номер строки" (строится по требованию)
+        # и ключи строк, чья версия из курсора уже устарела
+        self._key_positions = []
+        self._key_index = None
+        self._suppressed = set()
+        # Сортировка, выполненная сервером: [(имя столбца, по убыванию)] - для отметок в заголовке
+        self._sort_columns = []
+        # Заголовки столбцов из метаданных; без заголовка показывается имя столбца
+        self._titles = {}
+
+    def set_rows(self, rows, column_names, fetch_page=None):
+        self.beginResetModel()
+        self._columns = list(column_names)
+        self._rows = rows if isinstance(rows, list) else list(rows)
+        self._fetch_page = fetch_page
+        self._exhausted = fetch_page is None
+        self._fetching = False
+        self._generation += 1
+        self._key_positions = []
+        self._key_index = None
+        self._suppressed = set()
+        self.endResetModel()
+
+    def set_row_key(self, key_columns):
+        # Без ключа строки точечные изменения невозможны, остается полная перезагрузка
+        if key_columns and all(column in self._columns for column in key_columns):
+            self._key_positions = [self._columns.index(column) for column in key_columns]
+        else:
+            self._key_positions = []
+        self._key_index = None
+
+    def has_row_key(self):
+        return bool(self._key_positions)
+
+    def _row_key(self, row):
+        # Значения ключа сравниваются как строки: так они приходят в уведомлениях
+        return tuple(key_text(row[position]) for position in self._key_positions)
+
+    def _index_by_key(self):
+        if self._key_index is None:
+            self._key_index = {self._row_key(row): number for number, row in enumerate(self._rows)}
+        return self._key_index
+
+    def apply_changes(self, keys, rows):
+        # keys - ключи измененных строк, rows - их текущие версии (удаленных строк среди них нет)
+        if not self._key_positions:
+            return False
+
+        keys = list(dict.fromkeys(keys))
+        fresh = {self._row_key(row): row for row in rows}
+        index = self._index_by_key()
+        removed = []
+        for key in keys:
+            number = index.get(key)
+            if number is None:
+                continue
+            row = fresh.pop(key, None)
+            if row is None:
+                removed.append(number)
+                continue
+            self._rows[number] = row
+            self.dataChanged.emit(self.index(number, 0), self.index(number, len(self._columns) - 1))
+
+        # Еще не загруженные строки курсор вернет в старой версии - их пропустим
+        if not self._exhausted:
+            self._suppressed.update(key for key in keys if key not in index)
+
+        for number in sorted(set(removed), reverse=True):
+            self.beginRemoveRows(QModelIndex(), number, number)
+            del self._rows[number]
+            self.endRemoveRows()
+
+        # Новые строки показываем сверху
+        if fresh:
+            self.beginInsertRows(QModelIndex(), 0, len(fresh) - 1)
+            self._rows[0:0] = list(fresh.values())
+            self.endInsertRows()
+
+        if removed or fresh:
+            self._key_index = None
+        return True
+
+    def continue_rows(self, fetch_page):
+        # Следующие страницы уже показанных строк (например, сохраненного снимка) берутся из нового источника
+        self._fetch_page = fetch_page
+        self._exhausted = False
+        self._fetching = False
+        self._generation += 1
+
+    def set_column_titles(self, titles):
+        self._titles = dict(titles)
+        if self._columns:
+            self.headerDataChanged.emit(Qt.Orientation.Horizontal, 0, len(self._columns) - 1)
+
+    def set_sort_columns(self, sort_columns):
+        self._sort_columns = list(sort_columns)
+        if self._columns:
+            self.headerDataChanged.emit(Qt.Orientation.Horizontal, 0, len(self._columns) - 1)
+
+    def is_exhausted(self):
+        return self._exhausted
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return not self._exhausted
+
+    def is_fetching(self):
+        return self._fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        # Страница читается в фоне, представление получит строки, когда она придет
+        if parent.isValid() or self._exhausted or self._fetching:
+            return
+
+        self._fetching = True
+        generation = self._generation
+        self._fetch_page(PAGE_SIZE, lambda rows: self._deliver(generation, rows))
+
+    def _deliver(self, generation, rows):
+        if generation != self._generation:
+            return
+        self._fetching = False
+        if len(rows) < PAGE_SIZE:
+            self._exhausted = True
+        if self._suppressed:
+            rows = [row for row in rows if self._row_key(row) not in self._suppressed]
+        if not rows:
+            return
+
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+        if self._key_index is not None:
+            for number, row in enumerate(rows, first):
+                self._key_index[self._row_key(row)] = number
+
+    def column_names(self):
+        return self._columns
+
+    def rows(self):
+        return self._rows
+
+    def action_column(self):
+        # Последняя колонка отводится под кнопки действий
+        return len(self._columns)
+
+    def row_dict(self, row):
+        return dict(zip(self._columns, self._rows[row]))
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._columns) + 1 if self._columns else 0
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.column() >= len(self._columns):
+            return None
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            # Преобразование в строку только для видимых ячеек
+            return str(self._rows[index.row()][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            if section < len(self._columns):
+                name = self._columns[section]
+                title = self._titles.get(name, name)
+                # Направление и номер столбца в многостолбцовой сортировке
+                for number, (column, descending) in enumerate(self._sort_columns, 1):
+                    if column == name:
+                        marker = "▼" if descending else "▲"
+                        return f"{title} {marker}{number if len(self._sort_columns) > 1 else ''}"
+                return title
+            return ACTIONS_HEADER
+        return section + 1
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+
+
+class ActionDelegate(QStyledItemDelegate):
+    # Кнопки "Редактировать"/"Удалить" рисуются делегатом, а не создаются виджетами на каждую строку
+    edit_clicked = pyqtSignal(int)
+    delete_clicked = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pressed = None
+
+    def _button_rects(self, rect):
+        spacing = 4
+        total_width = BUTTON_SIZE * 2 + spacing
+        left = rect.x() + (rect.width() - total_width) // 2
+        top = rect.y() + (rect.height() - BUTTON_SIZE) // 2
+        edit_rect = QRect(left, top, BUTTON_SIZE, BUTTON_SIZE)
+        delete_rect = QRect(left + BUTTON_SIZE + spacing, top, BUTTON_SIZE, BUTTON_SIZE)
+        return edit_rect, delete_rect
+
+    def _is_action_index(self, index):
+        return index.column() == index.model().action_column()
+
+    def paint(self, painter, option, index):
+        if not self._is_action_index(index):
+            super().paint(painter, option, index)
+            return
+
+        style = option.widget.style() if option.widget else QApplication.style()
+        edit_rect, delete_rect = self._button_rects(option.rect)
+        for rect, text, action in ((edit_rect, "✏️", "edit"), (delete_rect, "🗑️", "delete")):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = text
+            button.state = QStyle.StateFlag.State_Enabled
+            if self._pressed == (index.row(), action):
+                button.state |= QStyle.StateFlag.State_Sunken
+            else:
+                button.state |= QStyle.StateFlag.State_Raised
+            style.drawControl(QStyle.ControlElement.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if not self._is_action_index(index):
+            return super().editorEvent(event, model, option, index)
+
+        if event.type() not in (QEvent.Type.MouseButtonPress, QEvent.Type.MouseButtonRelease):
+            return False
+
+        edit_rect, delete_rect = self._button_rects(option.rect)
+        position = event.position().toPoint()
+        action = None
+        if edit_rect.contains(position):
+            action = "edit"
+        elif delete_rect.contains(position):
+            action = "delete"
+
+        if event.type() == QEvent.Type.MouseButtonPress:
+            self._pressed = (index.row(), action) if action else None
+            return action is not None
+
+        pressed, self._pressed = self._pressed, None
+        if action is None or pressed != (index.row(), action):
+            return False
+
+        if action == "edit":
+            self.edit_clicked.emit(index.row())
+        else:
+            self.delete_clicked.emit(index.row())
+        return True
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        if self._is_action_index(index):
+            size.setWidth(ACTIONS_WIDTH)
+            size.setHeight(ROW_HEIGHT)
+        return size
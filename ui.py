@@ -1,17 +1,54 @@
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QComboBox, QLineEdit, QPushButton, QAbstractItemView, QInputDialog, QFormLayout,
-    QTableWidget, QTableWidgetItem, QHBoxLayout, QVBoxLayout, QWidget, QMessageBox, QHeaderView, QDialog,
-    QDialogButtonBox, QDateTimeEdit, QLabel, QSpinBox
+    QTableView, QHBoxLayout, QVBoxLayout, QWidget, QMessageBox, QHeaderView, QDialog,
+    QDialogButtonBox, QDateTimeEdit, QLabel, QSpinBox, QProgressBar, QProgressDialog, QFileDialog,
+    QListWidget
 )
 from PyQt6.QtGui import QFont, QIntValidator, QRegularExpressionValidator
-from PyQt6.QtCore import QRegularExpression, QDateTime
-import psycopg2
+from PyQt6.QtCore import Qt, QEvent, QRegularExpression, QDateTime, QTimer, pyqtSignal
 import json
-
-from fpdf import FPDF
 import os
 
+from db import (
+    DB_PARAMS, DatabaseManager, RowStream, view_dependencies, ensure_partitions, table_versions, open_stream,
+    stream_order, sorted_query, execute_prepared
+)
+from exporter import EXPORT_FORMATS, available_formats, export_query
+from importer import CsvImporter
+from journeys import MIN_TRANSFER_SECONDS, Timetable, route_trains
+from listener import ChangeListener, listen_connection
+from lookups import LookupCache
+from metrics import QUERY_METRICS, start_metrics_server
+from search import SearchEngine, MIN_QUERY_LENGTH, select_query, lazy_columns
+from snapshots import SnapshotCache, TableSnapshot
+from table_model import RowTableModel, ActionDelegate, ACTIONS_WIDTH, ROW_HEIGHT, PAGE_SIZE, key_text
+from workers import QueryExecutor
+
+# Задержка перед поиском при вводе текста, мс
+SEARCH_DELAY = 300
+# Задержка, за которую копятся изменения строк из уведомлений перед их применением, мс
+CHANGES_DELAY = 100
+# На сколько месяцев вперед при запуске создаются секции секционированных таблиц
+PARTITION_MONTHS_AHEAD = 12
+# Память под снимки недавно открытых таблиц, МБ
+SNAPSHOT_CACHE_MB = 256
+# Запросы дольше порога пишутся в журнал медленных запросов, секунды
+SLOW_QUERY_SECONDS = 0.5
+# Файл, в который журнал дописывается JSON по строке; None - журнал только в памяти
+# (последние записи, счетчик в метриках)
+SLOW_QUERY_LOG = None
+# Порог, выше которого к записи журнала добавляется EXPLAIN (ANALYZE, BUFFERS): запрос
+# выполняется повторно, поэтому по умолчанию выключено (None)
+EXPLAIN_QUERY_SECONDS = None
+# Порт, на котором отдаются метрики запросов (GET /metrics); None - не открывать
+METRICS_PORT = None
+# Через сколько секунд без прокрутки поток строк закрывает курсор и возвращает соединение в пул
+STREAM_IDLE_SECONDS = 30
+
 class App(QMainWindow):
+    # Подключение к базе завершилось (True) или не удалось (False)
+    database_ready = pyqtSignal(bool)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Database Manager")
@@ -19,15 +56,44 @@ class App(QMainWindow):
 
         with open("table_metadata.json", "r", encoding="utf-8") as file:
             self.metadata = json.load(file)
+        # Отчеты загружаются при первом обращении (см. report_engine)
+        self._report_engine = None
+        # Расписание для поиска поездок загружается при первом поиске и обновляется по уведомлениям;
+        # пока оно загружается, измененные маршруты копятся в timetable_pending
+        self.timetable = None
+        self.timetable_pending = None
+
+        self.search_engine = SearchEngine(self.metadata)
+        self.importer = CsvImporter(self.metadata)
+        self.lookup_cache = LookupCache()
+        self.snapshot_cache = SnapshotCache(SNAPSHOT_CACHE_MB * 1024 * 1024)
+        self.change_listener = None
+
+        QUERY_METRICS.configure(SLOW_QUERY_SECONDS, EXPLAIN_QUERY_SECONDS, SLOW_QUERY_LOG)
+        self.metrics_server = start_metrics_server(METRICS_PORT) if METRICS_PORT else None
 
         # Установка шрифта для приложения
         app_font = QFont("Arial", 12)
         QApplication.setFont(app_font)
 
-        self.db_connection = None
-        self.cursor = None
+        self.db = None
         self.current_table = None
-        self.sort_order = {}
+        # Сортировка строк на сервере: [(имя столбца, по убыванию)], первый столбец - главный
+        self.sort_order = []
+        # Текст поиска показанных строк (None - вся таблица): выгрузка повторяет тот же запрос
+        self.shown_search = None
+        self.row_stream = None
+        # Позиция потока после последней страницы, переданной в модель (страница в пути не учтена)
+        self.row_position = None
+        self.row_count_estimate = None
+        # Версии таблиц-источников показанных строк (None - результат поиска, снимок не сохраняется)
+        self.row_versions = None
+        # Таблицы, из которых собраны представления, и ключи строк, ожидающие обновления
+        self.table_dependencies = {}
+        self.pending_keys = []
+
+        # Запросы выполняются в фоновых потоках, каждый на своем соединении из пула
+        self.executor = QueryExecutor(self.acquire_connection, self.release_connection, parent=self)
 
         self.setup_ui()
         self.connect_to_database()
@@ -45,56 +111,214 @@ class App(QMainWindow):
         add_record_button = QPushButton("Добавить запись в таблицу")
         add_record_button.clicked.connect(self.open_add_record_form)
 
+        # Кнопка загрузки записей из CSV-файла
+        import_button = QPushButton("Импорт из CSV")
+        import_button.clicked.connect(self.import_csv)
+
+        # Кнопка выгрузки текущей таблицы или результата поиска в файл
+        export_button = QPushButton("Экспорт")
+        export_button.clicked.connect(self.export_rows)
+
         # Поле поиска
         self.search_field = QLineEdit()
         self.search_field.setPlaceholderText("Введите запрос для поиска...")
 
+        # Поиск по мере ввода запускается после паузы в наборе
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_records)
+        self.search_field.textChanged.connect(self.on_search_text_changed)
+        self.search_field.returnPressed.connect(self.search_records)
+
         # Кнопка поиска
         search_button = QPushButton("Найти")
         search_button.clicked.connect(self.search_records)
 
-        # Таблица для отображения данных
-        self.table_widget = QTableWidget()
-        self.table_widget.setColumnCount(0)
-        self.table_widget.setRowCount(0)
-        self.table_widget.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        # Таблица для отображения данных (модель/представление, строки не создают виджетов)
+        self.table_model = RowTableModel(self)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.table_model)
+        self.table_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+
+        # Фиксированная высота строк позволяет представлению не измерять каждую строку
+        vertical_header = self.table_view.verticalHeader()
+        vertical_header.setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        vertical_header.setDefaultSectionSize(ROW_HEIGHT)
+
+        # Кнопки действий рисуются делегатом
+        self.action_delegate = ActionDelegate(self.table_view)
+        self.table_view.setItemDelegate(self.action_delegate)
+        self.action_delegate.edit_clicked.connect(
+            lambda row: self.edit_record(self.table_model.row_dict(row)), Qt.ConnectionType.QueuedConnection
+        )
+        self.action_delegate.delete_clicked.connect(
+            lambda row: self.delete_record(self.table_model.row_dict(row)), Qt.ConnectionType.QueuedConnection
+        )
+
+        # Сортирует сервер (ORDER BY), а не модель: клик по заголовку перезапрашивает строки,
+        # клик с Ctrl добавляет столбец к сортировке
+        self.table_view.setSortingEnabled(False)
+        self.table_view.horizontalHeader().setSectionsClickable(True)
+        self.table_view.horizontalHeader().sectionClicked.connect(self.sort_table)
+
+        # Счетчик строк в строке состояния обновляется по мере подгрузки страниц
+        self.table_model.modelReset.connect(self.update_row_count_status)
+        self.table_model.rowsInserted.connect(self.update_row_count_status)
+        self.table_model.rowsRemoved.connect(self.update_row_count_status)
+
+        # Изменения строк из уведомлений применяются пачкой, а если строки
+        # определить нельзя - таблица перечитывается целиком
+        self.changes_timer = QTimer(self)
+        self.changes_timer.setSingleShot(True)
+        self.changes_timer.setInterval(CHANGES_DELAY)
+        self.changes_timer.timeout.connect(self.apply_pending_changes)
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(CHANGES_DELAY)
+        self.reload_timer.timeout.connect(self.search_records)
+
+        # Открытый курсор держит транзакцию и блокировки таблицы: без прокрутки он закрывается,
+        # следующая страница откроет новый с того же места
+        self.stream_idle_timer = QTimer(self)
+        self.stream_idle_timer.setSingleShot(True)
+        self.stream_idle_timer.setInterval(STREAM_IDLE_SECONDS * 1000)
+        self.stream_idle_timer.timeout.connect(self.suspend_row_stream)
 
         # Кнопка "Сформировать отчет"
         generate_report_button = QPushButton("Сформировать отчет")
         generate_report_button.setStyleSheet("position: absolute; bottom: 20px; right: 20px;")
         generate_report_button.clicked.connect(self.open_report_dialog)
 
+        # Кнопка "Поиск поездки"
+        journey_button = QPushButton("Поиск поездки")
+        journey_button.clicked.connect(self.open_journey_dialog)
+
         # Layout
         top_layout = QHBoxLayout()
         top_layout.addWidget(self.table_selector)
         top_layout.addStretch(1)
         top_layout.addWidget(add_record_button)
+        top_layout.addWidget(import_button)
+        top_layout.addWidget(export_button)
         top_layout.addStretch(1)
         top_layout.addWidget(self.search_field)
         top_layout.addWidget(search_button)
 
         main_layout = QVBoxLayout()
         main_layout.addLayout(top_layout)
-        main_layout.addWidget(self.table_widget)
+        main_layout.addWidget(self.table_view)
+        main_layout.addWidget(journey_button)
         main_layout.addWidget(generate_report_button)
 
         central_widget.setLayout(main_layout)
 
+        # Индикатор выполнения фоновых запросов и кнопка их отмены
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setMaximumWidth(150)
+        self.progress_bar.hide()
+        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button.clicked.connect(lambda: self.executor.cancel())
+        self.cancel_button.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self.executor.busy_changed.connect(self.progress_bar.setVisible)
+        self.executor.busy_changed.connect(self.cancel_button.setVisible)
+
+    @property
+    def report_engine(self):
+        # Отчеты открывают редко: построитель PDF (fpdf2, fontTools) не замедляет запуск окна
+        if self._report_engine is None:
+            from reports import ReportEngine
+            with open("report_metadata.json", "r", encoding="utf-8") as file:
+                self._report_engine = ReportEngine(json.load(file))
+        return self._report_engine
+
     def connect_to_database(self):
-        try:
-            self.db_connection = psycopg2.connect(
-                dbname="vokzal",
-                user="postgres",
-                password="pass",
-                host="localhost",
-                port=5432
-            )
-            self.cursor = self.db_connection.cursor()
+        # Подключение идет в фоне: окно рисуется сразу, список таблиц появится после подключения.
+        # Пул создается без соединений, первое откроет фоновая задача
+        self.db = DatabaseManager(**DB_PARAMS, min_connections=0)
+        self.statusBar().showMessage("Подключение к базе данных...")
+
+        def job(connection):
+            with connection.cursor() as cursor:
+                dependencies = view_dependencies(cursor)
+                self.create_future_partitions(cursor)
+            connection.commit()
+            # Соединение для уведомлений тоже открывается здесь, а не в потоке интерфейса
+            return dependencies, listen_connection(self.db.connect_dedicated)
+
+        def on_finished(result):
+            self.table_dependencies, listen_connection = result
+            self.statusBar().clearMessage()
+
+            # Кэш списков сбрасывается по уведомлениям об изменении таблиц-источников,
+            # а показанные строки обновляются по ключам из тех же уведомлений
+            self.change_listener = ChangeListener(self.db.connect_dedicated, self.executor, parent=self)
+            self.change_listener.table_changed.connect(self.lookup_cache.invalidate)
+            self.change_listener.rows_changed.connect(self.on_rows_changed)
+            self.change_listener.rows_changed.connect(self.on_timetable_changed)
+            self.change_listener.changes_missed.connect(self.lookup_cache.clear)
+            self.change_listener.changes_missed.connect(self.drop_timetable)
+            self.change_listener.changes_missed.connect(self.reload_timer.start)
+            self.change_listener.start(listen_connection)
+
             self.load_table_names()
-        except psycopg2.Error as e:
-            QMessageBox.critical(self, "Ошибка подключения", f"Не удалось подключиться к базе данных:\n{e}")
+            self.database_ready.emit(True)
+
+        def on_failed(error):
+            self.statusBar().clearMessage()
+            QMessageBox.critical(self, "Ошибка подключения", f"Не удалось подключиться к базе данных:\n{error}")
+            self.database_ready.emit(False)
             self.close()
 
+        def on_done():
+            # Подключение отменили кнопкой "Отмена"
+            if self.change_listener is None:
+                self.statusBar().showMessage("Нет подключения к базе данных")
+
+        self.executor.submit(job, on_finished, on_failed, tag="connect", on_done=on_done, readonly=False)
+
+    def create_future_partitions(self, cursor):
+        # Секции на ближайшие месяцы создаются заранее, чтобы запись в них не ждала DDL
+        for meta in self.metadata.values():
+            if "partitions" in meta:
+                cursor.execute(
+                    f"SELECT now()::timestamp, now()::timestamp + INTERVAL '{PARTITION_MONTHS_AHEAD} months'"
+                )
+                ensure_partitions(cursor, meta["partitions"], *cursor.fetchone())
+
+    def acquire_connection(self, readonly=True):
+        return self.db.acquire(readonly)
+
+    def release_connection(self, connection):
+        self.db.release(connection)
+
+    def run_in_background(self, job, on_finished, error_title, error_text, tag=None,
+                          progress_parent=None, progress_text=None, keep_connection=False, readonly=True):
+        error_parent = progress_parent or self
+        progress = None
+
+        # Для модальных окон (отчеты) показываем отдельный диалог с кнопкой отмены,
+        # иначе достаточно индикатора в строке состояния
+        if progress_parent is not None:
+            progress = QProgressDialog(progress_text or error_title, "Отмена", 0, 0, progress_parent)
+            progress.setWindowModality(Qt.WindowModality.WindowModal)
+            progress.setMinimumDuration(300)
+            progress.canceled.connect(lambda: self.executor.cancel(tag))
+
+        def on_done():
+            if progress is not None:
+                progress.canceled.disconnect()
+                progress.close()
+
+        def on_failed(error):
+            QMessageBox.critical(error_parent, error_title, f"{error_text}:\n{error}")
+
+        return self.executor.submit(job, on_finished, on_failed, tag, keep_connection, on_done, readonly)
+
     def load_table_names(self):
         try:
             # Получаем список таблиц из мета-данных
@@ -109,85 +333,385 @@ class App(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка загрузки таблиц", f"Не удалось загрузить список таблиц:\n{e}")
 
-    def load_rows(self, rows, column_names):
-        # Очистка таблицы перед добавлением новых данных
-        self.table_widget.clearContents()
-        self.table_widget.setRowCount(0)
-        self.table_widget.setColumnCount(0)  # Обнуляем количество столбцов
+    def load_rows(self, rows, column_names, stream=None):
+        # Передаем строки в модель, представление отрисует только видимые,
+        # а остальные страницы модель запросит у потока при прокрутке
+        fetch_page = self.stream_pages(stream) if stream and not stream.exhausted else None
+        self.table_model.set_rows(rows, column_names, fetch_page)
 
-        # Настройка таблицы
-        self.table_widget.setColumnCount(len(column_names) + 1)  # Добавляем одну колонку для кнопок
-        self.table_widget.setHorizontalHeaderLabels(column_names + ['Действия'])
+        # Подсказки отображения из метаданных: заголовки и скрытые служебные столбцы (коды ключей)
+        hints = self.metadata.get(self.current_table, {}).get("columns", {})
+        self.table_model.set_column_titles({name: hints[name]["title"] for name in column_names
+                                            if "title" in hints.get(name, {})})
+        for col_idx, name in enumerate(column_names):
+            self.table_view.setColumnHidden(col_idx, bool(hints.get(name, {}).get("hidden")))
 
-        # Устанавливаем фиксированную ширину последнего столбца для кнопок
-        self.table_widget.setColumnWidth(len(column_names), 80)
+        header = self.table_view.horizontalHeader()
 
-        # Устанавливаем растягивание для всех остальных столбцов
+        # Устанавливаем растягивание для всех столбцов с данными
         for col_idx in range(len(column_names)):
-            self.table_widget.horizontalHeader().setSectionResizeMode(col_idx, QHeaderView.ResizeMode.Stretch)
+            header.setSectionResizeMode(col_idx, QHeaderView.ResizeMode.Stretch)
 
-        # Включаем сортировку таблицы
-        self.table_widget.setSortingEnabled(True)
+        # Устанавливаем фиксированную ширину последнего столбца для кнопок
+        header.setSectionResizeMode(len(column_names), QHeaderView.ResizeMode.Fixed)
+        self.table_view.setColumnWidth(len(column_names), ACTIONS_WIDTH)
 
-        # Добавляем данные в таблицу и кнопки
-        for row_idx, row_data in enumerate(rows):
-            self.table_widget.insertRow(row_idx)  # Вставка новой строки
-            for col_idx, cell_data in enumerate(row_data):
-                self.table_widget.setItem(row_idx, col_idx, QTableWidgetItem(str(cell_data)))
+    def load_table_data(self):
+        # Уходя с таблицы, сохраняем ее строки: при возврате они покажутся без запроса
+        self.save_snapshot()
+        self.close_row_stream()
+        if self.table_selector.currentText() != self.current_table:
+            self.sort_order = []
+            self.table_model.set_sort_columns(self.sort_order)
+        self.current_table = self.table_selector.currentText()
+        if not self.current_table:
+            return
 
-            # Создаем контейнер для кнопок (кнопки в одной ячейке)
-            action_widget = QWidget()
+        self.search_timer.stop()
+        self.reload_timer.stop()
+        table = self.current_table
+        self.shown_search = None
+        # Только столбцы из метаданных: широкие читаются при открытии строки
+        query = select_query(self.metadata, table)
+        # Строки представления меняются вместе с любой из его таблиц
+        tables = self.table_dependencies.get(table, {table})
+        error_title, error_text = "Ошибка загрузки данных", "Не удалось загрузить данные из таблицы"
+
+        def load(connection):
+            return query, None
+
+        # Снимки хранят строки в порядке ключа, отсортированные строки всегда читаются заново
+        if self.sort_order or self.snapshot_cache.versions(table) is None:
+            self.load_stream(load, error_title, error_text, version_tables=tables)
+            return
 
-            # Кнопки в виде смайликов
-            edit_button = QPushButton("✏️")  # Смайлик для "Редактировать"
-            delete_button = QPushButton("🗑️")  # Смайлик для "Удалить"
+        # Снимок проверяется по счетчикам изменений - одним коротким запросом
+        def job(connection):
+            with connection.cursor() as cursor:
+                return table_versions(cursor, tables)
 
-            # Устанавливаем фиксированные размеры кнопок
-            edit_button.setFixedSize(30, 30)
-            delete_button.setFixedSize(30, 30)
+        def on_finished(versions):
+            snapshot = self.snapshot_cache.take(table, versions)
+            if snapshot is None:
+                self.load_stream(load, error_title, error_text, version_tables=tables)
+                return
+            self.show_snapshot(snapshot, query)
+            if not snapshot.exhausted:
+                self.continue_snapshot(snapshot, query, error_title, error_text)
+
+        self.run_in_background(job, on_finished, error_title, error_text, tag="table")
+
+    def load_stream(self, build_query, error_title, error_text, version_tables=None, ranked=False):
+        # Предыдущий серверный курсор больше не нужен
+        self.close_row_stream()
+        sort_columns = list(self.sort_order)
+        key_columns = self.row_key().get("columns")
+        # Без сортировки строки идут по рангу поиска (ranked - он последний столбец запроса)
+        # или по ключу строки; ключ в конце порядка делает его однозначным, и поток продолжается
+        # после последней полученной строки, не держа курсор между прокрутками
+        lead = sort_columns or ([("search_rank", True)] if ranked else [])
+        order = stream_order(lead, key_columns) if key_columns else None
+
+        def job(connection):
+            query, params = build_query(connection)
+            # Версии читаются до строк: изменение между ними только вызовет лишнюю перезагрузку снимка
+            versions = None
+            if version_tables:
+                with connection.cursor() as cursor:
+                    versions = table_versions(cursor, version_tables)
+            if order is None and lead:
+                query = sorted_query(query, lead)
+            stream = open_stream(connection, query, params, order, self.acquire_connection, self.release_connection,
+                                 PAGE_SIZE, hidden_columns=1 if ranked else 0)
+            # Снимок сохраняется только для строк в порядке ключа
+            stream.versions = None if sort_columns else versions
+            stream.row_count_estimate = stream.estimate_row_count(connection)
+            # Первая страница читается на соединении задачи - ее можно отменить
+            stream.first_page = stream.fetch(connection=connection)
+            return stream
+
+        # Показываем первую страницу сразу, остальное - по мере прокрутки
+        self.run_in_background(job, self.show_stream, error_title, error_text, tag="table")
+
+    def show_stream(self, stream):
+        self.close_row_stream()
+        self.row_stream = stream
+        self.row_position = stream.position
+        self.row_count_estimate = stream.row_count_estimate
+        self.row_versions = stream.versions
+        rows, stream.first_page = stream.first_page, []
+        self.load_rows(rows, stream.column_names, stream)
+        self.table_model.set_row_key(self.row_key().get("columns"))
+        self.pending_keys = []
+        self.stream_idle_timer.start()
+
+    def show_snapshot(self, snapshot, query):
+        # Строки снимка показываются сразу; поток без курсора хранит запрос для точечных обновлений
+        # и порядок с позицией снимка - пока продолжение не открыто, снимок сохранится с ними же
+        self.close_row_stream()
+        self.row_stream = RowStream(query, order=snapshot.order)
+        self.row_stream.column_names = snapshot.column_names
+        self.row_position = snapshot.position
+        self.row_count_estimate = snapshot.row_count_estimate
+        self.row_versions = snapshot.versions
+        self.load_rows(snapshot.rows, snapshot.column_names)
+        self.table_model.set_row_key(self.row_key().get("columns"))
+        self.pending_keys = []
+
+    def continue_snapshot(self, snapshot, query, error_title, error_text):
+        # Недочитанный снимок продолжается с его позиции в том порядке, в котором он читался
+        # (от удаленных или измененных на экране строк позиция не зависит)
+        placeholder = self.row_stream
+        if not snapshot.order or snapshot.position is None:
+            self.load_stream(lambda connection: (query, None), error_title, error_text)
+            return
 
-            # Располагаем кнопки горизонтально
-            action_layout = QHBoxLayout(action_widget)
-            action_layout.addWidget(edit_button)
-            action_layout.addWidget(delete_button)
+        def job(connection):
+            stream = open_stream(connection, query, None, snapshot.order,
+                                 self.acquire_connection, self.release_connection, PAGE_SIZE)
+            stream.resume_at(snapshot.position, snapshot.column_names)
+            return stream
 
-            # Устанавливаем контейнер в ячейку таблицы
-            self.table_widget.setCellWidget(row_idx, len(column_names), action_widget)
+        def on_finished(stream):
+            # Пока выбирался способ чтения, могли открыть другую таблицу
+            if self.row_stream is not placeholder:
+                stream.close()
+                return
+            self.row_stream = stream
+            self.table_model.continue_rows(self.stream_pages(stream))
 
-            # Связываем действия с кнопками
-            edit_button.clicked.connect(lambda _, row=dict(zip(column_names, row_data)): self.edit_record(row))
-            delete_button.clicked.connect(lambda _, row=dict(zip(column_names, row_data)): self.delete_record(row))
+        self.run_in_background(job, on_finished, error_title, error_text, tag="table")
 
-            # Устанавливаем фиксированную высоту строки
-            self.table_widget.setRowHeight(row_idx, 40)
+    def save_snapshot(self):
+        # Сохраняется только таблица целиком (не результат поиска) с известными версиями;
+        # недочитанные строки - только если их можно продолжить (известны порядок и позиция)
+        if self.row_stream is None or self.row_versions is None or not self.current_table:
+            return
+        exhausted = self.table_model.is_exhausted()
+        if not exhausted and (not self.row_stream.order or self.row_position is None):
+            self.snapshot_cache.discard(self.current_table)
+            return
+        self.snapshot_cache.put(self.current_table, TableSnapshot(
+            self.row_versions, list(self.table_model.column_names()), list(self.table_model.rows()),
+            exhausted, self.row_count_estimate, self.row_stream.order, self.row_position
+        ))
+
+    def stream_pages(self, stream):
+        # Источник страниц для модели: страница читается в фоне (соединение поток берет сам),
+        # после каждой страницы отсчет простоя начинается заново
+        def fetch_page(count, deliver):
+            def job(connection):
+                rows = stream.fetch(count)
+                return rows, stream.position
+
+            def on_finished(result):
+                rows, position = result
+                if self.row_stream is stream:
+                    self.row_position = position
+                    self.stream_idle_timer.start()
+                deliver(rows)
+
+            def on_failed(error):
+                self.statusBar().showMessage(f"Не удалось загрузить строки: {error}")
+                deliver([])
+
+            self.executor.submit(job, on_finished, on_failed, uses_connection=False)
+        return fetch_page
+
+    def suspend_row_stream(self):
+        # Курсор закрывается, соединение возвращается в пул; прокрутка продолжит чтение.
+        # В фоне: поток может ждать окончания чтения страницы
+        self.stream_idle_timer.stop()
+        stream = self.row_stream
+        if stream:
+            self.executor.submit(lambda connection: stream.suspend(), None, uses_connection=False)
+
+    def close_row_stream(self):
+        self.stream_idle_timer.stop()
+        stream, self.row_stream = self.row_stream, None
+        if stream:
+            self.executor.submit(lambda connection: stream.close(), None, uses_connection=False)
+
+    def changeEvent(self, event):
+        # Окно ушло в фон - курсор не держим, пока пользователь не вернется
+        if event.type() == QEvent.Type.ActivationChange and not self.isActiveWindow():
+            self.suspend_row_stream()
+        super().changeEvent(event)
+
+    def update_row_count_status(self):
+        loaded = self.table_model.rowCount()
+        if self.table_model.is_exhausted():
+            self.statusBar().showMessage(f"Строк: {loaded}")
+        else:
+            self.statusBar().showMessage(f"Загружено строк: {loaded} из ~{self.row_count_estimate}")
 
-        # Подключаем обработчик для клика по заголовку таблицы
-        self.table_widget.horizontalHeader().sectionClicked.connect(self.sort_table)
+    def row_key(self):
+        # Базовая таблица, чей первичный ключ однозначно определяет строку текущей таблицы
+        return self.metadata.get(self.current_table, {}).get("row_key", {})
 
-    def load_table_data(self):
-        self.current_table = self.table_selector.currentText()
-        if not self.current_table:
+    def on_rows_changed(self, table, op, keys):
+        if self.row_stream is None or not self.current_table:
             return
 
-        try:
-            query = f"SELECT * FROM {self.current_table}"
-            self.cursor.execute(query)
-            rows = self.cursor.fetchall()
-            column_names = [desc[0] for desc in self.cursor.description]
+        row_key = self.row_key()
+        if table == row_key.get("table") and keys is not None and self.table_model.has_row_key():
+            self.pending_keys += [key for key in keys if key not in self.pending_keys]
+            self.changes_timer.start()
+            return
+
+        # Добавление строки в справочник само по себе не меняет строк представления:
+        # они появятся вместе с изменением таблицы, которая на этот справочник ссылается
+        if op == "INSERT" and table != row_key.get("table"):
+            return
+        if table == self.current_table or table in self.table_dependencies.get(self.current_table, ()):
+            self.reload_timer.start()
+
+    def apply_pending_changes(self):
+        keys, self.pending_keys = self.pending_keys, []
+        self.refresh_rows(keys)
+
+    def refresh_rows(self, keys):
+        # Перечитываем только измененные строки тем же запросом, что показан в таблице
+        stream = self.row_stream
+        if stream is None or not keys:
+            return
+
+        key_columns = self.row_key()["columns"]
+        params = dict(stream.params or {})
+        values = []
+        for i, key in enumerate(keys):
+            names = [f"row_key_{i}_{j}" for j in range(len(key_columns))]
+            params.update({name: key_text(key[column]) for name, column in zip(names, key_columns)})
+            values.append("(" + ", ".join(f"%({name})s" for name in names) + ")")
+        query = f"""
+            SELECT {", ".join(stream.column_names)} FROM ({stream.query}) current_rows
+            WHERE ({", ".join(key_columns)}) IN ({", ".join(values)})
+        """
+        row_keys = [tuple(key_text(key[column]) for column in key_columns) for key in keys]
 
-            self.load_rows(rows, column_names)
+        def job(connection):
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
 
-        except psycopg2.Error as e:
-            QMessageBox.critical(self, "Ошибка загрузки данных", f"Не удалось загрузить данные из таблицы:\n{e}")
+        def on_finished(rows):
+            # Пока строки читались, в таблице могли открыть другие данные
+            if self.row_stream is stream and not self.table_model.apply_changes(row_keys, rows):
+                self.reload_timer.start()
+
+        self.run_in_background(job, on_finished, "Ошибка обновления данных", "Не удалось обновить строки таблицы")
 
     def sort_table(self, index):
-        if index in self.sort_order:
-            # Если сортировка уже была включена для этого столбца, меняем направление
-            self.sort_order[index] = not self.sort_order[index]
+        column_names = self.table_model.column_names()
+        if index >= len(column_names) or not self.current_table:
+            return
+
+        # Клик по столбцу: по возрастанию -> по убыванию -> без сортировки.
+        # Без Ctrl сортировка по остальным столбцам сбрасывается
+        column = column_names[index]
+        if QApplication.keyboardModifiers() & Qt.KeyboardModifier.ControlModifier:
+            order = list(self.sort_order)
+        else:
+            order = [item for item in self.sort_order if item[0] == column]
+        position = next((i for i, (name, _) in enumerate(order) if name == column), None)
+        if position is None:
+            order.append((column, False))
+        elif not order[position][1]:
+            order[position] = (column, True)
         else:
-            # Если сортировка еще не была включена для этого столбца, сортируем по убыванию
-            self.sort_order = {key: False for key in self.sort_order}  # Сброс сортировки всех других столбцов
-            self.sort_order[index] = True  # Устанавливаем сортировку по убыванию для текущего столбца
+            del order[position]
+
+        self.sort_order = order
+        self.table_model.set_sort_columns(order)
+        # Перезапрос с новым порядком - вся таблица или текущий результат поиска
+        self.search_records()
+
+    def import_csv(self):
+        if self.current_table not in self.metadata:
+            QMessageBox.critical(self, "Ошибка", f"Нет метаданных для таблицы '{self.current_table}'!")
+            return
+
+        table = self.current_table
+        columns = ", ".join(self.importer.import_fields(table))
+        path, _ = QFileDialog.getOpenFileName(
+            self, f"Импорт в {table} (столбцы: {columns})", "", "CSV (*.csv);;Все файлы (*)"
+        )
+        if not path:
+            return
+
+        def job(connection):
+            with open(path, "r", encoding="utf-8-sig", newline="") as file:
+                return self.importer.import_csv(connection, table, file)
+
+        # Показанные строки обновятся по уведомлению об изменении таблицы
+        self.run_in_background(job, self.show_import_result, "Ошибка импорта", "Не удалось загрузить файл",
+                               tag="import", progress_parent=self, progress_text=f"Загрузка файла в {table}...",
+                               readonly=False)
+
+    def show_import_result(self, result):
+        message = QMessageBox(self)
+        message.setWindowTitle("Импорт из CSV")
+        message.setText(
+            f"Строк в файле: {result.total}\n"
+            f"Добавлено в {result.target_table}: {result.inserted}\n"
+            f"Уже существовали: {result.duplicates}\n"
+            f"Отклонено: {result.rejected_count}"
+        )
+        if result.rejected:
+            details = "\n".join(f"Строка {line_number}: {reason}" for line_number, reason in result.rejected)
+            if result.rejected_count > len(result.rejected):
+                details += f"\n... и еще {result.rejected_count - len(result.rejected)}"
+            message.setDetailedText(details)
+        message.exec()
+
+    def export_rows(self):
+        if self.row_stream is None:
+            QMessageBox.warning(self, "Экспорт", "Нет данных для выгрузки.")
+            return
+
+        # Выгружается тот же запрос, что показан в таблице (вся таблица или результат поиска),
+        # целиком и в том же порядке, а не только загруженные строки, и со всеми столбцами,
+        # включая широкие, которых в показанных строках нет
+        table, search_text, sort_order = self.current_table, self.shown_search, list(self.sort_order)
+        key_columns = self.row_key().get("columns")
+        formats = available_formats()
+        filters = [f"{name} (*{EXPORT_FORMATS[name][0]})" for name in formats]
+        path, selected_filter = QFileDialog.getSaveFileName(
+            self, f"Экспорт {self.current_table}", f"{self.current_table}{EXPORT_FORMATS[formats[0]][0]}",
+            ";;".join(filters)
+        )
+        if not path:
+            return
+        export_format = formats[filters.index(selected_filter)] if selected_filter in filters else formats[0]
+        extension = EXPORT_FORMATS[export_format][0]
+        if not path.lower().endswith(extension):
+            path += extension
+
+        state = {}
+
+        def is_cancelled():
+            worker = state.get("worker")
+            return worker is not None and worker.is_cancelled
+
+        def job(connection):
+            if search_text:
+                with connection.cursor() as cursor:
+                    query, params = self.search_engine.build_query(cursor, table, search_text, lazy=True)
+            else:
+                query, params = select_query(self.metadata, table, lazy=True), None
+            if sort_order:
+                query = sorted_query(query, sort_order)
+            elif not search_text and key_columns:
+                # Таблица без сортировки показана в порядке ключа
+                query = sorted_query(query, stream_order([], key_columns))
+            return export_query(connection, query, params, path, export_format, is_cancelled)
+
+        def on_finished(row_count):
+            QMessageBox.information(self, "Экспорт", f"Выгружено строк: {row_count}\n{path}")
+
+        state["worker"] = self.run_in_background(job, on_finished, "Ошибка экспорта", "Не удалось выгрузить данные",
+                                                 tag="export", progress_parent=self,
+                                                 progress_text=f"Выгрузка в {os.path.basename(path)}...")
 
     def open_add_record_form(self):
         try:
@@ -197,6 +721,32 @@ class App(QMainWindow):
             QMessageBox.critical(self, "Ошибка", f"Нет метаданных для таблицы '{self.current_table}'!")
             return
 
+        self.fetch_lookups(fields, lambda lookup_values: self.show_add_record_form(fields, lookup_values))
+
+    def fetch_lookups(self, fields, on_ready, skip=()):
+        lookups = {
+            field: (details["source_table"], details["source_column"])
+            for field, details in fields.items()
+            if details.get("input_type") == "dropdown" and field not in skip
+        }
+        self.load_lookups(lookups, on_ready)
+
+    def load_lookups(self, lookups, on_ready):
+        # Если все списки уже в кэше, форма открывается сразу, без обращения к базе
+        cached = self.lookup_cache.cached(lookups.values())
+        if cached is not None:
+            on_ready({field: cached[pair] for field, pair in lookups.items()})
+            return
+
+        # Иначе недостающие списки загружаются в фоне
+        def job(connection):
+            values = self.lookup_cache.get_many(connection, lookups.values())
+            return {field: values[pair] for field, pair in lookups.items()}
+
+        self.run_in_background(job, on_ready, "Ошибка загрузки списков", "Не удалось загрузить значения для формы",
+                               tag="form")
+
+    def show_add_record_form(self, fields, lookup_values):
         dialog = QDialog(self)
         dialog.setWindowTitle(f"Добавить запись в {self.current_table}")
         layout = QFormLayout(dialog)
@@ -209,13 +759,7 @@ class App(QMainWindow):
 
             if input_type == "dropdown":
                 combo_box = QComboBox()
-                source_table = details["source_table"]
-                source_column = details["source_column"]
-                # Получение данных для выпадающего списка
-                query = f"SELECT {source_column} FROM {source_table}"
-                self.cursor.execute(query)
-                values = [str(row[0]) for row in self.cursor.fetchall()]
-                combo_box.addItems(values)
+                combo_box.addItems(lookup_values[field])
                 layout.addRow(f"{details['description']} ({field}):", combo_box)
                 input_fields[field] = combo_box
             elif input_type == "datetime":
@@ -292,39 +836,89 @@ class App(QMainWindow):
             staff_count = int(data["staff_count"])
             del data["staff_count"]
 
-        try:
-            self.add_record(data)
-
+        def on_added():
             brigade_name = data.get("brigade_name", "")
-            for i in range(1, staff_count + 1):
-                self.open_add_staff_form(i, [brigade_name])
+            if staff_count:
+                self.open_add_staff_forms(staff_count, brigade_name)
 
-            self.load_table_data()
             QMessageBox.information(self, "Успех", "Запись успешно добавлена!")
             dialog.accept()
-        except Exception as e:
-            QMessageBox.critical(dialog, "Ошибка", f"Не удалось добавить запись:\n{e}")
 
-    def add_record(self, data):
-        try:
-            # Получение метаданных из JSON
-            meta = self.metadata[self.current_table]
+        self.add_record(data, on_added, dialog)
+
+    def write_in_background(self, job, on_finished, error_text, dialog=None):
+        # Запись идет в фоне отдельной короткой транзакцией (job сам делает commit); форма на это
+        # время недоступна, чтобы ту же запись не отправили дважды, а ошибка показывается над ней
+        if dialog is not None:
+            dialog.setEnabled(False)
+
+        def on_done():
+            if dialog is not None:
+                dialog.setEnabled(True)
+
+        def on_failed(error):
+            QMessageBox.critical(dialog or self, "Ошибка", f"{error_text}:\n{error}")
+
+        self.executor.submit(job, on_finished, on_failed, on_done=on_done, readonly=False)
+
+    def add_record(self, data, on_added, dialog=None):
+        # Получение метаданных из JSON
+        table = self.current_table
+        meta = self.metadata[table]
+
+        # Формируем запрос на добавление записи в основную таблицу
+        table_name = meta.get("main_table", table)
+        fields_str = ", ".join(data.keys())
+        placeholders = ", ".join(["%s"] * len(data))
+        insert_query = f"INSERT INTO {table_name} ({fields_str}) VALUES ({placeholders})"
+
+        # Ключ новой строки возвращается сразу, чтобы показать ее без перезагрузки таблицы
+        key_columns = self.row_key().get("columns", [])
+        if key_columns:
+            insert_query += f" RETURNING {', '.join(key_columns)}"
+
+        def job(connection):
+            with connection.cursor() as cursor:
+                self.ensure_record_partition(cursor, meta, data)
+                execute_prepared(cursor, insert_query, tuple(data.values()))
+                keys = [dict(zip(key_columns, row)) for row in cursor.fetchall()] if key_columns else []
+            connection.commit()
+            return keys
+
+        def on_finished(keys):
+            # Пока шла запись, могли открыть другую таблицу - ее строки обновятся по уведомлению
+            if self.current_table == table:
+                if keys:
+                    self.refresh_rows(keys)
+                else:
+                    self.load_table_data()
+            on_added()
+
+        self.write_in_background(job, on_finished, "Не удалось добавить запись", dialog)
 
-            # Формируем запрос на добавление записи в основную таблицу
-            table_name = meta.get("main_table", self.current_table)
-            fields_str = ", ".join(data.keys())
-            placeholders = ", ".join(["%s"] * len(data))
-            insert_query = f"INSERT INTO {table_name} ({fields_str}) VALUES ({placeholders})"
+    @staticmethod
+    def ensure_record_partition(cursor, meta, data):
+        # Запись может попасть в месяц, для которого секции еще нет
+        partitions = meta.get("partitions")
+        if partitions and data.get(partitions["column"]):
+            value = data[partitions["column"]]
+            ensure_partitions(cursor, partitions, value, value)
+
+    def open_add_staff_forms(self, staff_count, brigade_name):
+        try:
+            fields = self.metadata["staff_details"]["fields"]
+        except KeyError:
+            QMessageBox.critical(self, "Ошибка", "Нет метаданных для таблицы 'staff_details'!")
+            return
 
-            # Выполняем запрос
-            self.cursor.execute(insert_query, tuple(data.values()))
-            self.db_connection.commit()
+        # Списки загружаются один раз для всех форм, бригада уже известна
+        def show_forms(lookup_values):
+            for i in range(1, staff_count + 1):
+                self.open_add_staff_form(i, [brigade_name], lookup_values)
 
-        except psycopg2.Error as e:
-            self.db_connection.rollback()
-            QMessageBox.critical(self, "Ошибка", f"Ошибка добавления записи:\n{e}")
+        self.fetch_lookups(fields, show_forms, skip=("brigade_name",))
 
-    def open_add_staff_form(self, staff_index, brigade_name):
+    def open_add_staff_form(self, staff_index, brigade_name, lookup_values):
         try:
             meta = self.metadata["staff_details"]
             fields = meta["fields"]
@@ -345,12 +939,7 @@ class App(QMainWindow):
                 if field == "brigade_name":
                     combo_box.addItems(brigade_name)
                 else:
-                    source_table = details["source_table"]
-                    source_column = details["source_column"]
-                    query = f"SELECT {source_column} FROM {source_table}"
-                    self.cursor.execute(query)
-                    values = [str(row[0]) for row in self.cursor.fetchall()]
-                    combo_box.addItems(values)
+                    combo_box.addItems(lookup_values[field])
                 layout.addRow(f"{details['description']} ({field}):", combo_box)
                 input_fields[field] = combo_box
             elif input_type == "datetime":
@@ -405,138 +994,214 @@ class App(QMainWindow):
 
             data[field] = value
 
-        try:
-            self.add_staff(data)
+        def on_added():
             QMessageBox.information(dialog, "Успех", f"Сотрудник {staff_index} успешно добавлен!")
             dialog.accept()
-        except Exception as e:
-            QMessageBox.critical(dialog, "Ошибка", f"Не удалось добавить сотрудника {staff_index}: {e}")
 
-    def add_staff(self, data):
-        try:
-            # Получение метаданных из JSON
-            meta = self.metadata["staff_details"]
+        self.add_staff(data, on_added, dialog, f"Не удалось добавить сотрудника {staff_index}")
 
-            # Формируем запрос на добавление записи в основную таблицу
-            table_name = meta.get("main_table", "staff_details")
-            fields_str = ", ".join(data.keys())
-            placeholders = ", ".join(["%s"] * len(data))
-            insert_query = f"INSERT INTO {table_name} ({fields_str}) VALUES ({placeholders})"
+    def add_staff(self, data, on_added, dialog=None, error_text="Не удалось добавить сотрудника"):
+        # Получение метаданных из JSON
+        meta = self.metadata["staff_details"]
 
-            # Выполняем запрос
-            self.cursor.execute(insert_query, tuple(data.values()))
-            self.db_connection.commit()
+        # Формируем запрос на добавление записи в основную таблицу
+        table_name = meta.get("main_table", "staff_details")
+        fields_str = ", ".join(data.keys())
+        placeholders = ", ".join(["%s"] * len(data))
+        insert_query = f"INSERT INTO {table_name} ({fields_str}) VALUES ({placeholders})"
 
-        except psycopg2.Error as e:
-            self.db_connection.rollback()
-            QMessageBox.critical(self, "Ошибка", f"Ошибка добавления записи:\n{e}")
+        def job(connection):
+            with connection.cursor() as cursor:
+                execute_prepared(cursor, insert_query, tuple(data.values()))
+            connection.commit()
+
+        self.write_in_background(job, lambda result: on_added(), error_text, dialog)
 
     def edit_record(self, row_data):
         try:
             # Получение метаданных для текущей таблицы
             meta = self.metadata[self.current_table]
             fields = meta["fields"]
-
-            dialog = QDialog(self)
-            dialog.setWindowTitle(f"Редактировать запись в {self.current_table}")
-            layout = QFormLayout(dialog)
-
-            input_fields = {}
-
-            # Заполнение полей данными из строки
-            for field, details in fields.items():
-                input_type = details.get("input_type", "text")
-                current_value = row_data.get(field, "")
-
-                if input_type == "dropdown":
-                    combo_box = QComboBox()
-                    source_table = details["source_table"]
-                    source_column = details["source_column"]
-                    query = f"SELECT {source_column} FROM {source_table}"
-                    self.cursor.execute(query)
-                    values = [str(row[0]) for row in self.cursor.fetchall()]
-                    combo_box.addItems(values)
-                    combo_box.setCurrentText(str(current_value))
-                    layout.addRow(f"{details['description']} ({field}):", combo_box)
-                    input_fields[field] = combo_box
-                elif input_type == "datetime":
-                    date_edit = QDateTimeEdit()
-                    date_edit.setCalendarPopup(True)
-                    if current_value:
-                        date_edit.setDateTime(QDateTime.fromString(current_value, "yyyy-MM-dd HH:mm:ss"))
-                    layout.addRow(f"{details['description']} ({field}):", date_edit)
-                    input_fields[field] = date_edit
-                elif input_type == "number":
-                    line_edit = QLineEdit()
-                    line_edit.setValidator(QIntValidator())
-                    line_edit.setText(str(current_value))
-                    layout.addRow(f"{details['description']} ({field}):", line_edit)
-                    input_fields[field] = line_edit
-                elif input_type == "staff_inn":
-                    line_edit = QLineEdit()
-                    line_edit.setValidator(QRegularExpressionValidator(QRegularExpression("\\d{12}")))
-                    line_edit.setText(str(current_value))
-                    layout.addRow(f"{details['description']} ({field}):", line_edit)
-                    input_fields[field] = line_edit
-                elif input_type == "station_inn":
-                    line_edit = QLineEdit()
-                    line_edit.setValidator(QRegularExpressionValidator(QRegularExpression("\\d{10}")))
-                    line_edit.setText(str(current_value))
-                    layout.addRow(f"{details['description']} ({field}):", line_edit)
-                    input_fields[field] = line_edit
-                elif input_type == "gender_dropdown":
-                    combo_box = QComboBox()
-                    combo_box.addItems(["M", "F"])
-                    combo_box.setCurrentText(str(current_value))
-                    layout.addRow(f"{details['description']} ({field}):", combo_box)
-                    input_fields[field] = combo_box
-                elif input_type == "text":
-                    line_edit = QLineEdit()
-                    line_edit.setText(str(current_value))
-                    layout.addRow(f"{details['description']} ({field}):", line_edit)
-                    input_fields[field] = line_edit
-
-            button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-            button_box.accepted.connect(lambda: self.submit_edit_record(dialog, row_data, input_fields))
-            button_box.rejected.connect(dialog.reject)
-            layout.addWidget(button_box)
-
-            dialog.exec()
-
         except KeyError:
             QMessageBox.critical(self, "Ошибка", f"Нет метаданных для таблицы '{self.current_table}'!")
+            return
+
+        def show_form(row_data):
+            self.fetch_lookups(fields, lambda lookup_values: self.show_edit_record_form(row_data, fields, lookup_values))
+
+        # Широкие столбцы ("lazy" в метаданных) в строках таблицы не читаются - берем их по ключу строки
+        lazy = lazy_columns(meta)
+        key_columns = self.row_key().get("columns", [])
+        if not lazy or not key_columns or any(row_data.get(column) is None for column in key_columns):
+            show_form(row_data)
+            return
+        table = self.current_table
+        key_values = [row_data[column] for column in key_columns]
+
+        def job(connection):
+            with connection.cursor() as cursor:
+                execute_prepared(cursor, f"SELECT {', '.join(lazy)} FROM {table}"
+                                         f" WHERE {' AND '.join(f'{column} = %s' for column in key_columns)}",
+                                 key_values)
+                row = cursor.fetchone()
+            return dict(zip(lazy, row)) if row else {}
+
+        self.run_in_background(job, lambda details: show_form({**row_data, **details}),
+                               "Ошибка загрузки записи", "Не удалось прочитать запись", tag="form")
+
+    def show_edit_record_form(self, row_data, fields, lookup_values):
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"Редактировать запись в {self.current_table}")
+        layout = QFormLayout(dialog)
+
+        input_fields = {}
+
+        # Заполнение полей данными из строки
+        for field, details in fields.items():
+            input_type = details.get("input_type", "text")
+            current_value = row_data.get(field, "")
 
-    def submit_edit_record(self, dialog, row_data, input_fields):
+            if input_type == "dropdown":
+                combo_box = QComboBox()
+                combo_box.addItems(lookup_values[field])
+                combo_box.setCurrentText(str(current_value))
+                layout.addRow(f"{details['description']} ({field}):", combo_box)
+                input_fields[field] = combo_box
+            elif input_type == "datetime":
+                date_edit = QDateTimeEdit()
+                date_edit.setCalendarPopup(True)
+                if current_value:
+                    date_edit.setDateTime(QDateTime.fromString(str(current_value), "yyyy-MM-dd HH:mm:ss"))
+                layout.addRow(f"{details['description']} ({field}):", date_edit)
+                input_fields[field] = date_edit
+            elif input_type == "number":
+                line_edit = QLineEdit()
+                line_edit.setValidator(QIntValidator())
+                line_edit.setText(str(current_value))
+                layout.addRow(f"{details['description']} ({field}):", line_edit)
+                input_fields[field] = line_edit
+            elif input_type == "staff_inn":
+                line_edit = QLineEdit()
+                line_edit.setValidator(QRegularExpressionValidator(QRegularExpression("\\d{12}")))
+                line_edit.setText(str(current_value))
+                layout.addRow(f"{details['description']} ({field}):", line_edit)
+                input_fields[field] = line_edit
+            elif input_type == "station_inn":
+                line_edit = QLineEdit()
+                line_edit.setValidator(QRegularExpressionValidator(QRegularExpression("\\d{10}")))
+                line_edit.setText(str(current_value))
+                layout.addRow(f"{details['description']} ({field}):", line_edit)
+                input_fields[field] = line_edit
+            elif input_type == "gender_dropdown":
+                combo_box = QComboBox()
+                combo_box.addItems(["M", "F"])
+                combo_box.setCurrentText(str(current_value))
+                layout.addRow(f"{details['description']} ({field}):", combo_box)
+                input_fields[field] = combo_box
+            elif input_type == "text":
+                line_edit = QLineEdit()
+                line_edit.setText(str(current_value))
+                layout.addRow(f"{details['description']} ({field}):", line_edit)
+                input_fields[field] = line_edit
+
+        # Значения полей при открытии формы: изменение запишет только те, что поменял пользователь
+        initial_values = {field: self.read_input(widget) for field, widget in input_fields.items()}
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        button_box.accepted.connect(lambda: self.submit_edit_record(dialog, row_data, input_fields, initial_values))
+        button_box.rejected.connect(dialog.reject)
+        layout.addWidget(button_box)
+
+        dialog.exec()
+
+    @staticmethod
+    def read_input(widget):
+        if isinstance(widget, QComboBox):
+            return widget.currentText().strip()
+        if isinstance(widget, QDateTimeEdit):
+            return widget.dateTime().toString("yyyy-MM-dd HH:mm:ss")
+        return widget.text().strip()
+
+    def submit_edit_record(self, dialog, row_data, input_fields, initial_values):
         try:
             new_data = {}
 
             # Сбор новых данных из формы
             for field, widget in input_fields.items():
-                if isinstance(widget, QComboBox):
-                    value = widget.currentText().strip()
-                elif isinstance(widget, QDateTimeEdit):
-                    value = widget.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-                else:
-                    value = widget.text().strip()
+                value = self.read_input(widget)
 
                 if not value:
                     QMessageBox.warning(dialog, "Ошибка", f"Поле '{field}' не заполнено!")
                     return
 
-                new_data[field] = value
+                # Неизмененные поля в UPDATE не попадают
+                if value != initial_values.get(field):
+                    new_data[field] = value
 
-            # Удаление старой записи
-            self.delete_record(row_data)
+            def on_updated(updated):
+                if not updated:
+                    QMessageBox.warning(dialog, "Ошибка", "Запись не найдена или значения не найдены в справочниках!")
+                    return
 
-            # Добавление новой записи с обновленными данными
-            self.add_record(new_data)
+                QMessageBox.information(self, "Успех", "Запись успешно обновлена!")
+                dialog.accept()
 
-            self.load_table_data()
-            QMessageBox.information(self, "Успех", "Запись успешно обновлена!")
-            dialog.accept()
+            if not new_data:
+                on_updated(True)
+                return
+            self.update_record(row_data, new_data, on_updated, dialog)
         except Exception as e:
             QMessageBox.critical(dialog, "Ошибка", f"Не удалось обновить запись:\n{e}")
 
+    def update_record(self, row_data, data, on_updated, dialog=None):
+        # Один UPDATE по ключу строки в одной короткой транзакции: представления
+        # меняются через триггеры INSTEAD OF UPDATE, базовые таблицы - напрямую.
+        # on_updated(False) - строка не найдена. Ключ строк секционированной таблицы содержит
+        # столбец секционирования (у route_stops - время отправления маршрута), поэтому
+        # условие по ключу читает в представлении одну секцию
+        table = self.current_table
+        meta = self.metadata[table]
+        fields = meta["fields"]
+        key_columns = self.row_key().get("columns", [])
+        if not key_columns or any(row_data.get(column) is None for column in key_columns):
+            raise KeyError("нет ключа строки в метаданных или данных строки")
+
+        is_view = self.current_table in self.table_dependencies
+        assignments = []
+        for field in data:
+            foreign_key = fields.get(field, {}).get("foreign_key")
+            if foreign_key and not is_view:
+                # В базовой таблице хранится код, а в форме выбрано название из справочника
+                assignments.append(
+                    f"{field} = (SELECT {foreign_key['key_column']} FROM {foreign_key['table']}"
+                    f" WHERE {fields[field]['source_column']} = %s LIMIT 1)"
+                )
+            else:
+                assignments.append(f"{field} = %s")
+
+        where_clause = " AND ".join(f"{column} = %s" for column in key_columns)
+        query = (
+            f"UPDATE {meta.get('main_table', self.current_table)} SET {', '.join(assignments)}"
+            f" WHERE {where_clause} RETURNING {', '.join(key_columns)}"
+        )
+        old_key = {column: row_data[column] for column in key_columns}
+
+        def job(connection):
+            with connection.cursor() as cursor:
+                self.ensure_record_partition(cursor, meta, data)
+                execute_prepared(cursor, query, list(data.values()) + list(old_key.values()))
+                new_keys = [dict(zip(key_columns, row)) for row in cursor.fetchall()]
+            connection.commit()
+            return new_keys
+
+        def on_finished(new_keys):
+            # Ключ строки мог измениться: перечитываем и старый, и новый
+            if new_keys and self.current_table == table:
+                self.refresh_rows([old_key] + [key for key in new_keys if key != old_key])
+            on_updated(bool(new_keys))
+
+        self.write_in_background(job, on_finished, "Не удалось обновить запись", dialog)
+
     def delete_record(self, row_data):
         try:
             # Получаем имя таблицы и ключевые столбцы из мета-данных
@@ -554,13 +1219,26 @@ class App(QMainWindow):
 
             # Формируем SQL-запрос на удаление
             query = f"DELETE FROM {table_name} WHERE {where_clause}"
-            self.cursor.execute(query, key_values)
-            self.db_connection.commit()
-
-            self.load_table_data()
-            QMessageBox.information(self, "Успех", "Запись успешно удалена.")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось удалить запись: {e}")
+            return
+
+        row_key = tuple(key_text(row_data.get(column)) for column in self.row_key().get("columns", []))
+        stream = self.row_stream
+
+        def job(connection):
+            with connection.cursor() as cursor:
+                execute_prepared(cursor, query, key_values)
+            connection.commit()
+
+        def on_finished(result):
+            # Убираем строку из таблицы на месте, перезагрузка нужна только без ключа строки;
+            # если за это время открыли другие строки, они уже прочитаны после удаления
+            if self.row_stream is stream and not self.table_model.apply_changes([row_key], []):
+                self.load_table_data()
+            QMessageBox.information(self, "Успех", "Запись успешно удалена.")
+
+        self.write_in_background(job, on_finished, "Не удалось удалить запись")
 
 
     def search_records(self):
@@ -569,457 +1247,314 @@ class App(QMainWindow):
             self.load_table_data()
             return
 
-        try:
-            # Запрос для поиска по всем полям таблицы
-            query = f"SELECT * FROM {self.current_table} WHERE " + " OR ".join(
-                [f"CAST({col[0]} AS TEXT) ILIKE %s" for col in self.cursor.description]
-            )
-            search_pattern = f"%{search_query}%"
-            self.cursor.execute(query, [search_pattern] * len(self.cursor.description))
-
-            rows = self.cursor.fetchall()
+        self.search_timer.stop()
+        table = self.current_table
+        self.shown_search = search_query
 
-            column_names = [desc[0] for desc in self.cursor.description]
+        # Запрос строится в фоне: для него нужны типы столбцов из каталога
+        def build_query(connection):
+            with connection.cursor() as cursor:
+                return self.search_engine.build_query(cursor, table, search_query, ranked=True)
 
-            self.load_rows(rows, column_names)
+        self.load_stream(build_query, "Ошибка поиска", "Не удалось выполнить поиск", ranked=True)
 
-        except psycopg2.Error as e:
-            QMessageBox.critical(self, "Ошибка поиска", f"Не удалось выполнить поиск:\n{e}")
-
-    def get_column_names(self):
-        if not self.current_table:
-            return []
-        self.cursor.execute(f"SELECT * FROM {self.current_table} LIMIT 1")
-        return [desc[0] for desc in self.cursor.description]
+    def on_search_text_changed(self, text):
+        # Короткие запросы не ищем при вводе: триграммный индекс для них не работает
+        if not text.strip() or len(text.strip()) >= MIN_QUERY_LENGTH:
+            self.search_timer.start()
+        else:
+            self.search_timer.stop()
 
     def open_report_dialog(self):
-        # Окно выбора типа отчета
+        # Окно выбора отчета: список строится по метаданным отчетов
         dialog = QDialog(self)
         dialog.setWindowTitle("Сформировать отчет")
 
         report_type_label = QLabel("Выберите отчет:")
-        self.report_type_combobox = QComboBox()
-        self.report_type_combobox.addItems([
-            "Среднее время в пути для маршрутов",
-            "Популярные направления маршрутов",
-            "Используемость бригад"
-        ])
+        report_type_combobox = QComboBox()
+        for name, report in self.report_engine.reports.items():
+            report_type_combobox.addItem(report["description"], (name, False))
+            # Пакетный вариант: файл на каждую группу (например, вокзал и месяц)
+            if "batch" in report:
+                report_type_combobox.addItem(report["batch"]["description"], (name, True))
 
         # Кнопка "OK" для продолжения
         button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-        button_box.accepted.connect(lambda: self.open_selected_report(dialog))
+        button_box.accepted.connect(lambda: self.open_report_params_dialog(dialog, *report_type_combobox.currentData()))
         button_box.rejected.connect(dialog.reject)
 
         layout = QFormLayout()
-        layout.addRow(report_type_label, self.report_type_combobox)
+        layout.addRow(report_type_label, report_type_combobox)
         layout.addWidget(button_box)
         dialog.setLayout(layout)
 
         dialog.exec()
 
-    def open_selected_report(self, parent_dialog):
-        # Получаем выбранный тип отчета
-        selected_report = self.report_type_combobox.currentText()
-
-        # Открываем соответствующее окно настроек отчета
-        if selected_report == "Среднее время в пути для маршрутов":
-            self.open_route_report_dialog(parent_dialog)
-        elif selected_report == "Популярные направления маршрутов":
-            self.open_popular_directions_report_dialog(parent_dialog)
-        elif selected_report == "Используемость бригад":
-            self.open_brigade_usage_report_dialog(parent_dialog)
-
-    def open_route_report_dialog(self, parent_dialog):
+    def open_report_params_dialog(self, parent_dialog, name, batch=False):
         parent_dialog.accept()
+        report = self.report_engine.reports[name]
+        description = report["batch"]["description"] if batch else report["description"]
 
         dialog = QDialog(self)
-        dialog.setWindowTitle("Настройки отчета: Среднее время в пути")
+        dialog.setWindowTitle(f"Настройки отчета: {description}")
+        layout = QFormLayout()
 
-        # Вокзал отправления
-        station_label = QLabel("Вокзал отправления:")
-        self.station_combobox = QComboBox()
-        self.get_station_names()
+        # Поле ввода на каждый параметр отчета по его типу
+        input_fields = {}
+        lookups = {}
+        for param in report["params"]:
+            if param["type"] == "dropdown":
+                # В пакете выбирается несколько значений сразу (по умолчанию все)
+                if batch:
+                    widget = QListWidget()
+                    widget.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
+                else:
+                    widget = QComboBox()
+                lookups[param["name"]] = (param["source_table"], param["source_column"])
+            elif param["type"] == "datetime":
+                widget = QDateTimeEdit(QDateTime.currentDateTime())
+                widget.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+            elif param["type"] == "integer":
+                widget = QSpinBox()
+                widget.setMinimum(param.get("min", 0))
+                widget.setMaximum(param.get("max", 100))
+                widget.setValue(param.get("default", widget.minimum()))
+            elif param["type"] == "order":
+                widget = QComboBox()
+                widget.addItems([label for label, _ in param["options"]])
+            else:
+                widget = QLineEdit()
+            input_fields[param["name"]] = widget
+            layout.addRow(param.get("label", ""), widget)
 
-        # Диапазон времени отправления
-        date_range_label = QLabel("Диапазон времени отправления:")
-        self.start_date_edit = QDateTimeEdit(QDateTime.currentDateTime())
-        self.start_date_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
-        self.end_date_edit = QDateTimeEdit(QDateTime.currentDateTime())
-        self.end_date_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+        def on_ready(lookup_values):
+            for field, values in lookup_values.items():
+                input_fields[field].addItems(values)
+                if isinstance(input_fields[field], QListWidget):
+                    input_fields[field].selectAll()
 
-        # Сортировка
-        sort_label = QLabel("Сортировка:")
-        self.sort_combobox = QComboBox()
-        self.sort_combobox.addItems(["ASC", "DESC"])
+        # Списки берутся из общего кэша или заполнятся, когда запрос выполнится
+        if lookups:
+            self.load_lookups(lookups, on_ready)
 
         # Кнопки
         button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-        button_box.accepted.connect(lambda: self.generate_route_report(dialog))
+        if batch:
+            button_box.accepted.connect(lambda: self.generate_batch_report(dialog, name, input_fields))
+        else:
+            button_box.accepted.connect(lambda: self.generate_report(dialog, name, input_fields))
         button_box.rejected.connect(dialog.reject)
-
-        # Layout
-        layout = QFormLayout()
-        layout.addRow(station_label, self.station_combobox)
-        layout.addRow(date_range_label, self.start_date_edit)
-        layout.addRow("", self.end_date_edit)
-        layout.addRow(sort_label, self.sort_combobox)
         layout.addWidget(button_box)
         dialog.setLayout(layout)
 
         dialog.exec()
 
-    def get_station_names(self):
-        try:
-            query = "SELECT name FROM stations"
-            self.cursor.execute(query)
-            stations = self.cursor.fetchall()
-            for station in stations:
-                self.station_combobox.addItem(station[0])  # Добавляем вокзал в список
-        except psycopg2.Error as e:
-            QMessageBox.critical(self, "Ошибка загрузки вокзалов", f"Не удалось загрузить вокзалы:\n{e}")
-
-    def generate_route_report(self, dialog):
-        departure_station = self.station_combobox.currentText()
-        start_date = self.start_date_edit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        end_date = self.end_date_edit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        sort_order = self.sort_combobox.currentText()
-
-        # Формируем SQL запрос
-        query = f"""
-        SELECT 
-            s1.name AS departure_station,
-            s2.name AS arrival_station,
-            ROUND(AVG(EXTRACT(EPOCH FROM (r.arrival_time - r.departure_time)) / 3600), 2) AS avg_travel_time_hours,
-            COUNT(*) AS route_count
-        FROM 
-            routes r
-        JOIN stations s1 ON r.departure_station_code = s1.station_code
-        JOIN stations s2 ON r.arrival_station_code = s2.station_code
-        WHERE 
-            r.departure_time BETWEEN %s AND %s
-            AND s1.name = %s
-        GROUP BY 
-            s1.name, s2.name
-        ORDER BY 
-            avg_travel_time_hours {sort_order};
-        """
+    @staticmethod
+    def read_report_params(input_fields):
+        values = {}
+        for param_name, widget in input_fields.items():
+            if isinstance(widget, QDateTimeEdit):
+                values[param_name] = widget.dateTime().toString("yyyy-MM-dd HH:mm:ss")
+            elif isinstance(widget, QSpinBox):
+                values[param_name] = widget.value()
+            elif isinstance(widget, QComboBox):
+                values[param_name] = widget.currentText()
+            elif isinstance(widget, QListWidget):
+                values[param_name] = [item.text() for item in widget.selectedItems()]
+            else:
+                values[param_name] = widget.text()
+        return values
 
-        try:
-            # Выполняем SQL запрос с переданными параметрами
-            self.cursor.execute(query, (start_date, end_date, departure_station))
-            report_data = self.cursor.fetchall()
+    def generate_report(self, dialog, name, input_fields):
+        values = self.read_report_params(input_fields)
+        pdf_file_path = os.path.join(os.path.expanduser("~"), "Desktop", self.report_engine.reports[name]["file_name"])
+        # Задача проверяет отмену между порциями строк, пока PDF строится в фоне
+        state = {}
+
+        def is_cancelled():
+            worker = state.get("worker")
+            return worker is not None and worker.is_cancelled
 
-            if not report_data:
+        def job(connection):
+            return self.report_engine.render(connection, name, values, pdf_file_path, is_cancelled=is_cancelled)
+
+        def on_finished(row_count):
+            if not row_count:
                 QMessageBox.warning(self, "Нет данных", "Для заданного периода и фильтров данные отсутствуют.")
                 return
 
-            # Создаем PDF файл
-            pdf_file_path = os.path.join(os.path.expanduser("~"), "Desktop", "route_report.pdf")
-            self.create_route_pdf(report_data, pdf_file_path)
-
             # Показываем сообщение об успешном сохранении
             QMessageBox.information(self, "Отчет сформирован", f"Отчет сохранен на рабочем столе:\n{pdf_file_path}")
             dialog.accept()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка генерации отчета", f"Не удалось сгенерировать отчет:\n{e}")
-
-    def create_route_pdf(self, data, file_path):
-        pdf = FPDF()
-        pdf.add_page()
-
-        # Пути к файлам шрифтов
-        font_dir = os.path.join(os.path.dirname(__file__), "fonts")
-        regular_font_path = os.path.join(font_dir, "timesnrcyrmt.ttf")
-        bold_font_path = os.path.join(font_dir, "timesnrcyrmt_bold.ttf")
-
-        # Подключение пользовательских шрифтов
-        pdf.add_font("TimesNewRoman", style="", fname=regular_font_path, uni=True)
-        pdf.add_font("TimesNewRoman", style="B", fname=bold_font_path, uni=True)
-
-        # Устанавливаем шрифт
-        pdf.set_font("TimesNewRoman", size=12)
-
-        # Заголовок
-        pdf.set_font("TimesNewRoman", style="B", size=16)
-        pdf.cell(0, 10, "Отчет по маршрутам", ln=True, align="C")
-        pdf.ln(10)  # Отступ
-
-        # Заголовки таблицы
-        pdf.set_font("TimesNewRoman", style="B", size=12)
-        column_headers = ["Вокзал отправления", "Вокзал прибытия", "Сред. время (ч)", "Кол-во маршрутов"]
-        column_widths = [50, 50, 40, 40]
-
-        for i, header in enumerate(column_headers):
-            pdf.cell(column_widths[i], 10, header, border=1, align="C")
-        pdf.ln()
-
-        # Данные таблицы
-        pdf.set_font("TimesNewRoman", size=12)
-        for row in data:
-            for i, cell in enumerate(row):
-                pdf.cell(column_widths[i], 10, str(cell), border=1, align="C")
-            pdf.ln()
-
-        # Сохраняем файл
-        try:
-            pdf.output(file_path)
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл:\n{e}")
-
-    def open_popular_directions_report_dialog(self, parent_dialog):
-        parent_dialog.accept()
-
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Настройки отчета: Популярные направления маршрутов")
-
-        # Диапазон времени отправления
-        date_range_label = QLabel("Диапазон времени отправления:")
-        self.start_date_edit = QDateTimeEdit(QDateTime.currentDateTime())
-        self.start_date_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
-        self.end_date_edit = QDateTimeEdit(QDateTime.currentDateTime())
-        self.end_date_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
 
-        # Сортировка
-        sort_label = QLabel("Сортировка:")
-        self.sort_combobox = QComboBox()
-        self.sort_combobox.addItems(["По количеству маршрутов", "По общему времени в пути"])
-
-        # Кнопки
-        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-        button_box.accepted.connect(lambda: self.generate_popular_directions_report(dialog))
-        button_box.rejected.connect(dialog.reject)
+        # Отчет формируется в фоне, его можно отменить из окна прогресса
+        state["worker"] = self.run_in_background(job, on_finished, "Ошибка генерации отчета",
+                                                 "Не удалось сгенерировать отчет", tag="report",
+                                                 progress_parent=dialog, progress_text="Формирование отчета...")
 
-        # Layout
-        layout = QFormLayout()
-        layout.addRow(date_range_label, self.start_date_edit)
-        layout.addRow("", self.end_date_edit)
-        layout.addRow(sort_label, self.sort_combobox)
-        layout.addWidget(button_box)
-        dialog.setLayout(layout)
+    def generate_batch_report(self, dialog, name, input_fields):
+        values = self.read_report_params(input_fields)
+        if any(isinstance(value, list) and not value for value in values.values()):
+            QMessageBox.warning(dialog, "Ошибка", "Выберите хотя бы одно значение для каждого списка.")
+            return
 
-        dialog.exec()
+        directory = QFileDialog.getExistingDirectory(dialog, "Папка для отчетов", os.path.expanduser("~"))
+        if not directory:
+            return
 
-    def generate_popular_directions_report(self, dialog):
-        start_date = self.start_date_edit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        end_date = self.end_date_edit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        sort_order = "route_count DESC, total_travel_time_hours DESC" if self.sort_combobox.currentText() == "По количеству маршрутов" else "total_travel_time_hours DESC, route_count DESC"
+        # Задача проверяет отмену между файлами пакета
+        state = {}
 
-        # Формируем SQL запрос
-        query = f"""
-        SELECT 
-            s1.name AS departure_station,
-            s2.name AS arrival_station,
-            COUNT(r.route_code) AS route_count,
-            ROUND(SUM(EXTRACT(EPOCH FROM (r.arrival_time - r.departure_time))) / 3600, 2) AS total_travel_time_hours
-        FROM 
-            routes r
-        JOIN stations s1 ON r.departure_station_code = s1.station_code
-        JOIN stations s2 ON r.arrival_station_code = s2.station_code
-        WHERE 
-            r.departure_time BETWEEN %s AND %s
-        GROUP BY 
-            s1.name, s2.name
-        ORDER BY 
-            {sort_order};
-        """
+        def is_cancelled():
+            worker = state.get("worker")
+            return worker is not None and worker.is_cancelled
 
-        try:
-            # Выполняем SQL запрос с переданными параметрами
-            self.cursor.execute(query, (start_date, end_date))
-            report_data = self.cursor.fetchall()
+        def job(connection):
+            return self.report_engine.render_batch(connection, name, values, directory, is_cancelled=is_cancelled)
 
-            if not report_data:
-                QMessageBox.warning(self, "Нет данных", "Для заданного периода данные отсутствуют.")
+        def on_finished(results):
+            from reports import BATCH_INDEX_FILE
+            if not results:
+                QMessageBox.warning(self, "Нет данных", "Для заданного периода и фильтров данные отсутствуют.")
                 return
 
-            # Создаем PDF файл
-            pdf_file_path = os.path.join(os.path.expanduser("~"), "Desktop", "popular_directions_report.pdf")
-            self.create_popular_routes_pdf(report_data, pdf_file_path)
-
-            # Показываем сообщение об успешном сохранении
-            QMessageBox.information(self, "Отчет сформирован", f"Отчет сохранен на рабочем столе:\n{pdf_file_path}")
+            QMessageBox.information(self, "Отчеты сформированы",
+                                    f"Сформировано отчетов: {len(results)}\nПапка: {directory}\n"
+                                    f"Список отчетов: {BATCH_INDEX_FILE}")
             dialog.accept()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка генерации отчета", f"Не удалось сгенерировать отчет:\n{e}")
-
-    def create_popular_routes_pdf(self, data, file_path):
-        pdf = FPDF()
-        pdf.add_page()
-
-        # Пути к файлам шрифтов
-        font_dir = os.path.join(os.path.dirname(__file__), "fonts")
-        regular_font_path = os.path.join(font_dir, "timesnrcyrmt.ttf")
-        bold_font_path = os.path.join(font_dir, "timesnrcyrmt_bold.ttf")
-
-        # Подключение пользовательских шрифтов
-        pdf.add_font("TimesNewRoman", style="", fname=regular_font_path, uni=True)
-        pdf.add_font("TimesNewRoman", style="B", fname=bold_font_path, uni=True)
-
-        # Устанавливаем шрифт
-        pdf.set_font("TimesNewRoman", size=12)
-
-        # Заголовок
-        pdf.set_font("TimesNewRoman", style="B", size=16)
-        pdf.cell(0, 10, "Популярные направления маршрутов", ln=True, align="C")
-        pdf.ln(10)  # Отступ
-
-        # Заголовки таблицы
-        pdf.set_font("TimesNewRoman", style="B", size=12)
-        column_headers = ["Вокзал отправления", "Вокзал прибытия", "Кол-во маршрутов", "Общее время (ч)"]
-        column_widths = [50, 50, 40, 50]
-
-        for i, header in enumerate(column_headers):
-            pdf.cell(column_widths[i], 10, header, border=1, align="C")
-        pdf.ln()
-
-        # Данные таблицы
-        pdf.set_font("TimesNewRoman", size=12)
-        for row in data:
-            for i, cell in enumerate(row):
-                pdf.cell(column_widths[i], 10, str(cell), border=1, align="C")
-            pdf.ln()
-
-        # Сохраняем файл
-        try:
-            pdf.output(file_path)
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл:\n{e}")
 
-    def open_brigade_usage_report_dialog(self, parent_dialog):
-        parent_dialog.accept()
+        state["worker"] = self.run_in_background(job, on_finished, "Ошибка генерации отчета",
+                                                 "Не удалось сгенерировать отчеты", tag="report",
+                                                 progress_parent=dialog, progress_text="Формирование отчетов...")
 
+    def open_journey_dialog(self):
         dialog = QDialog(self)
-        dialog.setWindowTitle("Настройки отчета: Используемость бригад")
-
-        # Диапазон времени отправления
-        date_range_label = QLabel("Диапазон времени отправления:")
-        self.start_date_edit = QDateTimeEdit(QDateTime.currentDateTime())
-        self.start_date_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
-        self.end_date_edit = QDateTimeEdit(QDateTime.currentDateTime())
-        self.end_date_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
-
-        # Минимальный стаж сотрудников
-        min_experience_label = QLabel("Минимальный стаж сотрудников:")
-        self.min_experience_edit = QSpinBox()
-        self.min_experience_edit.setMinimum(0)
-        self.min_experience_edit.setMaximum(100)
-        self.min_experience_edit.setValue(0)
-
-        # Сортировка
-        sort_label = QLabel("Сортировка:")
-        self.sort_combobox = QComboBox()
-        self.sort_combobox.addItems(["По количеству маршрутов", "По среднему стажу"])
+        dialog.setWindowTitle("Поиск поездки")
+        layout = QFormLayout(dialog)
 
-        # Кнопки
-        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
-        button_box.accepted.connect(lambda: self.generate_brigade_usage_report(dialog))
+        input_fields = {"origin": QComboBox(), "target": QComboBox()}
+        input_fields["after"] = QDateTimeEdit(QDateTime.currentDateTime())
+        input_fields["after"].setDisplayFormat("yyyy-MM-dd HH:mm")
+        input_fields["transfer"] = QSpinBox()
+        input_fields["transfer"].setMaximum(24 * 60)
+        input_fields["transfer"].setValue(MIN_TRANSFER_SECONDS // 60)
+        results = QListWidget()
+        results.setMinimumWidth(600)
+        layout.addRow("Откуда:", input_fields["origin"])
+        layout.addRow("Куда:", input_fields["target"])
+        layout.addRow("Отправление не раньше:", input_fields["after"])
+        layout.addRow("Пересадка не короче, мин:", input_fields["transfer"])
+        layout.addRow(results)
+
+        def on_ready(lookup_values):
+            for field, values in lookup_values.items():
+                input_fields[field].addItems(values)
+
+        self.load_lookups({"origin": ("stations", "name"), "target": ("stations", "name")}, on_ready)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        find_button = button_box.addButton("Найти", QDialogButtonBox.ButtonRole.ActionRole)
+        find_button.clicked.connect(lambda: self.find_journey(dialog, input_fields, results))
         button_box.rejected.connect(dialog.reject)
-
-        # Layout
-        layout = QFormLayout()
-        layout.addRow(date_range_label, self.start_date_edit)
-        layout.addRow("", self.end_date_edit)
-        layout.addRow(min_experience_label, self.min_experience_edit)
-        layout.addRow(sort_label, self.sort_combobox)
-        layout.addWidget(button_box)
-        dialog.setLayout(layout)
+        layout.addRow(button_box)
 
         dialog.exec()
 
-    def generate_brigade_usage_report(self, dialog):
-        start_date = self.start_date_edit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        end_date = self.end_date_edit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
-        min_experience = self.min_experience_edit.value()
-        sort_order = "route_count DESC, avg_experience_years DESC" if self.sort_combobox.currentText() == "По количеству маршрутов" else "avg_experience_years DESC, route_count DESC"
+    def find_journey(self, dialog, input_fields, results):
+        if self.timetable is None:
+            self.load_timetable(dialog, lambda: self.find_journey(dialog, input_fields, results))
+            return
 
-        # Формируем SQL запрос
-        query = f"""
-        SELECT 
-            b.name AS brigade_name,
-            COUNT(rb.route_code) AS route_count,
-            ROUND(AVG(s.experience_years), 2) AS avg_experience_years
-        FROM 
-            route_brigades rb
-        JOIN brigades b ON rb.brigade_code = b.brigade_code
-        JOIN staff s ON s.brigade_code = b.brigade_code
-        WHERE 
-            s.experience_years >= %s
-            AND rb.route_code IN (
-                SELECT route_code 
-                FROM routes 
-                WHERE departure_time BETWEEN %s AND %s
-            )
-        GROUP BY 
-            b.name
-        ORDER BY 
-            {sort_order};
-        """
+        # Поиск идет по массивам в памяти и занимает миллисекунды, поэтому не уходит в фон
+        timetable = self.timetable
+        origin = timetable.station_code(input_fields["origin"].currentText())
+        target = timetable.station_code(input_fields["target"].currentText())
+        if origin is None or target is None:
+            QMessageBox.warning(dialog, "Ошибка", "Выберите вокзалы отправления и прибытия.")
+            return
+        legs = timetable.earliest_arrival(origin, target, input_fields["after"].dateTime().toPyDateTime(),
+                                          input_fields["transfer"].value() * 60)
+        results.clear()
+        if not legs:
+            results.addItem("Поездка не найдена." if legs is None else "Вокзалы отправления и прибытия совпадают.")
+            return
+        results.addItems(timetable.describe(legs))
 
-        try:
-            # Выполняем SQL запрос с переданными параметрами
-            self.cursor.execute(query, (min_experience, start_date, end_date))
-            report_data = self.cursor.fetchall()
+        # Названия поездов дописываются, когда придут из базы
+        def job(connection):
+            with connection.cursor() as cursor:
+                return route_trains(cursor, {leg.route_code for leg in legs})
 
-            if not report_data:
-                QMessageBox.warning(self, "Нет данных", "Для заданного периода и фильтров данные отсутствуют.")
+        def on_finished(trains):
+            results.clear()
+            results.addItems(timetable.describe(legs, trains))
+
+        self.run_in_background(job, on_finished, "Ошибка поиска поездки", "Не удалось получить поезда маршрутов")
+
+    def load_timetable(self, dialog, on_loaded):
+        timetable = Timetable()
+        self.timetable_pending = []
+        state = {}
+
+        def is_cancelled():
+            worker = state.get("worker")
+            return worker is not None and worker.is_cancelled
+
+        def job(connection):
+            return timetable.load(connection, is_cancelled=is_cancelled)
+
+        def on_finished(loaded):
+            pending, self.timetable_pending = self.timetable_pending, None
+            if not loaded:
+                return
+            # Во время загрузки изменилось слишком много маршрутов: загруженное уже устарело
+            if pending is None:
+                self.load_timetable(dialog, on_loaded)
                 return
+            self.timetable = timetable
+            # Маршруты, измененные во время загрузки, перечитываются: повторное обновление безвредно
+            if pending:
+                self.refresh_timetable(pending)
+            on_loaded()
+
+        state["worker"] = self.run_in_background(job, on_finished, "Ошибка загрузки расписания",
+                                                 "Не удалось загрузить расписание маршрутов", tag="timetable",
+                                                 progress_parent=dialog, progress_text="Загрузка расписания...")
+
+    def on_timetable_changed(self, table, op, keys):
+        if table != "route_data" or (self.timetable is None and self.timetable_pending is None):
+            return
+        # Без ключей (слишком много строк) неизвестно, какие маршруты изменились:
+        # расписание загрузится заново при следующем поиске
+        if keys is None:
+            self.drop_timetable()
+            return
+        routes = list({(key["route_code"], key["route_departure_time"]) for key in keys})
+        if self.timetable_pending is not None:
+            self.timetable_pending += routes
+            return
+        self.refresh_timetable(routes)
 
-            # Создаем PDF файл
-            pdf_file_path = os.path.join(os.path.expanduser("~"), "Desktop", "brigade_usage_report.pdf")
-            self.create_brigade_usage_pdf(report_data, pdf_file_path)
+    def refresh_timetable(self, routes):
+        # Перестраиваются только сутки расписания, где есть перегоны измененных маршрутов
+        timetable = self.timetable
+        self.run_in_background(lambda connection: timetable.refresh(connection, routes), None,
+                               "Ошибка обновления расписания", "Не удалось обновить расписание маршрутов")
 
-            # Показываем сообщение об успешном сохранении
-            QMessageBox.information(self, "Отчет сформирован", f"Отчет сохранен на рабочем столе:\n{pdf_file_path}")
-            dialog.accept()
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка генерации отчета", f"Не удалось сгенерировать отчет:\n{e}")
-
-    def create_brigade_usage_pdf(self, data, file_path):
-        pdf = FPDF()
-        pdf.add_page()
-
-        # Пути к файлам шрифтов
-        font_dir = os.path.join(os.path.dirname(__file__), "fonts")
-        regular_font_path = os.path.join(font_dir, "timesnrcyrmt.ttf")
-        bold_font_path = os.path.join(font_dir, "timesnrcyrmt_bold.ttf")
-
-        # Подключение пользовательских шрифтов
-        pdf.add_font("TimesNewRoman", style="", fname=regular_font_path, uni=True)
-        pdf.add_font("TimesNewRoman", style="B", fname=bold_font_path, uni=True)
-
-        # Устанавливаем шрифт
-        pdf.set_font("TimesNewRoman", size=12)
-
-        # Заголовок
-        pdf.set_font("TimesNewRoman", style="B", size=16)
-        pdf.cell(0, 10, "Используемость бригад", ln=True, align="C")
-        pdf.ln(10)  # Отступ
-
-        # Заголовки таблицы
-        pdf.set_font("TimesNewRoman", style="B", size=12)
-        column_headers = ["Название бригады", "Количество маршрутов", "Средний стаж (годы)"]
-        column_widths = [70, 50, 60]
-
-        for i, header in enumerate(column_headers):
-            pdf.cell(column_widths[i], 10, header, border=1, align="C")
-        pdf.ln()
-
-        # Данные таблицы
-        pdf.set_font("TimesNewRoman", size=12)
-        for row in data:
-            for i, cell in enumerate(row):
-                pdf.cell(column_widths[i], 10, str(cell), border=1, align="C")
-            pdf.ln()
-
-        # Сохраняем файл
-        try:
-            pdf.output(file_path)
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл:\n{e}")
+    def drop_timetable(self):
+        self.timetable = None
+        self.timetable_pending = None
 
     def closeEvent(self, event):
-        if self.cursor:
-            self.cursor.close()
-        if self.db_connection:
-            self.db_connection.close()
+        if self.change_listener:
+            self.change_listener.stop()
+        self.executor.shutdown()
+        # Фоновые задачи завершены: поток строк закрываем сразу, до закрытия пула
+        if self.row_stream:
+            self.row_stream.close()
+            self.row_stream = None
+        if self.db:
+            self.db.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
         event.accept()
@@ -0,0 +1,162 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+import psycopg2
+import psycopg2.extensions
+
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+
+
+class QueryWorker(QRunnable):
+    # Выполняет job(connection) в пуле потоков, результат возвращается сигналами в поток интерфейса
+    def __init__(self, job, acquire, release, keep_connection=False, tag=None, readonly=True, uses_connection=True):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self.job = job
+        self.acquire = acquire
+        self.release = release
+        # Соединение остается за результатом (например, серверным курсором) и освобождается им самим
+        self.keep_connection = keep_connection
+        self.tag = tag
+        self.readonly = readonly
+        # Задача без соединения (job(None)) берет его сама, например поток строк для следующей страницы
+        self.uses_connection = uses_connection
+        self.connection = None
+        self.is_cancelled = False
+
+    def cancel(self):
+        # Задачу без соединения не отменяем: ее результат уже учтен источником
+        # (страница сдвинула позицию потока строк) и должен дойти до получателя
+        if not self.uses_connection:
+            return
+        self.is_cancelled = True
+        connection = self.connection
+        if connection is not None and not connection.closed:
+            try:
+                # Отменяем выполняющийся запрос на сервере
+                connection.cancel()
+            except psycopg2.Error:
+                pass
+
+    def run(self):
+        if self.is_cancelled:
+            self.signals.cancelled.emit()
+            return
+
+        if not self.uses_connection:
+            try:
+                result = self.job(None)
+            except Exception as e:
+                self.signals.failed.emit(e)
+                return
+            self.signals.finished.emit(result)
+            return
+
+        result = None
+        # Читающая задача повторяется один раз, если соединение оборвалось во время запроса
+        attempts = 2 if self.readonly else 1
+        for attempt in range(attempts):
+            succeeded = False
+            try:
+                self.connection = self.acquire(self.readonly)
+                if self.is_cancelled:
+                    raise psycopg2.extensions.QueryCanceledError("canceled before start")
+                result = self.job(self.connection)
+                succeeded = True
+            except psycopg2.extensions.QueryCanceledError:
+                self.is_cancelled = True
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                dropped = self.connection is not None and self.connection.closed
+                if not self.is_cancelled and not (dropped and attempt + 1 < attempts):
+                    self._release_connection(False)
+                    self.signals.failed.emit(e)
+                    return
+            except Exception as e:
+                if not self.is_cancelled:
+                    self._release_connection(False)
+                    self.signals.failed.emit(e)
+                    return
+            self._release_connection(succeeded)
+            if succeeded or self.is_cancelled:
+                break
+
+        if self.is_cancelled:
+            discard_result(result)
+            self.signals.cancelled.emit()
+        else:
+            self.signals.finished.emit(result)
+
+    def _release_connection(self, succeeded):
+        connection, self.connection = self.connection, None
+        if connection is not None and not (succeeded and self.keep_connection):
+            self.release(connection)
+
+
+def discard_result(result):
+    # Результат, владеющий ресурсами (соединением, курсором), закрываем, если он больше не нужен
+    close = getattr(result, "close", None)
+    if close is not None:
+        close()
+
+
+class QueryExecutor(QObject):
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, acquire, release, max_threads=4, parent=None):
+        super().__init__(parent)
+        self.acquire = acquire
+        self.release = release
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.active = []
+
+    def submit(self, job, on_finished, on_failed=None, tag=None, keep_connection=False, on_done=None, readonly=True,
+               uses_connection=True):
+        # Новая задача с тем же тегом заменяет предыдущую (например, загрузка другой таблицы)
+        if tag is not None:
+            self.cancel(tag)
+
+        worker = QueryWorker(job, self.acquire, self.release, keep_connection, tag, readonly, uses_connection)
+        worker.signals.finished.connect(lambda result: self._finish(worker, on_done, on_finished, result))
+        worker.signals.failed.connect(lambda error: self._finish(worker, on_done, on_failed, error, False))
+        worker.signals.cancelled.connect(lambda: self._finish(worker, on_done, None, None, False))
+
+        self.active.append(worker)
+        if len(self.active) == 1:
+            self.busy_changed.emit(True)
+        self.pool.start(worker)
+        return worker
+
+    def cancel(self, tag=None):
+        for worker in list(self.active):
+            if tag is None or worker.tag == tag:
+                worker.cancel()
+
+    def is_busy(self):
+        return bool(self.active)
+
+    def shutdown(self, timeout_ms=3000):
+        self.cancel()
+        self.pool.waitForDone(timeout_ms)
+
+    def _finish(self, worker, on_done, callback, value, is_result=True):
+        if worker not in self.active:
+            return
+        self.active.remove(worker)
+        if not self.active:
+            self.busy_changed.emit(False)
+
+        if on_done:
+            on_done()
+
+        # Задачу отменили, пока результат шел в поток интерфейса
+        if worker.is_cancelled:
+            if is_result:
+                discard_result(value)
+            return
+
+        if callback:
+            callback(value)